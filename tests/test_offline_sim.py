@@ -0,0 +1,723 @@
+# 离线替身冒烟测试：在 PTrade 替身上加载 vagird.py 并跑完一个交易日
+import json
+import pathlib
+
+import pytest
+
+from tools.ptrade_sim import BarStore, PTradeAPI, SimRunner, load_strategy, prepare_research_dir
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _cfg(n=3):
+    full = json.loads((ROOT / 'config' / 'symbols.json').read_text(encoding='utf-8'))
+    return dict(list(full.items())[:n])
+
+
+def _api(tmp_path):
+    return PTradeAPI(BarStore.from_config(_cfg(1), days=1, seed=3), tmp_path)
+
+
+def _strategy(tmp_path, api=None):
+    """单标的替身上加载策略模块 (不跑 initialize)，供组件/纯函数测试。"""
+    return load_strategy(ROOT / 'vagird.py', api or _api(tmp_path))
+
+
+def _runner(tmp_path, cfg, days=1):
+    prepare_research_dir(tmp_path, cfg)
+    api = PTradeAPI(BarStore.from_config(cfg, days=days, seed=3), tmp_path)
+    return SimRunner(load_strategy(ROOT / 'vagird.py', api), api, interval=False)
+
+
+def test_strategy_runs_one_day_offline(tmp_path):
+    cfg = _cfg()
+    runner = _runner(tmp_path, cfg).run()
+    s = runner.summary()
+    assert s['ticks'] == 240
+    assert s['orders'] > 0
+    assert s['api_calls_total']['get_snapshot'] == 240
+    for sym in cfg:
+        assert (tmp_path / 'state' / f'{sym}.json').exists()
+
+
+def test_matching_engine_partial_fill_delay_and_bands():
+    from datetime import datetime, timedelta
+
+    from tools.matching import MatchConfig, MatchingEngine
+    from tools.ptrade_sim import SimBroker
+
+    now = datetime(2025, 1, 6, 10, 0)
+    broker = SimBroker(lambda: now)
+    eng = MatchingEngine(broker, limits=lambda s: (1.10, 0.90),
+                         config=MatchConfig(partial_prob=1.0, push_delay=3.0))
+    with pytest.raises(RuntimeError, match='120162'):
+        eng.check_order('510300.SS', 100, 1.20)
+
+    eid = broker.place('510300.SS', 400, 1.0)
+    eng.match(now, {'510300.SS': 0.99})
+    assert eng.pop_due(now) == []
+    first = eng.pop_due(now + timedelta(seconds=3))
+    assert [p['status'] for p in first] == ['7'] and first[0]['business_amount'] == 200
+    eng.match(now, {'510300.SS': 0.99})
+    eng.match(now, {'510300.SS': 0.99})
+    rest = eng.pop_due(now + timedelta(seconds=3))
+    assert [p['status'] for p in rest] == ['7', '8']
+    assert broker.orders[eid].filled == 400 and broker.position('510300.SS').amount == 400
+
+
+def test_replay_reproduces_recorded_run(tmp_path):
+    from tools.matching import MatchConfig
+    from tools.replay import build_replay, diff_states
+
+    cfg = _cfg()
+    live = tmp_path / 'live'
+    prepare_research_dir(live, cfg, {'strategy.json': {'replay': {'record': True}}})
+    api = PTradeAPI(BarStore.from_config(cfg, days=1, seed=5, daily_vol=0.03), live,
+                    match_config=MatchConfig(partial_prob=0.3, push_delay=2, drop_prob=0.1, seed=1))
+    SimRunner(load_strategy(ROOT / 'vagird.py', api), api).run()
+    assert list((live / 'replay').glob('*.jsonl'))
+
+    outs = []
+    for name in ('a', 'b'):
+        driver = build_replay(live / 'replay', tmp_path / name).run()
+        assert driver.api.diverged_orders == 0
+        outs.append(tmp_path / name)
+    assert diff_states(*outs) == []
+    assert diff_states(live, outs[0]) == []
+
+
+def test_injected_clock_drives_time_windows(tmp_path):
+    from datetime import datetime
+
+    cfg = _cfg(1)
+    prepare_research_dir(tmp_path, cfg)
+    api = PTradeAPI(BarStore.from_config(cfg, days=1, seed=3), tmp_path)
+    strat = load_strategy(ROOT / 'vagird.py', api)
+    assert strat.CLOCK is api
+
+    clock = strat.set_clock(strat.SimClock(datetime(2025, 1, 6, 9, 20)))
+    assert strat.is_auction_time() and not strat.is_main_trading_time()
+    clock.sleep(6 * 60)
+    assert strat.is_order_blocking_period()
+    clock.set(datetime(2025, 1, 6, 13, 5))
+    assert strat.is_main_trading_time()
+    assert isinstance(strat.set_clock(None), strat.WallClock)
+
+
+def test_vector_backtest_matches_bar_by_bar(tmp_path):
+    from datetime import datetime, time
+
+    from tools.backtest import BacktestData, VectorBacktest, atr_tables
+    from tools.ptrade_sim import SimContext
+
+    cfg = _cfg(4)
+    store = BarStore.from_config(cfg, days=3, seed=3)
+    tables = atr_tables(BacktestData.from_bar_store(store))
+    prepare_research_dir(tmp_path, cfg)
+    api = PTradeAPI(store, tmp_path)
+    strat = load_strategy(ROOT / 'vagird.py', api)
+    ctx = SimContext(api)
+    for d, day in enumerate(store.days):
+        api.set_time(datetime.combine(day, time(10, 0)))
+        for i, sym in enumerate(store.symbols):
+            ctx.state = {sym: {}}
+            assert abs(strat.calculate_grid_atr(ctx, sym) - tables['grid'][d, i]) < 1e-12
+            assert abs(strat.calculate_macro_atr(ctx, sym) - tables['macro'][d, i]) < 1e-12
+
+    data = BacktestData.from_config(cfg, years=0.1, freq='1m', seed=5, daily_vol=0.02)
+    fast = VectorBacktest(data, cfg).run()
+    full = VectorBacktest(data, cfg, skip=False).run()
+    assert fast.fills and fast.steps * 5 < full.steps
+    assert fast.fills == full.fills
+    assert fast.per_symbol == full.per_symbol
+
+
+def test_parameter_sweep_ranks_combinations(tmp_path):
+    from tools.backtest import BacktestData
+    from tools.sweep import apply_params, parse_params, run_sweep
+
+    cfg = _cfg(3)
+    grid = parse_params(['grid_unit=x2', 'max_grid_count=6,12', 'market.max_stack_size=3'])
+    sym_cfg, strat_cfg = apply_params(cfg, {'grid_unit': 'x2', 'market.max_stack_size': 3})
+    assert strat_cfg == {'market': {'max_stack_size': 3}}
+    assert all(sym_cfg[s]['grid_unit'] == max(100, cfg[s]['grid_unit'] * 2) for s in cfg)
+
+    data = BacktestData.from_config(cfg, years=0.2, freq='1d', seed=2)
+    table = run_sweep(grid, cfg, data, tmp_path, workers=2)
+    assert len(table) == 2 and list(table['total_pnl']) == sorted(table['total_pnl'], reverse=True)
+    assert (tmp_path / 'ranked.csv').exists()
+    assert len((tmp_path / 'results.jsonl').read_text(encoding='utf-8').splitlines()) == 2
+
+
+def test_state_writes_are_coalesced_and_atomic(tmp_path):
+    from datetime import timedelta
+
+    cfg = _cfg(1)
+    sym = next(iter(cfg))
+    runner = _runner(tmp_path, cfg)
+    runner.initialize()
+    strat, api, state = runner.strategy, runner.api, runner.context.state[sym]
+    path = tmp_path / 'state' / f'{sym}.json'
+    strat.safe_save_state(sym, state, sync=True)
+    assert '\n' not in path.read_text(encoding='utf-8')
+
+    state['history_pnl'] = 1.5
+    strat.safe_save_state(sym, state)
+    strat.flush_states()
+    assert json.loads(path.read_text(encoding='utf-8'))['history_pnl'] != 1.5
+    api.set_time(api.now_dt + timedelta(seconds=strat.StrategyConfig.PERSIST.FLUSH_SEC))
+    strat.flush_states()
+    assert json.loads(path.read_text(encoding='utf-8'))['history_pnl'] == 1.5
+
+    state['history_pnl'] = 2.5
+    strat.safe_save_state(sym, state, sync=True)
+    assert json.loads(path.read_text(encoding='utf-8'))['history_pnl'] == 2.5
+    assert not list((tmp_path / 'state').glob('*.tmp'))
+
+
+def test_journal_restores_fills_after_crash(tmp_path):
+    cfg = _cfg(1)
+    sym = next(iter(cfg))
+    runner = _runner(tmp_path, cfg)
+    runner.initialize()
+    strat, state = runner.strategy, runner.context.state[sym]
+    strat.safe_save_state(sym, state, sync=True)
+    snapshot = (tmp_path / 'state' / f'{sym}.json').read_text(encoding='utf-8')
+
+    price = round(state['base_price'] * 0.99, 3)
+    strat.on_trade_response(runner.context, [
+        {'entrust_no': '801', 'business_id': '9001', 'business_amount': 100, 'business_price': price,
+         'stock_code': sym, 'entrust_bs': '1', 'status': '7'},
+        {'entrust_no': '801', 'business_id': '9002', 'business_amount': 100, 'business_price': price,
+         'stock_code': sym, 'entrust_bs': '1', 'status': '8'},
+    ])
+    # 成交只进日志，快照未动；模拟崩溃：不 flush，末行写了一半
+    journal = tmp_path / 'state' / f'{sym}.journal'
+    assert (tmp_path / 'state' / f'{sym}.json').read_text(encoding='utf-8') == snapshot
+    with journal.open('a', encoding='utf-8') as fh:
+        fh.write('{"n":999,"s":{"base_price"')
+
+    api2 = PTradeAPI(BarStore.from_config(cfg, days=1, seed=3), tmp_path)
+    runner2 = SimRunner(load_strategy(ROOT / 'vagird.py', api2), api2, interval=False)
+    runner2.initialize()
+    st2 = runner2.context.state[sym]
+    for key in ('buy_stack', 'sell_stack', 'history_pnl', 'base_price', '_fill_tracker', 'filled_order_ids', '_journal_seq'):
+        assert st2[key] == state[key], key
+    assert st2['_fill_tracker']['801'] == 200 and '801' in st2['filled_order_ids']
+
+    runner2.strategy.flush_states(force=True)
+    assert journal.read_text(encoding='utf-8') == ''
+    assert json.loads((tmp_path / 'state' / f'{sym}.json').read_text(encoding='utf-8'))['_journal_seq'] == st2['_journal_seq']
+
+
+def test_atr_is_cached_per_trading_day(tmp_path):
+    cfg = _cfg(3)
+    runner = _runner(tmp_path, cfg).run()
+    strat, api, ctx = runner.strategy, runner.api, runner.context
+    today = ctx.current_dt.strftime('%Y-%m-%d')
+    assert {k for k in strat.ATR_CACHE if k[1] == today} == {(s, today, 14) for s in cfg}
+    assert {k for k in strat.MACRO_ATR_CACHE if k[1] == today} == {(s, today, 60) for s in cfg}
+
+    before = api.calls['get_history']
+    rates = [f(ctx, s) for f in (strat.calculate_grid_atr, strat.calculate_macro_atr) for s in cfg for _ in range(3)]
+    assert api.calls['get_history'] == before and all(r and r > 0 for r in rates)
+    # 刷新单个标的：网格 1 次 + 宏观批量 1 次
+    strat.refresh_atr_cache(ctx, [next(iter(cfg))])
+    assert api.calls['get_history'] == before + 2
+
+
+def test_macro_atr_keeps_symbols_with_suspended_days(tmp_path):
+    import numpy as np
+    import pandas as pd
+    strat = _strategy(tmp_path)
+    rng = np.random.default_rng(5)
+    close = 1.0 + np.cumsum(rng.normal(0, 0.01, 80))
+    frame = lambda c: pd.DataFrame({'high': c * 1.01, 'low': c * 0.99, 'close': c})
+    hist = {'A': frame(close), 'B': frame(close)}
+    hist['B'].iloc[[30, 31]] = np.nan      # 停牌两天：PTrade 默认填 NaN
+    strat.get_history = lambda *a, **kw: hist
+    rates = strat._macro_atr_batch(['A', 'B'], 60)
+    for sym in ('A', 'B'):
+        assert rates[sym] is not None and rates[sym] > 0
+        assert abs(rates[sym] - strat._macro_atr_frame(hist[sym], 60)) < 1e-12
+
+
+def test_va_schedule_matches_weekly_sum(tmp_path):
+    strat = _strategy(tmp_path)
+    for base, rate in ((1000, 0.0), (1500, 0.002), (800.5, 0.01)):
+        for weeks in (520, 0, 1, 37, 260):
+            assert strat.va_accumulated(base, rate, weeks) == sum(base * (1 + rate) ** w for w in range(1, weeks + 1))
+    state = {'initial_position_value': 50000.0, 'dingtou_base': 1500, 'dingtou_rate': 0.002}
+    assert strat.va_target_value(state, 10) == 50000.0 + strat.va_accumulated(1500, 0.002, 10)
+    assert strat.va_target_shares(state, 10, 1.234) == int(strat.va_target_value(state, 10) / 1.234 / 100) * 100
+
+
+def test_account_view_serves_tick_from_one_fetch(tmp_path):
+    cfg = _cfg(5)
+    runner = _runner(tmp_path, cfg).run()
+    calls, ticks = runner.api.calls, runner.summary()['ticks']
+    assert (calls['get_position'] + calls['get_positions'] + calls['get_open_orders']) / ticks < 4
+
+    strat, ctx = runner.strategy, runner.context
+    sym = next(iter(cfg))
+    strat.ACCOUNT.begin(ctx.symbol_list)
+    try:
+        n0 = len(strat.ACCOUNT.open_orders(sym))
+        before = calls['get_open_orders']
+        strat.ACCOUNT.open_orders(sym)
+        assert calls['get_open_orders'] == before
+        strat._place_order(ctx, sym, 100, round(ctx.latest_data[sym] * 0.97, 3))
+        assert len(strat.ACCOUNT.open_orders(sym)) == n0 + 1
+    finally:
+        strat.ACCOUNT.end()
+
+
+def test_perf_metrics_account_for_phases_and_api_calls(tmp_path):
+    cfg = _cfg(3)
+    runner = _runner(tmp_path, cfg).run()
+    strat = runner.strategy
+    strat.after_trading_end(runner.context, None)
+    perf = json.loads((tmp_path / 'reports' / 'perf_metrics.json').read_text(encoding='utf-8'))
+    assert perf['phases']['tick']['count'] == runner.summary()['ticks']
+    assert {'quotes', 'macro_va', 'place', 'recover', 'flush'} <= set(perf['phases'])
+    assert perf['apis']['get_snapshot']['count'] == runner.api.calls['get_snapshot']
+    assert perf['phases']['quotes']['api_calls']['get_snapshot'] == runner.api.calls['get_snapshot']
+    assert set(perf['symbols']) == set(cfg)
+    assert 0 <= perf['phases']['tick']['p50_ms'] <= perf['phases']['tick']['p99_ms']
+    assert '运行监控' in strat.PERF.render_html()
+
+
+def test_async_logger_batches_rotates_and_gates_debug(tmp_path):
+    from datetime import datetime
+
+    api = _api(tmp_path)
+    strat = _strategy(tmp_path, api)
+    api.set_time(datetime(2025, 1, 6, 23, 59, 59))
+    strat.info('第一天 {}', 1)
+    api.set_time(datetime(2025, 1, 7, 0, 0, 1))
+    strat.info('第二天 {}', 2, flush=True)
+    assert strat.LOG_THREAD.is_alive()
+    day1 = (tmp_path / 'logs' / '2025-01-06_strategy.log').read_text(encoding='utf-8')
+    day2 = (tmp_path / 'logs' / '2025-01-07_strategy.log').read_text(encoding='utf-8')
+    assert day1.endswith('INFO - 第一天 1\n') and day2.endswith('INFO - 第二天 2\n')
+
+    class Boom:
+        def __format__(self, spec):
+            raise AssertionError('debug 关闭时不应格式化')
+
+    strat.StrategyConfig.DEBUG.ENABLE = False
+    strat.debug('调试 {}', Boom())
+    strat.log_flush()
+    assert (tmp_path / 'logs' / '2025-01-07_strategy.log').read_text(encoding='utf-8') == day2
+
+
+def test_sync_log_writes_are_serialized_across_threads(tmp_path):
+    import threading
+    from datetime import datetime
+
+    strat = _strategy(tmp_path)
+    strat.StrategyConfig.LOGGING.ASYNC = False
+    days = (datetime(2025, 1, 6, 23, 59), datetime(2025, 1, 7, 0, 1))
+
+    def writer(tag):
+        # 两个线程交替写两天的记录，每条都会触发日切 (关闭并重开 LOG_FH)
+        for i in range(1000):
+            strat._write_log_locked([(days[i % 2], 'INFO', f'{tag}{i}')])
+        for _ in range(50): strat._log_dropped()
+
+    threads = [threading.Thread(target=writer, args=(tag,)) for tag in 'ab']
+    for t in threads: t.start()
+    for t in threads: t.join()
+    lines = sum(len((tmp_path / 'logs' / f'{d:%Y-%m-%d}_strategy.log').read_text(encoding='utf-8').splitlines()) for d in days)
+    assert lines == 2000 and strat.LOG_DROPPED == 100
+
+
+def test_event_stream_index_seeks_to_time_window(tmp_path):
+    from datetime import datetime
+
+    from tools.events import load_index, query_events
+
+    api = _api(tmp_path)
+    strat = _strategy(tmp_path, api)
+    for minute, sym, etype in [(31, 'A.SS', 'guard'), (31, 'B.SZ', 'fill'), (45, 'A.SS', 'fill'),
+                               (45, 'B.SZ', 'ratchet'), (59, 'A.SS', 'fill')]:
+        api.set_time(datetime(2025, 1, 6, 9, minute, 5))
+        strat.emit_event(etype, sym, price=1.234, qty=100)
+    strat.info('落盘', flush=True)
+
+    path = tmp_path / 'events' / '2025-01-06.jsonl'
+    minutes, offsets = load_index(path.with_suffix('.idx'))
+    assert minutes == ['09:31', '09:45', '09:59']
+    raw = path.read_bytes()
+    assert json.loads(raw[offsets[1]:].split(b'\n')[0]) == {
+        'ts': '2025-01-06 09:45:05', 't': 'fill', 's': 'A.SS', 'price': 1.234, 'qty': 100}
+
+    hits = query_events(tmp_path, symbols=['A.SS'], types=['fill'], start='2025-01-06 09:40', end='2025-01-06 09:50')
+    assert [e['ts'] for e in hits] == ['2025-01-06 09:45:05']
+    assert len(query_events(tmp_path, start='2025-01-06')) == 5
+
+    strat.StrategyConfig.EVENTS.ENABLE = False
+    strat.emit_event('fill', 'A.SS')
+    strat.log_flush()
+    assert path.read_bytes() == raw
+
+
+def test_pnl_ledger_consumes_only_new_trades(tmp_path):
+    from datetime import datetime
+    from types import SimpleNamespace
+
+    strat = _strategy(tmp_path)
+    day1 = [('2025-01-06 10:00:00', 'A.SS', 1000, 1.0, 500), ('2025-01-06 10:30:00', 'B.SZ', 200, 2.0, 0),
+            ('2025-01-06 11:00:00', 'A.SS', -300, 1.1, 500)]
+    day2 = [('2025-01-07 10:00:00', 'A.SS', -400, 1.2, 500), ('2025-01-07 10:05:00', 'B.SZ', -200, 2.1, 0)]
+
+    def add(rows):
+        for t, sym, qty, price, base in rows:
+            strat.TRADES.append(datetime.fromisoformat(t), sym, qty, price, base, 'x')
+
+    def ctx():
+        return SimpleNamespace(symbol_list=['A.SS'], pnl_metrics={}, pnl_metrics_path=tmp_path / 'pnl.json',
+                               state={'A.SS': {'initial_base_position': 0, 'base_price': 1.0, 'base_position': 500}})
+
+    c = ctx()
+    add(day1)
+    strat._calculate_local_pnl_lifo(c)
+    assert c.pnl_metrics['A.SS']['realized_grid_pnl'] == pytest.approx(30.0)
+    add(day2)
+    strat._calculate_local_pnl_lifo(c)
+    ledger = json.loads((tmp_path / 'state' / 'pnl_ledger.json').read_text(encoding='utf-8'))
+    assert ledger['cursor'] == {'2025-01': 5}
+    # 增量多次 (含中途加入的标的) == 一次性全量
+    c.symbol_list.append('B.SZ')
+    c.state['B.SZ'] = {'initial_base_position': 0, 'base_price': 2.0, 'base_position': 0}
+    strat._calculate_local_pnl_lifo(c)
+    incremental = c.pnl_metrics
+    (tmp_path / 'state' / 'pnl_ledger.json').unlink()
+    c2 = ctx()
+    c2.symbol_list.append('B.SZ')
+    c2.state['B.SZ'] = c.state['B.SZ']
+    strat._calculate_local_pnl_lifo(c2)
+    assert c2.pnl_metrics == incremental
+    assert incremental['A.SS']['realized_grid_pnl'] == pytest.approx(30.0 + 40.0)
+    assert incremental['A.SS']['realized_base_pnl'] == pytest.approx(40.0)
+    assert incremental['B.SZ']['realized_grid_pnl'] == pytest.approx(20.0)
+
+
+def test_trade_store_imports_csv_and_queries_by_symbol_and_date(tmp_path):
+    from datetime import datetime
+
+    strat = _strategy(tmp_path)
+    (tmp_path / 'reports').mkdir(exist_ok=True)
+    csv = tmp_path / 'reports' / 'a_trade_details.csv'
+    csv.write_text(strat.TRADE_CSV_HEADER + '2024-12-30 10:00:00,A.SS,BUY,1000,1.000,500,7\n'
+                   '2024-12-31 14:00:00,B.SZ,SELL,200,2.000,0,8\n', encoding='utf-8')   # 旧版卖出记正数
+    store = strat.TRADES
+    assert store.months() == ['2024-12']                       # 首次启用导入历史 CSV
+    with open(tmp_path / 'trades' / '2024-12.bin', 'ab') as f:
+        f.write(b'\0' * 5)                                    # 崩溃留下的半条记录
+    store.append(datetime(2025, 1, 6, 9, 31), 'A.SS', -300, 1.1, 500, '9')
+    store.append(datetime(2024, 12, 31, 14, 30), 'A.SS', 100, 1.05, 500, '10')
+    assert store._buf and csv.read_text(encoding='utf-8').count('\n') == 3
+    strat.flush_states()
+    assert store.count('2024-12') == 3 and store.count('2025-01') == 1
+    assert csv.read_text(encoding='utf-8').count('\n') == 5
+
+    a = store.query('A.SS')
+    assert a['qty'].tolist() == [1000.0, 100.0, -300.0] and a['entrust_no'].tolist() == [b'7', b'10', b'9']
+    assert store.query('A.SS', '2024-12-31', '2024-12-31')['price'].tolist() == [1.05]
+    assert store.query(None, '2024-12-31 14:00', '2025-01-06')['sid'].tolist() == [store.sid('B.SZ'), 0, 0]
+    assert len(store.query('C.SS')) == 0
+    assert store.query('B.SZ')['qty'].tolist() == [-200.0]
+
+    store.append(datetime(2025, 1, 7, 10, 0), 'B.SZ', -1500000, 2.0, 0, '11')
+    strat.flush_states()
+    assert csv.read_text(encoding='utf-8').splitlines()[-1] == '2025-01-07 10:00:00,B.SZ,SELL,-1500000,2.000,0,11'
+
+
+def test_dashboard_reuses_compiled_template_and_unchanged_rows(tmp_path):
+    import os
+
+    cfg = _cfg(3)
+    runner = _runner(tmp_path, cfg)
+    tpl = tmp_path / 'config' / 'dashboard_template.html'
+    tpl.write_text('<style>td{color:red}</style><body>{update_time}<table>{g1_rows}{g2_rows}{g3_rows}</table></body>',
+                   encoding='utf-8')
+    runner.run()
+    strat, ctx = runner.strategy, runner.context
+    out = tmp_path / 'reports' / 'strategy_dashboard.html'
+
+    strat.generate_html_report(ctx)
+    assert strat.REPORTER.wait(5)
+    assert strat.DASHBOARD.rebuilt == 0                        # 盘中每分钟已渲染过，输入未变
+    html = out.read_text(encoding='utf-8')
+    assert html.startswith('<style>td{color:red}</style><body>') and '运行监控' in html   # 无槽位时补在 </body> 前
+    sym = next(iter(cfg))
+    ctx.state[sym]['buy_stack'].push(0.5, 100)
+    strat.generate_html_report(ctx)
+    assert strat.REPORTER.wait(5)
+    assert strat.DASHBOARD.rebuilt == 1 and '0.500(100股)' in out.read_text(encoding='utf-8')
+
+    tpl.write_text('<p>{total_market_value}</p>', encoding='utf-8')
+    os.utime(tpl, (tpl.stat().st_atime, tpl.stat().st_mtime + 5))
+    strat.StrategyConfig.PERF.ENABLE = False
+    strat.generate_html_report(ctx)
+    assert strat.REPORTER.wait(5)
+    assert out.read_text(encoding='utf-8').startswith('<p>') and strat.DASHBOARD.rebuilt == 0
+
+
+def test_reports_run_on_background_worker_from_snapshot(tmp_path):
+    import threading
+
+    cfg = _cfg(3)
+    runner = _runner(tmp_path, cfg)
+    (tmp_path / 'config' / 'dashboard_template.html').write_text('<body>{update_time}{g1_rows}{g2_rows}{g3_rows}</body>',
+                                                                 encoding='utf-8')
+    runner.run()
+    strat, ctx = runner.strategy, runner.context
+    sym = next(iter(cfg))
+
+    snap = strat._report_snapshot(ctx)
+    ctx.state[sym]['buy_stack'].push(0.5, 100)
+    assert (0.5, 100) not in snap.state[sym]['buy_stack'] and 'wm_map' not in snap.state[sym]
+
+    gate = threading.Event()
+    strat.REPORTER.submit('block', gate.wait, 5)
+    before = strat.REPORTER.coalesced
+    strat.generate_html_report(ctx)
+    strat.generate_html_report(ctx)                             # 未开工的同类任务只保留最新快照
+    assert strat.REPORTER.coalesced == before + 1
+    assert not strat.REPORTER.wait(0.05)                        # 交易线程不等报表
+    gate.set()
+    assert strat.REPORTER.wait(5)
+    assert '0.500(100股)' in (tmp_path / 'reports' / 'strategy_dashboard.html').read_text(encoding='utf-8')
+
+    strat.after_trading_end(ctx, None)                          # 盘后等后台收尾
+    assert (tmp_path / 'reports' / f'{sym}.csv').exists()
+    assert set(json.loads((tmp_path / 'state' / 'pnl_metrics.json').read_text(encoding='utf-8'))) == set(cfg)
+    assert set(ctx.pnl_metrics) == set(cfg)
+
+
+def test_dashboard_feed_writes_snapshot_and_downsampled_series(tmp_path):
+    cfg = _cfg(3)
+    runner = _runner(tmp_path, cfg)
+    runner.run()
+    strat, ctx = runner.strategy, runner.context
+    reports = tmp_path / 'reports'
+
+    doc = json.loads((reports / 'dashboard.json').read_text(encoding='utf-8'))
+    assert list(doc['symbols']) == list(cfg) and doc['cols'] == list(strat.FEED_COLS)
+    assert (reports / 'dashboard_live.html').read_text(encoding='utf-8') == strat.DASH_LIVE_PAGE
+    series = reports / doc['series']
+    lines = series.read_text(encoding='ascii').splitlines()
+    buckets = [json.loads(x)['t'] for x in lines]
+    assert buckets == sorted(set(buckets)) and all(int(t[-2:]) % strat.StrategyConfig.REPORT.SERIES_MIN == 0 for t in buckets)
+    assert 48 <= len(lines) <= 55                                # 4 小时盘中 + 盘前盘后，5 分钟一桶
+    sym = next(iter(cfg))
+    last = json.loads(lines[-1])['d'][sym]
+    assert len(last) == len(strat.FEED_COLS) and last[1] == doc['symbols'][sym]['position']
+
+    # 同一时间桶不重复记点；重启后从文件尾恢复，并截掉崩溃留下的半行
+    strat.generate_html_report(ctx)
+    assert strat.REPORTER.wait(5) and len(series.read_text(encoding='ascii').splitlines()) == len(lines)
+    with open(series, 'ab') as f:
+        f.write(b'{"t":"20')
+    feed = strat.DashboardFeed()
+    assert feed._recover(series) == buckets[-1] and series.read_text(encoding='ascii').splitlines() == lines
+
+    strat.StrategyConfig.REPORT.HTML = False
+    (reports / 'strategy_dashboard.html').unlink(missing_ok=True)
+    (tmp_path / 'config' / 'dashboard_template.html').write_text('<body>{update_time}</body>', encoding='utf-8')
+    strat.generate_html_report(ctx)
+    assert strat.REPORTER.wait(5) and not (reports / 'strategy_dashboard.html').exists()
+
+
+def test_intraday_metrics_stream_from_snapshots_and_warm_up_once(tmp_path):
+    import numpy as np
+
+    cfg = _cfg(3)
+    runner = _runner(tmp_path, cfg)
+    runner.run()
+    strat, ctx, api = runner.strategy, runner.context, runner.api
+    bars = api.bars
+
+    def expected(sym, n):
+        c = bars.minute_px[0, :n, bars.sym_index[sym]]
+        rv = float(np.abs(np.log(c[1:] / c[:-1])).sum())
+        ret = float((c[-1] - c[0]) / c[0])
+        return rv, ret
+
+    for sym in cfg:
+        m = ctx.intraday_metrics[sym]
+        rv, ret = expected(sym, 240)
+        assert m['rv'] == pytest.approx(rv) and m['daily_return'] == pytest.approx(ret)
+        assert m['efficiency'] == pytest.approx(rv / max(abs(ret), 0.0001))
+
+    # 盘中重启：首次见到标的时一次性回放当日分钟线，之后只靠快照推进
+    from datetime import datetime, time as dtime
+    from types import SimpleNamespace
+
+    calls, clock = [], strat.CLOCK
+    real = strat.get_history
+    strat.get_history = lambda *a, **kw: calls.append(a) or real(*a, **kw)
+    strat.INTRADAY_RV.clear()
+    ctx.intraday_day = None
+    t = datetime.combine(bars.days[0], dtime(10, 30))
+    for k, now in enumerate((t, t.replace(minute=31))):
+        api.now_dt = ctx.current_dt = now
+        strat.set_clock(SimpleNamespace(now=lambda now=now: now, sleep=lambda s: None))
+        strat._update_intraday_metrics(ctx, {sym: float(bars.price_vector(now)[bars.sym_index[sym]]) for sym in cfg})
+    strat.set_clock(clock)
+    assert len(calls) == 1 and calls[0][1] == '1m'
+    for sym in cfg:
+        rv, ret = expected(sym, 61)                               # 09:31 ~ 10:31 共 61 根
+        assert ctx.intraday_metrics[sym]['rv'] == pytest.approx(rv)
+        assert ctx.intraday_metrics[sym]['daily_return'] == pytest.approx(ret)
+
+
+def test_price_ladder_keeps_heap_semantics_and_json_format(tmp_path):
+    import heapq
+    import random
+
+    strat = _strategy(tmp_path)
+    Ladder = strat.PriceLadder
+
+    # 与旧的 heapq 列表口径逐步比对：栈顶最小、远端最大、同价合并
+    rng = random.Random(5)
+    ladder, ref = Ladder(), {}
+    for _ in range(3000):
+        op = rng.random()
+        if op < 0.5 or not ref:
+            v, q = round(rng.uniform(-3, 3), 3), rng.randint(1, 9) * 100
+            ladder.push(v, q)
+            ref[v] = ref.get(v, 0) + q
+        elif op < 0.7:
+            v = min(ref)
+            assert ladder.pop_top() == (v, ref.pop(v))
+        elif op < 0.85:
+            v = max(ref)
+            assert ladder.pop_far() == (v, ref.pop(v))
+        else:
+            v = min(ref)
+            take = min(ref[v], 100)
+            ladder.consume_top(take)
+            ref[v] -= take
+            if not ref[v]: del ref[v]
+        assert len(ladder) == len(ref) and (not ref or ladder.top() == (min(ref), ref[min(ref)]))
+    assert list(ladder) == sorted(ref.items())
+    assert ladder.items(reverse=True, limit=3) == heapq.nlargest(3, ref.items())
+    assert len(ladder._lo) <= 2 * len(ladder) + 17                 # 惰性删除的残留会被压实
+
+    # 旧状态文件 (堆数组顺序 / 只有价格) 原样读入，写出按键升序
+    old = Ladder.from_json([[1.2, 300], [1.5, 100], [1.3, 200], 1.1], 500)
+    assert old.to_json() == [[1.1, 500], [1.2, 300], [1.3, 200], [1.5, 100]]
+    assert json.loads(json.dumps(strat._state_store({'buy_stack': old, 'sell_stack': Ladder([(-2.0, 100)])})['sell_stack'])) == [[-2.0, 100]]
+    assert old.push(1.2, 100) == 400 and old.push(1.25, 100) is None
+
+
+def test_grid_quote_uses_integer_ticks_and_caches_per_base(tmp_path):
+    from types import SimpleNamespace
+
+    strat = _strategy(tmp_path)
+    assert [strat.symbol_tick(s) for s in ('510300.SS', '159509.SZ', '161129.SZ', '600000.SS', '000001.SZ')] == [1, 1, 1, 10, 10]
+    assert strat.to_ticks(1.2341) == 1234 and strat.to_ticks(12.347, 10) == 12350
+
+    st = strat.SymbolState(symbol='510300.SS', base_price=1.0, buy_grid_spacing=0.01, sell_grid_spacing=0.012,
+                           credit_limit=0, buy_stack=strat.PriceLadder(), sell_stack=strat.PriceLadder(),
+                           _up_limit=1.1, _down_limit=0.9)
+    q = strat.grid_quote(st)
+    assert (q.theo_buy, q.theo_sell, q.buy_fix, q.sell_fix, q.down, q.up) == (990, 1012, None, None, 900, 1100)
+    assert strat.grid_quote(st) is q                               # 输入不变直接复用
+
+    st['sell_stack'].push(-0.99, 100)                              # 栈顶卖价 0.990 <= 理论买价：买价下修
+    q = strat.grid_quote(st)
+    assert q.sell_anchor == 990 and q.buy_fix == 980
+    ctx = SimpleNamespace(symbol_name_map={})
+    assert strat._apply_price_guard(ctx, st) == (0.98, 1.012)
+    assert strat._apply_price_guard(ctx, st, bypass_buy_block=True) == (0.99, 1.012)
+
+    st['base_price'] = 1.1
+    q = strat.grid_quote(st)
+    assert (q.theo_buy, q.theo_sell, q.buy_fix) == (1089, 1113, 980)
+
+
+def test_grid_quote_keeps_stock_prices_a_tick_apart(tmp_path):
+    strat = _strategy(tmp_path)
+    assert strat.to_ticks(9.996, 10, -1) == 9990 and strat.to_ticks(10.004, 10, 1) == 10010
+    assert strat.to_ticks(9.99, 10, -1) == 9990 and strat.to_ticks(10.01, 10, 1) == 10010
+
+    # 0.01 元档 + 0.04% 间距：四舍五入会把买卖价都挤到 10.00
+    st = strat.SymbolState(symbol='600000.SS', base_price=10.0, buy_grid_spacing=0.0004, sell_grid_spacing=0.0004,
+                           credit_limit=0, buy_stack=strat.PriceLadder(), sell_stack=strat.PriceLadder(),
+                           _up_limit=11.0, _down_limit=9.0)
+    q = strat.grid_quote(st)
+    assert (q.theo_buy, q.theo_sell) == (9990, 10010)
+
+    st['sell_stack'].push(-10.0, 100)                              # 栈顶卖价 = 基准：买价仍低一档
+    q = strat.grid_quote(st)
+    assert q.sell_anchor == 10000 and q.theo_buy == 9990 and q.buy_fix is None
+
+    st['sell_stack'] = strat.PriceLadder([(-9.99, 100)])           # 栈顶卖价 = 理论买价：下修到锚点下一档
+    q = strat.grid_quote(st)
+    assert q.sell_anchor == 9990 and q.buy_fix == 9980
+
+    st['buy_stack'].push(10.01, 100)                               # 栈顶买价 = 理论卖价：上修到锚点上一档
+    q = strat.grid_quote(st)
+    assert q.buy_anchor == 10010 and q.sell_fix == 10020
+
+
+def test_symbol_state_round_trips_saved_files_and_keeps_dict_access(tmp_path):
+    strat = _strategy(tmp_path)
+    State = strat.SymbolState
+
+    # 今天的状态文件 (无 _v，含旧字段 used_atr_rate) 照常读入；配置里的未知键进 _extra
+    saved = {'base_price': 1.5, 'grid_unit': 200, 'base_position': 1000, 'used_atr_rate': 0.03,
+             'buy_stack': [[1.45, 200], [1.4, 200]], 'filled_order_ids': ['12', '3'], 'trade_week_set': ['2025_2', '2025_1']}
+    st = State.from_json('510300.SS', saved, {'grid_unit': 100, 'base_price': 1.2, 'name': '沪深300', 'scale_factor': 2})
+    assert (st.base_price, st.grid_unit, st.grid_atr_rate, st.max_position) == (1.5, 200, 0.03, 1000 + 200 * 12)
+    assert st['name'] == '沪深300' and 'scale_factor' not in st and st.buy_stack.total() == 400
+
+    store = st.to_json()
+    assert store['_v'] == State.VERSION and 'name' not in store and '_last_trade_ts' not in store
+    assert list(store)[:-3] == list(State.PERSISTED[:-2])
+    assert store['filled_order_ids'] == ['3', '12'] and store['trade_week_set'] == ['2025_1', '2025_2']
+    again = State.from_json('510300.SS', json.loads(json.dumps(store)), {})
+    assert again.to_json() == store
+
+    # dict 兼容：未赋值的槽位等同于缺键
+    assert '_last_order_ts' not in st and st.get('_last_order_ts') is None and st.pop('_last_order_ts', 1) == 1
+    st['_last_order_ts'] = 5
+    assert st.pop('_last_order_ts') == 5 and '_last_order_ts' not in st
+    with pytest.raises(KeyError):
+        st['_last_order_bp']
+    assert st.get('items') is None and 'items' not in st
+    st.update({'base_price': 1.6, 'extra_key': 1})
+    assert st.base_price == 1.6 and dict(st.items())['extra_key'] == 1
+    assert strat._state_store({'base_price': 2.0})['base_price'] == 2.0
+
+
+def test_portfolio_screen_skips_quiet_symbols_without_changing_decisions(tmp_path):
+    from tools.matching import MatchConfig
+    cfg = _cfg(6)
+    out = {}
+    for screen in (False, True):
+        d = tmp_path / ('screen' if screen else 'full')
+        prepare_research_dir(d, cfg, {'strategy.json': {'market': {'max_stack_size': 3}, 'perf': {'screen': screen}}})
+        api = PTradeAPI(BarStore.from_config(cfg, days=3, seed=7, daily_vol=0.05), d,
+                        match_config=MatchConfig(partial_prob=0.3, push_delay=5, drop_prob=0.2, seed=1))
+        runner = SimRunner(load_strategy(ROOT / 'vagird.py', api), api).run()
+        runner.strategy.after_trading_end(runner.context, None)
+        states = {}
+        for f in sorted((d / 'state').glob('*.S?.json')):
+            j = json.loads(f.read_text(encoding='utf-8'))
+            for k in ('buy_stack', 'sell_stack'): j[k] = sorted(map(tuple, j[k] or []))
+            states[f.name] = j
+        events = ''.join(p.read_text(encoding='utf-8') for p in sorted((d / 'events').glob('*.jsonl')))
+        perf = json.loads((d / 'reports' / 'perf_metrics.json').read_text(encoding='utf-8'))
+        place = sum(v.get('place', {}).get('count', 0) for v in perf['symbols'].values())
+        out[screen] = (states, events, runner.summary()['orders'], place, perf['phases'])
+
+    full, screened = out[False], out[True]
+    assert screened[0] == full[0]
+    assert screened[1] == full[1] and screened[2] == full[2] > 0
+    assert 'screen' in screened[4] and 'screen' not in full[4]
+    assert screened[3] < full[3] / 2
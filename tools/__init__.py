@@ -0,0 +1 @@
+# vagird 离线工具集：PTrade 替身、基准测试等（不随策略部署到 PTRADE）
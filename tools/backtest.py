@@ -0,0 +1,766 @@
+# -*- coding: utf-8 -*-
+"""
+向量化多年回测引擎 (Vectorized Backtest)
+
+PTrade 回测器逐标的、逐 tick 地调用策略，10 年分钟线要跑几个小时。本引擎改为：
+- 行情以 0.001 元整数价位存成 [天, bar, 标的] 的 int32 面板 (分钟线或日线)；
+- 网格 ATR / 宏观 ATR 按日一次性向量化算好 (与 calculate_grid_atr / calculate_macro_atr 同口径)；
+- 对每个标的，用 NumPy 在当日剩余 bar 上一次性找出“下一根可能发生事情的 bar”：
+  挂单被穿价、触及影子棘轮理论价、VA 释放/加仓价位、宏观止盈升级/回撤触发、巡检需要重算；
+- 只有这些 bar 才回到 Python，调用 vagird.py 中原样的规则函数
+  (on_trade_response / process_trade_logic / place_limit_orders / get_target_base_position /
+   adjust_grid_unit / update_grid_spacing_final / _check_macro_take_profit / patrol_and_correct_orders)。
+候选条件都是宽松的超集：多进 Python 只是多算一次，不会漏掉真实策略会做的动作。
+
+撮合口径：限价单在 bar 的 [low, high] 覆盖委托价时整笔成交，开盘即穿价按开盘价成交；
+同一 bar 内撤单重挂的新单从下一根 bar 起参与撮合。日线模式每天一根 bar (14:30，巡检时点)：
+集合竞价挂出的网格单按当日 [low, high] 撮合，适合快速扫参；分钟线模式与逐 bar 驱动结果逐笔一致。
+
+    python -m tools.backtest --years 10 --freq 1d
+    python -m tools.backtest --years 10 --freq 1m --out bt.json
+    python -m tools.backtest --config config/symbols.json --years 3 --vol 0.02 --seed 3
+"""
+
+import argparse
+import json
+import math
+import tempfile
+import time as _time
+from datetime import date, datetime, timedelta
+from datetime import time as dtime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tools.ptrade_sim import MINUTE_TIMES, PTradeAPI, SimContext, load_strategy, prepare_research_dir
+
+ROOT = Path(__file__).resolve().parent.parent
+
+TICK = 1000                      # 1 元 = 1000 个最小价位 (0.001)
+NO_BUY = -1
+NO_SELL = np.iinfo(np.int32).max
+DAILY_BAR_TIME = dtime(14, 30)   # 日线模式的唯一 bar：落在巡检时点，且早于 14:55 日终撤单
+EOD_TIME = dtime(14, 55)
+
+
+def _to_ticks(a):
+    return np.rint(np.asarray(a, dtype=np.float64) * TICK).astype(np.int32)
+
+
+# ---------------- 行情面板 ----------------
+
+class BacktestData:
+    """
+    对齐后的行情面板。
+    open/high/low/close: [D, B, S] int32 (0.001 元)，bar_times: 每根 bar 的结束时刻；
+    daily_*: 含预热期的日线 [DD, S] float64，供 ATR 与涨跌停价使用。
+    """
+
+    def __init__(self, symbols, days, bar_times, ohlc, daily_dates, daily_ohlc):
+        self.symbols = list(symbols)
+        self.sym_index = {s: i for i, s in enumerate(self.symbols)}
+        self.days = list(days)
+        self.day_index = {d: i for i, d in enumerate(self.days)}
+        self.bar_times = list(bar_times)
+        self.open, self.high, self.low, self.close = (ohlc[k] for k in ('open', 'high', 'low', 'close'))
+        self.daily_dates = list(daily_dates)
+        self.daily = {k: np.asarray(v, dtype=np.float64) for k, v in daily_ohlc.items()}
+        self.day_offset = len(self.daily_dates) - len(self.days)
+        prev = self.daily['close'][self.day_offset - 1:-1] if self.day_offset > 0 else \
+            np.vstack([self.close[0, 0:1, :] / TICK, self.daily['close'][:-1]])
+        self.up_limit = np.round(prev * 1.10, 3)
+        self.down_limit = np.round(prev * 0.90, 3)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.open, self.high, self.low, self.close))
+
+    def limits(self, symbol, dt):
+        d = self.day_index.get(dt.date())
+        if d is None:
+            return None
+        s = self.sym_index[symbol]
+        return float(self.up_limit[d, s]), float(self.down_limit[d, s])
+
+    # ---- 落盘 / 内存映射 (并行扫参时各进程共享同一份只读行情) ----
+
+    PANELS = ('open', 'high', 'low', 'close')
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for k in self.PANELS:
+            np.save(path / f'{k}.npy', np.ascontiguousarray(getattr(self, k)))
+        for k, v in self.daily.items():
+            np.save(path / f'daily_{k}.npy', v)
+        meta = {
+            'symbols': self.symbols,
+            'days': [d.isoformat() for d in self.days],
+            'bar_times': [t.strftime('%H:%M') for t in self.bar_times],
+            'daily_dates': [d.isoformat() for d in self.daily_dates],
+        }
+        (path / 'meta.json').write_text(json.dumps(meta), encoding='utf-8')
+        return path
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """mmap_mode='r' 时分钟面板不读入内存，由操作系统页缓存在进程间共享。"""
+        path = Path(path)
+        meta = json.loads((path / 'meta.json').read_text(encoding='utf-8'))
+        ohlc = {k: np.load(path / f'{k}.npy', mmap_mode=mmap_mode) for k in cls.PANELS}
+        daily = {k: np.load(path / f'daily_{k}.npy') for k in cls.PANELS}
+        return cls(meta['symbols'], [date.fromisoformat(d) for d in meta['days']],
+                   [dtime.fromisoformat(t) for t in meta['bar_times']], ohlc,
+                   [date.fromisoformat(d) for d in meta['daily_dates']], daily)
+
+    # ---- 构造 ----
+
+    @classmethod
+    def synthetic(cls, symbols, base_prices=None, years=1.0, freq='1m', start=date(2015, 1, 5),
+                  seed=7, daily_vol=0.012, warmup_days=90):
+        """几何随机游走合成行情 (全部向量化生成)，预热期以 base_price 收尾。"""
+        rng = np.random.default_rng(seed)
+        S = len(symbols)
+        base = np.array([float((base_prices or {}).get(s, 1.0 + 0.01 * i)) for i, s in enumerate(symbols)])
+        D = max(1, int(round(years * 250)))
+        days = [d.date() for d in pd.bdate_range(start=start, periods=D)]
+        warm = [d.date() for d in pd.bdate_range(end=start - timedelta(days=1), periods=warmup_days)]
+
+        w_ret = rng.normal(0.0, daily_vol, size=(warmup_days, S))
+        w_close = base * np.exp(-np.cumsum(w_ret[::-1], axis=0)[::-1] + w_ret[-1:])
+        w_close[-1] = base
+        w_open = np.vstack([w_close[:1], w_close[:-1]])
+        spread = np.abs(rng.normal(0.0, daily_vol, size=(warmup_days, S)))
+        w_high = np.maximum(w_open, w_close) * (1 + spread / 2)
+        w_low = np.minimum(w_open, w_close) * (1 - spread / 2)
+
+        if freq == '1d':
+            bar_times = [DAILY_BAR_TIME]
+            gap = rng.normal(0.0, daily_vol / 4, size=(D, S))
+            body = rng.normal(0.0, daily_vol, size=(D, S))
+            log_c = np.log(base) + np.cumsum(gap + body, axis=0)
+            close = np.exp(log_c)
+            opn = np.exp(log_c - body)
+            wick = np.abs(rng.normal(0.0, daily_vol / 2, size=(2, D, S)))
+            high = np.maximum(opn, close) * (1 + wick[0])
+            low = np.minimum(opn, close) * (1 - wick[1])
+            ohlc = {k: _to_ticks(v)[:, None, :] for k, v in
+                    (('open', opn), ('high', high), ('low', low), ('close', close))}
+        else:
+            bar_times = list(MINUTE_TIMES)
+            B = len(bar_times)
+            sigma = daily_vol / np.sqrt(B)
+            steps = rng.normal(0.0, sigma, size=(D, B, S)).astype(np.float32)
+            steps[:, 0, :] += rng.normal(0.0, daily_vol / 4, size=(D, S)).astype(np.float32)
+            log_c = np.log(base).astype(np.float32) + np.cumsum(steps.reshape(D * B, S), axis=0).reshape(D, B, S)
+            close = np.exp(log_c)
+            del log_c, steps
+            opn = np.empty_like(close)
+            opn[:, 1:, :] = close[:, :-1, :]
+            opn[1:, 0, :] = close[:-1, -1, :]
+            opn[0, 0, :] = base
+            wick = np.abs(rng.normal(0.0, sigma / 2, size=(D, B, S))).astype(np.float32)
+            high = np.maximum(opn, close) * (1 + wick)
+            low = np.minimum(opn, close) * (1 - wick)
+            del wick
+            ohlc = {'open': _to_ticks(opn), 'high': _to_ticks(high), 'low': _to_ticks(low), 'close': _to_ticks(close)}
+            del opn, high, low, close
+
+        d_open = ohlc['open'][:, 0, :] / TICK
+        d_high = ohlc['high'].max(axis=1) / TICK
+        d_low = ohlc['low'].min(axis=1) / TICK
+        d_close = ohlc['close'][:, -1, :] / TICK
+        daily = {
+            'open': np.round(np.vstack([w_open, d_open]), 3),
+            'high': np.round(np.vstack([w_high, d_high]), 3),
+            'low': np.round(np.vstack([w_low, d_low]), 3),
+            'close': np.round(np.vstack([w_close, d_close]), 3),
+        }
+        return cls(symbols, days, bar_times, ohlc, warm + days, daily)
+
+    @classmethod
+    def from_config(cls, symbol_config, **kw):
+        return cls.synthetic(list(symbol_config.keys()),
+                             {s: c.get('base_price', 1.0) for s, c in symbol_config.items()}, **kw)
+
+    @classmethod
+    def from_bar_store(cls, store):
+        """复用离线替身 (tools.ptrade_sim.BarStore) 的分钟收盘价：open = high = low = close。"""
+        px = _to_ticks(store.minute_px)
+        return cls(store.symbols, store.days, MINUTE_TIMES,
+                   {'open': px, 'high': px, 'low': px, 'close': px},
+                   store.daily_dates, store.daily_ohlc)
+
+
+# ---------------- ATR 表 (与 calculate_grid_atr / calculate_macro_atr 同口径) ----------------
+
+def _true_range(high, low, close):
+    """[DD, S] 的真实波幅；首日无昨收，退化为 high - low。"""
+    tr = high - low
+    prev = close[:-1]
+    tr[1:] = np.maximum(tr[1:], np.maximum(np.abs(high[1:] - prev), np.abs(low[1:] - prev)))
+    return tr
+
+
+def _windows(arr, start, n):
+    """arr[start + i - n: start + i] 的滑动窗口视图，形状 [D, n, S]。"""
+    D = arr.shape[0] - start
+    idx = np.arange(D)[:, None] + np.arange(start - n, start)[None, :]
+    return arr[idx]
+
+
+def _ema_last(win, span):
+    """pandas ewm(span, adjust=False).mean().iloc[-1] 的闭式解：win [..., n, S] 沿 n 轴。"""
+    n = win.shape[-2]
+    a = 2.0 / (span + 1.0)
+    w = a * (1 - a) ** np.arange(n - 1, -1, -1)
+    w[0] = (1 - a) ** (n - 1)
+    return np.einsum('...ns,n->...s', win, w)
+
+
+def atr_tables(data, grid_period=14, macro_period=60):
+    """
+    逐交易日预计算原始 ATR 率 [D, S] (窗口只含当日之前的日线，与盘中 get_history 一致)：
+    grid: 近 grid_period+5 日 TR 的 EMA(span=grid_period) / 昨收
+    macro: 近 macro_period+20 日 TR，按滚动中位数 3 倍截尾后 EMA(span=macro_period) / 昨收
+    预热不足的交易日为 NaN (策略会沿用上一次的取值)。
+    """
+    H, L, C = data.daily['high'], data.daily['low'], data.daily['close']
+    off = data.day_offset
+    D, S = len(data.days), len(data.symbols)
+    tr = _true_range(H.copy(), L, C)
+    hl = H - L
+    last_close = C[off - 1: off - 1 + D] if off > 0 else np.full((D, S), np.nan)
+
+    def _window_tr(n):
+        if off < n:
+            return None
+        win = _windows(tr, off, n).copy()
+        win[:, 0, :] = _windows(hl, off, n)[:, 0, :]     # 窗口首根没有“昨收”
+        return win
+
+    out = {}
+    n = grid_period + 5
+    win = _window_tr(n)
+    grid = np.full((D, S), np.nan)
+    if win is not None:
+        grid = _ema_last(win, grid_period) / last_close
+
+    n = macro_period + 20
+    win = _window_tr(n)
+    macro = np.full((D, S), np.nan)
+    if win is not None:
+        # 中位数沿最后一轴做更快；窗口首根 (TR 退化为 high - low) 之后的整段 60 日中位数与全序列滚动中位数相同
+        wt = np.ascontiguousarray(win.transpose(0, 2, 1))
+        med = np.empty_like(wt)
+        for k in range(macro_period):
+            med[:, :, k] = np.median(wt[:, :, :k + 1], axis=2)
+        roll = np.median(np.lib.stride_tricks.sliding_window_view(tr, macro_period, axis=0), axis=-1)
+        med[:, :, macro_period:] = _windows(roll, off - macro_period + 1, n - macro_period).transpose(0, 2, 1)
+        med = med.transpose(0, 2, 1)
+        clipped = np.minimum(win, med * 3)
+        macro = _ema_last(clipped, macro_period) / last_close
+    out['grid'] = np.where(np.isfinite(grid) & (last_close > 0), grid, np.nan)
+    out['macro'] = np.where(np.isfinite(macro) & (last_close > 0), macro, np.nan)
+    return out
+
+
+# ---------------- 回测引擎 ----------------
+
+class _EngineAPI(PTradeAPI):
+    """回测用 PTrade 替身：账户/订单复用 SimBroker，撮合由引擎按 bar 驱动。"""
+
+    def get_snapshot(self, security):
+        return {}
+
+    def get_history(self, *a, **kw):
+        return {}
+
+
+def _noop(*a, **kw):
+    return None
+
+
+class BacktestResult:
+    def __init__(self, engine, wall_s):
+        self.fills = engine.fills
+        self.symbols = engine.data.symbols
+        self.wall_s = wall_s
+        self.steps = engine.n_steps
+        self.bars = len(engine.data.days) * len(engine.data.bar_times) * len(self.symbols)
+        self.per_symbol = engine.symbol_report()
+
+    def fills_frame(self):
+        return pd.DataFrame(self.fills, columns=['dt', 'symbol', 'amount', 'price', 'macro'])
+
+    def summary(self):
+        total = sum(r['total_pnl'] for r in self.per_symbol.values())
+        return {
+            'symbols': len(self.symbols),
+            'bars': self.bars,
+            'python_steps': self.steps,
+            'step_ratio': round(self.steps / max(1, self.bars), 5),
+            'fills': len(self.fills),
+            'total_pnl': round(total, 2),
+            'grid_pnl': round(sum(r['grid_pnl'] for r in self.per_symbol.values()), 2),
+            'wall_s': round(self.wall_s, 3),
+        }
+
+    def to_json(self):
+        return {'summary': self.summary(), 'symbols': self.per_symbol}
+
+
+class VectorBacktest:
+    """
+    data: BacktestData；symbol_config: symbols.json 内容；strategy_config: 可选 strategy.json 内容。
+    skip=False 时每根 bar 都进 Python (逐 bar 驱动)，用来核对事件跳跃没有漏掉动作。
+    run() 返回 BacktestResult (成交明细、每个标的的堆栈 / 底仓 / 盈亏)。
+    """
+
+    PATROL_MINUTES = (0, 30)
+
+    def __init__(self, data, symbol_config, strategy_path=None, strategy_config=None, research_dir=None,
+                 skip=True):
+        self.data = data
+        self.skip = skip
+        self.symbol_config = {s: symbol_config[s] for s in data.symbols}
+        self._tmp = None
+        if research_dir is None:
+            self._tmp = tempfile.TemporaryDirectory()
+            research_dir = self._tmp.name
+        prepare_research_dir(research_dir, self.symbol_config,
+                             {'strategy.json': strategy_config} if strategy_config else None)
+        self.api = _EngineAPI(data, research_dir)
+        self.strat = load_strategy(strategy_path or ROOT / 'vagird.py', self.api)
+        self._quiet()
+        self.atr = atr_tables(data)
+        self.fills = []
+        self.cash_flow = {s: 0.0 for s in data.symbols}
+        self.n_steps = 0
+        self._day = 0
+
+        B = len(data.bar_times)
+        self._bar_dt_off = [timedelta(hours=t.hour, minutes=t.minute) for t in data.bar_times]
+        self._patrol = np.array([t.minute in self.PATROL_MINUTES for t in data.bar_times])
+        self._eod_bar = next((b for b, t in enumerate(data.bar_times) if t >= EOD_TIME), B)
+
+    def _quiet(self):
+        """关掉日志与落盘、API 直连 (不计数)，ATR 换成预计算表；交易规则函数保持原样。"""
+        s = self.strat
+        for name in self.api.API_NAMES:
+            setattr(s, name, getattr(self.api, name))
+        s.info = _noop
+        s.safe_save_state = _noop
+        s.journal_state = _noop
+        s.emit_event = _noop
+        s.install_perf_hooks = _noop
+        s.log_trade_details = _noop
+        s.calculate_grid_atr = self._grid_atr
+        s.calculate_macro_atr = self._macro_atr
+
+    # ---- ATR：查表 + 与原函数相同的刷新门槛 ----
+
+    def _grid_atr(self, context, symbol, atr_period=14):
+        state = context.state[symbol]
+        raw = self.atr['grid'][self._day, self.data.sym_index[symbol]]
+        used = state.get('grid_atr_rate')
+        if raw > 0:
+            if used is None or abs(raw - used) / used > 0.10:
+                state['grid_atr_rate'] = float(raw)
+            return state['grid_atr_rate']
+        return used
+
+    def _macro_atr(self, context, symbol, atr_period=60):
+        state = context.state[symbol]
+        raw = self.atr['macro'][self._day, self.data.sym_index[symbol]]
+        used = state.get('macro_atr_rate')
+        if raw > 0:
+            if used is None or abs(raw - used) / used > 0.05:
+                state['macro_atr_rate'] = float(raw)
+            return state['macro_atr_rate']
+        return used
+
+    def _macro_atr_peek(self, state, s):
+        raw = self.atr['macro'][self._day, s]
+        used = state.get('macro_atr_rate')
+        if raw > 0:
+            if used is None or abs(raw - used) / used > 0.05:
+                return float(raw)
+            return used
+        return used
+
+    # ---- 初始化 ----
+
+    def _setup(self):
+        data, api = self.data, self.api
+        for sym, c in self.symbol_config.items():
+            amt = int((c or {}).get('initial_base_position', 0) or 0)
+            if amt > 0:
+                px = float(c.get('base_price', 1.0))
+                api.broker.seed_position(sym, amt, px)
+                self.cash_flow[sym] -= amt * px
+        api.set_time(datetime.combine(data.days[0], dtime(9, 0)))
+        self.ctx = SimContext(api)
+        self.strat.initialize(self.ctx)
+        # 关闭启动宽限期 (影子棘轮在宽限期内停用)
+        self.ctx.boot_dt = datetime.combine(data.days[0], dtime(0, 0)) - timedelta(days=1)
+
+    def _at(self, dt):
+        self.api.now_dt = dt
+        self.ctx.current_dt = dt
+
+    # ---- 单标的 bar 处理 (Python 慢路径) ----
+
+    def _match(self, sym, d, b, s):
+        """限价撮合：按离开盘价由近到远依次成交，每笔成交立即推送 on_trade_response。"""
+        broker = self.api.broker
+        orders = broker.open_orders(sym)
+        if not orders:
+            return
+        o_px, hi, lo = int(self.data.open[d, b, s]), int(self.data.high[d, b, s]), int(self.data.low[d, b, s])
+        hits = []
+        for o in orders:
+            lim = int(round(o.price * TICK))
+            if o.amount > 0 and lo <= lim:
+                hits.append((abs(min(lim, o_px) - o_px), min(lim, o_px), o))
+            elif o.amount < 0 and hi >= lim:
+                hits.append((abs(max(lim, o_px) - o_px), max(lim, o_px), o))
+        hits.sort(key=lambda x: x[0])
+        for _, px_t, o in hits:
+            if o.entrust_no not in broker._open:
+                continue
+            self._fill(sym, o, px_t / TICK)
+
+    def _fill(self, sym, o, price):
+        st = self.ctx.state[sym]
+        qty = o.remaining
+        push = self.api.broker.fill(o, qty, price)
+        signed = qty if o.amount > 0 else -qty
+        self.cash_flow[sym] -= signed * price
+        self.fills.append((self.ctx.current_dt, sym, signed, price, o.entrust_no in st.get('_macro_sell_ids', [])))
+        self.strat.on_trade_response(self.ctx, [push])
+
+    def _rehang(self, sym):
+        """check_pending_rehangs 的单标的视图。"""
+        ctx = self.ctx
+        syms = ctx.symbol_list
+        ctx.symbol_list = [sym]
+        try:
+            self.strat.check_pending_rehangs(ctx)
+        finally:
+            ctx.symbol_list = syms
+
+    def _end_of_day(self, sym):
+        """end_of_day 的单标的部分：撤掉全部挂单、清零冻结量。"""
+        for o in self.api.broker.open_orders(sym):
+            self.api.cancel_order_ex({'entrust_no': o.entrust_no, 'symbol': sym})
+        self.ctx.pending_frozen[sym] = 0
+
+    def _step(self, d, b, s):
+        """在第 d 天第 b 根 bar 上按实盘顺序处理一个标的：撮合 → handle_data 逐标的部分 → 补单。"""
+        self.n_steps += 1
+        strat, ctx, sym = self.strat, self.ctx, self.data.symbols[s]
+        st = ctx.state[sym]
+        dt = self._dates[d] + self._bar_dt_off[b]
+        self._at(dt)
+        self._match(sym, d, b, s)
+
+        price = int(self.data.close[d, b, s]) / TICK
+        ctx.latest_data[sym] = price
+        ctx.last_valid_price[sym] = price
+        ctx.last_valid_ts[sym] = dt
+        ctx.mark_halted[sym] = False
+        strat._check_macro_take_profit(ctx, sym, st, price, dt)
+        strat.get_target_base_position(ctx, sym, st, price, dt)
+        strat.adjust_grid_unit(st)
+        patrol = bool(self._patrol[b])
+        if patrol:
+            strat.update_grid_spacing_final(ctx, sym, st, self.api.broker.position(sym).amount)
+        elif b < self._eod_bar:
+            strat.place_limit_orders(ctx, sym, st, ignore_cooldown=False)
+        if patrol:
+            strat.patrol_and_correct_orders(ctx, sym, st)
+
+        if st.get('_rehang_due_ts') is not None and b < self._eod_bar:
+            self._at(dt + timedelta(seconds=3))
+            self._rehang(sym)
+
+        if patrol:
+            last_trade = st.get('_last_trade_ts')
+            self._settled[s] = not (last_trade and (dt - last_trade).total_seconds() < 58)
+        else:
+            self._settled[s] = False
+
+    # ---- 候选价位 (NumPy 快路径的输入) ----
+
+    def _levels(self, s):
+        """
+        返回 (买单最高价, 卖单最低价, 收盘上穿价, 收盘下穿价, 是否需要下一根 bar 立即处理)，单位 0.001 元。
+        价位全部取宽松方向：只可能多报候选 bar，不会漏报。
+        """
+        strat, ctx, sym = self.strat, self.ctx, self.data.symbols[s]
+        st = ctx.state[sym]
+        buy_hi, sell_lo = NO_BUY, NO_SELL
+        for o in self.api.broker.open_orders(sym):
+            lim = int(round(o.price * TICK))
+            if o.amount > 0:
+                buy_hi = max(buy_hi, lim)
+            else:
+                sell_lo = min(sell_lo, lim)
+
+        base = st.base_price
+        buy_sp = st.buy_grid_spacing
+        q = strat.grid_quote(st)
+        theo_buy, theo_sell = q.theo_buy / strat.PRICE_TICKS, q.theo_sell / strat.PRICE_TICKS
+        pos = self.api.broker.position(sym).amount
+        max_grids = st.max_grid_count
+
+        # 棘轮发生在 adjust_grid_unit 之后，下一步之前 grid_unit 可能仍是旧值：新旧两个网格单位都要覆盖
+        nxt = strat.SymbolState(symbol=sym, base_position=st.base_position, base_price=base, grid_unit=st.grid_unit,
+                                max_grid_count=max_grids)
+        strat.adjust_grid_unit(nxt)
+        up, dn = NO_SELL, NO_BUY
+        guards = []
+        for unit in {st.grid_unit, nxt.grid_unit}:
+            bypass = pos < st.base_position + max(1, max_grids // 3) * unit
+            buy_p, sell_p = strat._apply_price_guard(ctx, st, bypass)
+            guards.append((buy_p, sell_p))
+            # 影子棘轮：只有在仓位极限或被守门员扭曲时，触及理论价才会移动基准
+            if pos - unit <= st.base_position or sell_p > theo_sell:
+                up = int(round(theo_sell * TICK))
+            if pos + unit >= st.base_position + unit * max_grids or buy_p < theo_buy:
+                dn = int(round(theo_buy * TICK))
+
+        for unit in {st.grid_unit, nxt.grid_unit}:
+            va_up, va_dn = self._va_levels(st, unit)
+            if va_up is not None:
+                up = min(up, int(math.floor(va_up * TICK * (1 - 1e-9))))
+            if va_dn is not None:
+                dn = max(dn, int(math.floor(va_dn * TICK * (1 + 1e-9))) if math.isfinite(va_dn) else NO_SELL)
+
+        dirty = st._rehang_due_ts is not None
+        last_bp = st.get('_last_order_bp')
+        if not dirty and (last_bp is None or abs(base / last_bp - 1) >= buy_sp / 2):
+            dirty = True
+        if not dirty and any(self._lock_pending(st, theo_buy, theo_sell, b, s) for b, s in guards):
+            dirty = True
+        return buy_hi, sell_lo, up, dn, dirty
+
+    def _va_levels(self, st, unit):
+        """get_target_base_position 的触发价位：收盘 >= up 可能释放底仓，收盘 < dn 可能加仓。"""
+        target = self.strat.va_target_value(st, len(st.get('trade_week_set') or ()))
+        bp, lwp = st.base_position, st.last_week_position
+        k = self.strat.StrategyConfig.VA.THRESHOLD_K
+
+        up = None
+        if bp - unit >= st.initial_base_position * 0.5:
+            denom = bp - k * unit
+            if target <= 0:
+                up = 0.0
+            elif denom > 0:
+                up = target / denom
+        dn = None
+        if target > 0:
+            # final_pos > bp  <=>  min_base > bp  或  ceil((target/price - lwp) / 100) * 100 > bp - lwp
+            min_base = round(st.initial_position_value / st.base_price / 100) * 100 if st.base_price else 0
+            denom = lwp + max(0, (bp - lwp) // 100 * 100)
+            dn = math.inf if (min_base > bp or denom <= 0) else target / denom
+        return up, dn
+
+    def _lock_pending(self, st, theo_buy, theo_sell, buy_p, sell_p):
+        """place_limit_orders 的天地锁融合在下一次调用时是否会真的改动堆栈。"""
+        if not (st['buy_stack'] or st['sell_stack']) or not (buy_p > 0 and sell_p > 0):
+            return False
+        sym = st['symbol']
+        atr = self.atr['grid'][self._day, self.data.sym_index[sym]]
+        used = st.get('grid_atr_rate')
+        if not (atr > 0) or (used is not None and abs(atr - used) / used <= 0.10):
+            atr = used
+        if atr is None or math.isnan(atr) or atr <= 0:
+            atr = 0.02
+        if (sell_p - buy_p) / buy_p <= self.strat.StrategyConfig.MARKET.UNLOCK_ATR_MULTIPLIER * atr:
+            return False
+        d_buy, d_sell = theo_buy - buy_p, sell_p - theo_sell
+        return (d_buy > d_sell and bool(st['sell_stack'])) or (d_sell > d_buy and bool(st['buy_stack']))
+
+    # ---- 宏观止盈 ----
+
+    def _macro_params(self, s):
+        """宏观止盈在当前持仓/周数下是否生效；生效时返回计算候选所需的常量。"""
+        sym = self.data.symbols[s]
+        st = self.ctx.state[sym]
+        pos = self.api.broker.position(sym)
+        if pos.amount == 0 or pos.cost_basis <= 0:
+            return None
+        cfg = self.symbol_config.get(sym, {})
+        weeks = len(st.get('trade_week_set', set()))
+        if weeks < cfg.get('tp_cool_weeks', 4) or weeks < cfg.get('tp_min_weeks', 12):
+            return None
+        atr = self._macro_atr_peek(st, s) or 0.02
+        tier = st.get('_tp_tier', 0)
+        nxt = {0: 10.0, 1: 20.0, 2: 30.0}.get(tier)
+        return {
+            'amount': pos.amount, 'cost': pos.cost_basis, 'min_val': cfg.get('tp_min_value', 30000),
+            'hwm': st.get('_tp_hwm_ratio', 0.0), 'tier': tier,
+            'up': nxt * atr if nxt is not None else math.inf, 'floor': 10.0 * atr,
+            'dd': {1: 3.0, 2: 5.0, 3: 8.0}.get(tier, 0.05) * atr,
+        }
+
+    def _macro_scan(self, mp, close_t):
+        """返回 (候选掩码, 合格 bar 掩码, 盈利率)；close_t 为一维整数价位。"""
+        price = close_t / TICK
+        qual = (price * mp['amount']) >= mp['min_val']
+        ratio = (price - mp['cost']) / mp['cost']
+        cand = qual & (ratio >= mp['up'])
+        if mp['tier'] > 0:
+            # 回撤卖出要求当下盈利仍在 Tier 1 门槛之上 (否则原函数内的局部 tier 为 0)
+            hwm = np.maximum(mp['hwm'], np.maximum.accumulate(np.where(qual, ratio, -np.inf)))
+            cand |= qual & (ratio >= mp['floor']) & ((hwm - ratio) >= mp['dd'])
+        return cand, qual, ratio
+
+    def _macro_commit(self, s, qual, ratio):
+        """把未进 Python 的合格 bar 对 _check_macro_take_profit 状态的副作用补记上 (高水位、ATR 刷新)。"""
+        if not qual.any():
+            return
+        sym = self.data.symbols[s]
+        st = self.ctx.state[sym]
+        st['_tp_hwm_ratio'] = max(st.get('_tp_hwm_ratio', 0.0), float(ratio[qual].max()))
+        st['macro_atr_rate'] = self._macro_atr(self.ctx, sym) or 0.02
+
+    # ---- 主循环 ----
+
+    def _next_event(self, d, s, start, levels, mp):
+        """NumPy 扫描：从第 start 根 bar 起第一根候选 bar 的下标 (没有则返回 None)，并补记宏观副作用。"""
+        B = self.data.close.shape[1]
+        if start >= B:
+            return None
+        if not self.skip:
+            return start
+        buy_hi, sell_lo, up, dn, dirty = levels
+        if dirty and start < self._eod_bar:
+            return start
+        hi = self.data.high[d, start:, s]
+        lo = self.data.low[d, start:, s]
+        cl = self.data.close[d, start:, s]
+        cand = (lo <= buy_hi) | (hi >= sell_lo) | (cl >= up) | (cl <= dn)
+        if not self._settled[s]:
+            cand |= self._patrol[start:]
+        if start <= self._eod_bar < B:
+            cand[self._eod_bar - start] = True    # 日终撤单后挂单价位失效，重新评估
+        qual = ratio = None
+        if mp is not None:
+            m_cand, qual, ratio = self._macro_scan(mp, cl)
+            cand |= m_cand
+        hit = int(cand.argmax()) if cand.any() else None
+        if mp is not None:
+            end = hit if hit is not None else len(cl)
+            self._macro_commit(s, qual[:end], ratio[:end])
+        return None if hit is None else start + hit
+
+    def _run_symbol_day(self, d, s):
+        sym = self.data.symbols[s]
+        b = 0     # 每日首根 bar 必进 Python：新周 VA、T+1 解冻、ATR 日更、集合竞价成交后的补单
+        while b is not None:
+            if b == self._eod_bar:
+                self._end_of_day(sym)
+            self._step(d, b, s)
+            if b + 1 == self._eod_bar:
+                self._end_of_day(sym)
+            mp = self._macro_params(s)
+            b = self._next_event(d, s, b + 1, self._levels(s), mp)
+        if self._eod_bar < len(self.data.bar_times) and self.api.broker.open_orders(sym):
+            self._end_of_day(sym)
+
+    def _auction(self, d):
+        """9:15 集合竞价挂单 (原函数，全部标的)，9:25 按开盘价撮合。"""
+        data, ctx = self.data, self.ctx
+        self._at(self._dates[d] + timedelta(hours=9, minutes=15))
+        self.strat.place_auction_orders(ctx)
+        self._at(self._dates[d] + timedelta(hours=9, minutes=25))
+        broker = self.api.broker
+        for s, sym in enumerate(data.symbols):
+            o_px = int(data.open[d, 0, s])
+            for o in broker.open_orders(sym):
+                lim = int(round(o.price * TICK))
+                if (o.amount > 0 and o_px <= lim) or (o.amount < 0 and o_px >= lim):
+                    if o.entrust_no in broker._open:
+                        self._fill(sym, o, o_px / TICK)
+
+    def run(self):
+        t0 = _time.perf_counter()
+        self._setup()
+        data = self.data
+        self._dates = [datetime.combine(day, dtime(0, 0)) for day in data.days]
+        S = len(data.symbols)
+        for d in range(len(data.days)):
+            self._day = d
+            self.api.broker.new_day()
+            for s, sym in enumerate(data.symbols):
+                st = self.ctx.state[sym]
+                st['_up_limit'] = float(data.up_limit[d, s])
+                st['_down_limit'] = float(data.down_limit[d, s])
+                self.ctx.pending_frozen[sym] = 0
+            self._settled = [False] * S
+            self._auction(d)
+            for s in range(S):
+                self._run_symbol_day(d, s)
+        return BacktestResult(self, _time.perf_counter() - t0)
+
+    # ---- 输出 ----
+
+    def symbol_report(self):
+        out = {}
+        last_close = self.data.close[-1, -1, :] / TICK
+        for s, sym in enumerate(self.data.symbols):
+            st = self.ctx.state[sym]
+            pos = self.api.broker.position(sym)
+            mv = pos.amount * float(last_close[s])
+            out[sym] = {
+                'position': pos.amount,
+                'cost_basis': round(pos.cost_basis, 4),
+                'base_position': st['base_position'],
+                'grid_unit': st['grid_unit'],
+                'base_price': st['base_price'],
+                'buy_stack': [[round(p, 3), q] for p, q in st['buy_stack'].items()],
+                'sell_stack': [[round(-p, 3), q] for p, q in st['sell_stack'].items(reverse=True)],
+                'grid_pnl': round(st.get('history_pnl', 0.0), 2),
+                'market_value': round(mv, 2),
+                'total_pnl': round(self.cash_flow[sym] + mv, 2),
+                'fills': sum(1 for f in self.fills if f[1] == sym),
+            }
+        return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='vagird 向量化多年回测')
+    ap.add_argument('--config', default=str(ROOT / 'config' / 'symbols.json'))
+    ap.add_argument('--years', type=float, default=10.0)
+    ap.add_argument('--freq', choices=('1m', '1d'), default='1d')
+    ap.add_argument('--seed', type=int, default=7)
+    ap.add_argument('--vol', type=float, default=0.012, help='合成行情日波动率')
+    ap.add_argument('--strategy', default=None, help='策略文件 (默认 vagird.py)')
+    ap.add_argument('--out', default=None, help='结果 JSON 输出路径')
+    args = ap.parse_args(argv)
+
+    cfg = json.loads(Path(args.config).read_text(encoding='utf-8'))
+    t0 = _time.perf_counter()
+    data = BacktestData.from_config(cfg, years=args.years, freq=args.freq, seed=args.seed, daily_vol=args.vol)
+    t_data = _time.perf_counter() - t0
+    res = VectorBacktest(data, cfg, strategy_path=args.strategy).run()
+    out = res.to_json()
+    out['summary']['data_s'] = round(t_data, 3)
+    print(json.dumps(out['summary'], ensure_ascii=False, indent=2))
+    rows = [(sym, r['position'], r['base_position'], len(r['buy_stack']), len(r['sell_stack']), r['grid_pnl'], r['total_pnl'])
+            for sym, r in out['symbols'].items()]
+    print(f"{'symbol':<12}{'pos':>9}{'base':>9}{'buys':>6}{'sells':>6}{'grid_pnl':>12}{'total_pnl':>13}")
+    for r in rows:
+        print(f"{r[0]:<12}{r[1]:>9}{r[2]:>9}{r[3]:>6}{r[4]:>6}{r[5]:>12.2f}{r[6]:>13.2f}")
+    if args.out:
+        res_df = res.fills_frame()
+        out['fills'] = [[str(dt), sym, amt, px, mac] for dt, sym, amt, px, mac in res_df.itertuples(index=False)]
+        Path(args.out).write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+离线基准：在 PTrade 替身上跑 vagird.py，输出单 tick (handle_data) 延迟与 API 调用量。
+
+    python -m tools.bench                          # 使用 config/symbols.json 的 15 个标的
+    python -m tools.bench --synthetic 500 --days 1 # 合成 500 标的宇宙
+    python -m tools.bench --profile bench.prof     # 同时输出 cProfile 统计
+    # 对账路径压力测试：高波动 + 部分成交 + 回报延迟/丢失
+    python -m tools.bench --vol 0.06 --partial 0.5 --push-delay 5 --drop 0.1 --latency 1
+    # 同时开启行情录制 (research_dir/replay/*.jsonl)，供 tools.replay 回放
+    python -m tools.bench --days 3 --record --research-dir sim_run
+"""
+
+import argparse
+import cProfile
+import json
+import pstats
+import tempfile
+import time
+from pathlib import Path
+
+from tools.matching import MatchConfig
+from tools.ptrade_sim import (BarStore, PTradeAPI, SimRunner, load_strategy,
+                              prepare_research_dir, synthetic_universe)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def build_runner(symbol_config, research_dir, days=1, seed=7, vol=0.012, interval=True, strategy_path=None,
+                 record=False, **api_kw):
+    prepare_research_dir(research_dir, symbol_config,
+                         {'strategy.json': {'replay': {'record': True}}} if record else None)
+    bars = BarStore.from_config(symbol_config, days=days, seed=seed, daily_vol=vol)
+    api = PTradeAPI(bars, research_dir, **api_kw)
+    strat = load_strategy(strategy_path or ROOT / 'vagird.py', api)
+    return SimRunner(strat, api, interval=interval)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='vagird 离线基准')
+    ap.add_argument('--config', default=str(ROOT / 'config' / 'symbols.json'))
+    ap.add_argument('--synthetic', type=int, default=0, help='改用 N 个合成标的')
+    ap.add_argument('--days', type=int, default=1)
+    ap.add_argument('--seed', type=int, default=7)
+    ap.add_argument('--vol', type=float, default=0.012, help='合成行情日波动率')
+    ap.add_argument('--no-interval', action='store_true', help='不驱动 run_interval 任务')
+    ap.add_argument('--partial', type=float, default=0.0, help='部分成交概率')
+    ap.add_argument('--push-delay', type=float, default=0.0, help='成交回报延迟 (秒)')
+    ap.add_argument('--drop', type=float, default=0.0, help='成交回报丢失概率')
+    ap.add_argument('--latency', type=float, default=0.0, help='委托生效延迟 (秒)')
+    ap.add_argument('--record', action='store_true', help='开启行情录制 (配合 --research-dir 保留录制文件)')
+    ap.add_argument('--research-dir', default=None, help='默认使用临时目录')
+    ap.add_argument('--profile', default=None, help='cProfile 输出文件')
+    args = ap.parse_args(argv)
+
+    cfg = synthetic_universe(args.synthetic) if args.synthetic else json.loads(Path(args.config).read_text(encoding='utf-8'))
+    with tempfile.TemporaryDirectory() as tmp:
+        mc = MatchConfig(partial_prob=args.partial, push_delay=args.push_delay, drop_prob=args.drop,
+                         accept_latency=args.latency, seed=args.seed)
+        runner = build_runner(cfg, args.research_dir or tmp, days=args.days, seed=args.seed, vol=args.vol,
+                              interval=not args.no_interval, record=args.record, match_config=mc)
+        t0 = time.perf_counter()
+        if args.profile:
+            prof = cProfile.Profile()
+            prof.enable()
+            runner.run()
+            prof.disable()
+            prof.dump_stats(args.profile)
+            pstats.Stats(prof).sort_stats('cumulative').print_stats(25)
+        else:
+            runner.run()
+        wall = time.perf_counter() - t0
+        out = runner.summary()
+        out['wall_s'] = round(wall, 3)
+        out['order_events_per_s'] = round((out['orders'] + out['cancels'] + out['fills']) / max(wall, 1e-9), 1)
+        print(json.dumps(out, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
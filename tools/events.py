@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+结构化事件查询 (Event Stream Query)
+
+策略把关键决策写成 research_path/events/<日期>.jsonl，一行一条:
+    {"ts":"2026-03-02 10:31:05","t":"guard","s":"510300.SS", ...字段}
+旁边的 <日期>.idx 记录每个分钟首条事件的字节偏移 ("HH:MM 偏移")，
+按时间窗查询时直接 seek 到窗口起点、读到窗口终点为止，不做整文件扫描；
+标的/类型过滤先在原始字节上做子串预筛，命中的行才 json 解析。
+
+事件类型: guard (守门员拦截/VA 特权放行) / ratchet (影子棘轮) / merge (破锁融合、同价合并、容量裁剪) /
+          fill (成交回报、巡检补录) / patrol_cancel (巡检撤单) / va (VA 释放/加仓) / macro_tp (止盈档位/重置)
+
+    python -m tools.events sim_run --symbol 510300.SS --type guard,ratchet --start "2026-03-02 10:00" --end 2026-03-31
+    python -m tools.events sim_run --start 2026-03-02 --summary
+"""
+
+import argparse
+import bisect
+import json
+import sys
+import time as _time
+from collections import Counter
+from pathlib import Path
+
+
+def events_dir(root):
+    """root 可以是 research 目录 (含 events/) 或 events 目录本身。"""
+    root = Path(root)
+    return root / 'events' if (root / 'events').is_dir() else root
+
+
+def _parse_time(text, end=False):
+    """'YYYY-MM-DD' / 'YYYY-MM-DD HH:MM' / 'YYYY-MM-DD HH:MM:SS' -> 与事件 ts 同格式的字符串。
+    只给日期或分钟的终点取该日/该分钟的最后一秒。"""
+    if not text:
+        return None
+    text = text.strip().replace('T', ' ')
+    if len(text) == 10:
+        return text + (' 23:59:59' if end else ' 00:00:00')
+    if len(text) == 16:
+        return text + (':59' if end else ':00')
+    return text[:19]
+
+
+def load_index(path):
+    """<日期>.idx -> ([HH:MM...], [偏移...])；盘中重启追加的重复分钟保留，bisect 取首个即可。"""
+    minutes, offsets = [], []
+    try:
+        raw = Path(path).read_bytes().split()
+    except OSError:
+        return minutes, offsets
+    for i in range(0, len(raw) - 1, 2):
+        minutes.append(raw[i].decode())
+        offsets.append(int(raw[i + 1]))
+    return minutes, offsets
+
+
+def _byte_range(idx, size, start_min=None, end_min=None):
+    """由分钟索引求 [lo, hi) 字节区间：lo 为首个 >= 起始分钟的偏移，hi 为首个 > 终止分钟的偏移。"""
+    minutes, offsets = idx
+    lo, hi = 0, size
+    if start_min and minutes:
+        i = bisect.bisect_left(minutes, start_min)
+        lo = offsets[i] if i < len(offsets) else size
+    if end_min and minutes:
+        j = bisect.bisect_right(minutes, end_min)
+        hi = offsets[j] if j < len(offsets) else size
+    return lo, max(lo, hi)
+
+
+def iter_events(root, symbols=None, types=None, start=None, end=None):
+    """
+    按时间顺序产出满足条件的事件 dict。
+    symbols / types: 可迭代 (None 表示不限)；start / end: 见 _parse_time。
+    """
+    d = events_dir(root)
+    t0, t1 = _parse_time(start), _parse_time(end, end=True)
+    sym_keys = [f'"s":"{s}"'.encode() for s in symbols] if symbols else None
+    type_keys = [f'"t":"{t}"'.encode() for t in types] if types else None
+
+    for path in sorted(d.glob('*.jsonl')):
+        day = path.stem
+        if (t0 and day < t0[:10]) or (t1 and day > t1[:10]):
+            continue
+        size = path.stat().st_size
+        idx = load_index(path.with_suffix('.idx'))
+        start_min = t0[11:16] if t0 and day == t0[:10] else None
+        end_min = t1[11:16] if t1 and day == t1[:10] else None
+        lo, hi = _byte_range(idx, size, start_min, end_min)
+        if lo >= hi:
+            continue
+        with open(path, 'rb') as f:
+            f.seek(lo)
+            chunk = f.read(hi - lo)
+        for line in chunk.split(b'\n'):
+            if not line:
+                continue
+            if sym_keys and not any(k in line for k in sym_keys):
+                continue
+            if type_keys and not any(k in line for k in type_keys):
+                continue
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                continue  # 崩溃时写了半行
+            ts = ev.get('ts', '')
+            if (t0 and ts < t0) or (t1 and ts > t1):
+                continue
+            yield ev
+
+
+def query_events(root, symbols=None, types=None, start=None, end=None):
+    return list(iter_events(root, symbols=symbols, types=types, start=start, end=end))
+
+
+def _split(values):
+    out = []
+    for v in values or ():
+        out.extend(x.strip() for x in v.split(',') if x.strip())
+    return out or None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='vagird 结构化事件查询')
+    ap.add_argument('root', help='research 目录或其下的 events 目录')
+    ap.add_argument('--symbol', action='append', default=[], help='标的，可逗号分隔或重复')
+    ap.add_argument('--type', action='append', default=[], help='事件类型，可逗号分隔或重复')
+    ap.add_argument('--start', default=None, help='起始时间 YYYY-MM-DD[ HH:MM[:SS]]')
+    ap.add_argument('--end', default=None, help='终止时间 (含)，格式同上')
+    ap.add_argument('--summary', action='store_true', help='只打印按 标的 × 类型 的计数')
+    ap.add_argument('--limit', type=int, default=0, help='最多输出条数 (0 不限)')
+    args = ap.parse_args(argv)
+
+    t = _time.perf_counter()
+    events = iter_events(args.root, symbols=_split(args.symbol), types=_split(args.type),
+                         start=args.start, end=args.end)
+    n = 0
+    if args.summary:
+        counts = Counter((ev.get('s'), ev.get('t')) for ev in events)
+        n = sum(counts.values())
+        for (sym, etype), c in sorted(counts.items()):
+            print(f'{sym}\t{etype}\t{c}')
+    else:
+        out = sys.stdout
+        for ev in events:
+            out.write(json.dumps(ev, ensure_ascii=False) + '\n')
+            n += 1
+            if args.limit and n >= args.limit:
+                break
+    print(f'# {n} 条事件，用时 {(_time.perf_counter() - t) * 1000:.1f} ms', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
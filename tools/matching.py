@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+离线撮合引擎 (Deterministic Matching Engine)
+
+对 SimBroker 的挂单按回放价格路径做限价撮合，专门用来覆盖只有真实交易所才会触发的对账路径：
+- 部分成交：推送 status '7' 的分笔回报，最后一笔为 '8'
+- 回报延迟 / 回报丢失：持仓照常变动，但 on_trade_response 迟到或收不到 (考验 FillPatrol / SYN 补偿)
+- 涨跌停价格带：委托价超出 [p_down_price, p_up_price] 时 order() 抛出 "120162 超过涨跌停范围"
+- 委托延迟：报单在 accept_latency 秒后才参与撮合
+所有随机性来自带种子的 random.Random，同一配置同一价格路径的结果逐笔可复现。
+"""
+
+import heapq
+import random
+from datetime import timedelta
+
+
+class MatchConfig:
+    """
+    撮合参数。默认值即理想交易所：委托立即生效、穿价即全额成交、成交回报即时送达且不丢失；
+    唯一默认开启的限制是涨跌停价格带校验 (enforce_bands=True)。
+    """
+
+    def __init__(self, partial_prob=0.0, partial_ratio=0.5, accept_latency=0.0, push_delay=0.0,
+                 drop_prob=0.0, enforce_bands=True, seed=0):
+        self.partial_prob = float(partial_prob)      # 穿价时只成交一部分的概率
+        self.partial_ratio = float(partial_ratio)    # 部分成交时成交剩余量的比例 (按 100 股取整)
+        self.accept_latency = float(accept_latency)  # 委托生效延迟 (秒)
+        self.push_delay = float(push_delay)          # 成交回报延迟 (秒)
+        self.drop_prob = float(drop_prob)            # 成交回报丢失概率
+        self.enforce_bands = bool(enforce_bands)
+        self.seed = seed
+
+
+class MatchingEngine:
+    def __init__(self, broker, limits=None, config=None):
+        """
+        broker: SimBroker (负责记账)
+        limits: callable(symbol) -> (p_up_price, p_down_price) 或 None
+        """
+        self.broker = broker
+        self.cfg = config or MatchConfig()
+        self.limits = limits
+        self.rng = random.Random(self.cfg.seed)
+        self._queue = []        # (到达时刻, 序号, 回报)
+        self._seq = 0
+        self.n_partial = 0
+        self.n_dropped = 0
+        self.n_rejected = 0
+        self.n_delivered = 0
+
+    # ---- 报单校验 ----
+
+    def check_order(self, symbol, amount, limit_price):
+        if not (self.cfg.enforce_bands and limit_price and self.limits):
+            return
+        band = self.limits(symbol)
+        if not band:
+            return
+        up, down = band
+        if (up and limit_price > up + 1e-9) or (down and limit_price < down - 1e-9):
+            self.n_rejected += 1
+            raise RuntimeError(f'[120162]委托价格{limit_price:.3f}超过涨跌停范围[{down:.3f},{up:.3f}]')
+
+    # ---- 撮合 ----
+
+    def _fill_qty(self, remaining):
+        if remaining > 100 and self.cfg.partial_prob > 0 and self.rng.random() < self.cfg.partial_prob:
+            qty = int(remaining * self.cfg.partial_ratio // 100) * 100
+            if 0 < qty < remaining:
+                self.n_partial += 1
+                return qty
+        return remaining
+
+    def match(self, dt, prices):
+        """按 dt 时刻的最新价撮合所有已生效挂单，成交回报进入延迟队列。"""
+        latency = timedelta(seconds=self.cfg.accept_latency)
+        delay = timedelta(seconds=self.cfg.push_delay)
+        for o in self.broker.open_orders():
+            if latency and o.dt + latency > dt:
+                continue
+            px = prices.get(o.symbol)
+            if px is None:
+                continue
+            limit = o.price if o.price > 0 else px
+            if not ((o.amount > 0 and px <= limit) or (o.amount < 0 and px >= limit)):
+                continue
+            push = self.broker.fill(o, self._fill_qty(o.remaining), limit)
+            if self.cfg.drop_prob > 0 and self.rng.random() < self.cfg.drop_prob:
+                self.n_dropped += 1
+                continue
+            self._seq += 1
+            heapq.heappush(self._queue, (dt + delay, self._seq, push))
+
+    def pop_due(self, dt):
+        """取出 dt 之前应送达的全部成交回报 (按到达顺序)。"""
+        out = []
+        while self._queue and self._queue[0][0] <= dt:
+            out.append(heapq.heappop(self._queue)[2])
+        self.n_delivered += len(out)
+        return out
+
+    def stats(self):
+        return {'partial_fills': self.n_partial, 'dropped_pushes': self.n_dropped,
+                'rejected_orders': self.n_rejected, 'delivered_pushes': self.n_delivered,
+                'queued_pushes': len(self._queue)}
@@ -0,0 +1,723 @@
+# -*- coding: utf-8 -*-
+"""
+PTrade 离线替身 (Offline Stand-in)
+
+在本地进程内模拟 PTRADE 运行时：内存账户 / 订单簿 / K线仓库，并提供策略用到的全部全局 API
+(get_snapshot / get_position / get_open_orders / get_orders / order / cancel_order_ex /
+get_history / run_daily / run_interval / get_parameter / set_parameter / get_research_path ...)。
+vagird.py 无需任何修改即可被加载，并按真实交易日的时间线驱动，用于离线测量单 tick 延迟与 API 调用量。
+
+典型用法：
+    bars = BarStore.from_config(cfg, days=3)
+    api = PTradeAPI(bars, research_dir)
+    strat = load_strategy('vagird.py', api)
+    runner = SimRunner(strat, api)
+    runner.run()
+    print(runner.summary())
+"""
+
+import builtins
+import datetime as _dt
+import json
+import logging
+import time as _time
+import types
+from collections import Counter
+from datetime import date, datetime, timedelta
+from datetime import time as dtime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tools.matching import MatchingEngine
+
+# A 股连续竞价分钟 K 线的收盘时刻：9:31-11:30 / 13:01-15:00，共 240 根
+MINUTE_TIMES = (
+    [(datetime(2000, 1, 1, 9, 30) + timedelta(minutes=i + 1)).time() for i in range(120)]
+    + [(datetime(2000, 1, 1, 13, 0) + timedelta(minutes=i + 1)).time() for i in range(120)]
+)
+MINUTES_PER_DAY = len(MINUTE_TIMES)
+
+SESSIONS = ((dtime(9, 30), dtime(11, 30)), (dtime(13, 0), dtime(15, 0)))
+
+# PTrade 委托状态码
+ST_REPORTED = '2'   # 已报
+ST_PART_CANCELED = '5'  # 部撤
+ST_CANCELED = '6'   # 已撤
+ST_PARTIAL = '7'    # 部成
+ST_FILLED = '8'     # 已成
+ST_REJECTED = '9'   # 废单
+ACTIVE_STATUS = (ST_REPORTED, ST_PARTIAL)
+
+
+def _parse_hhmm(s):
+    h, m = str(s).split(':')[:2]
+    return dtime(int(h), int(m))
+
+
+# ---------------- K线仓库 ----------------
+
+class BarStore:
+    """
+    内存K线仓库：模拟日的分钟收盘价 [D, 240, S] + 含预热期的日线 OHLC [DD, S]。
+    仅保存 numpy 数组，DataFrame 只在 get_history 被调用时按需构造。
+    """
+
+    def __init__(self, symbols, days, minute_px, daily_dates, daily_ohlc):
+        self.symbols = list(symbols)
+        self.sym_index = {s: i for i, s in enumerate(self.symbols)}
+        self.days = list(days)
+        self.day_index = {d: i for i, d in enumerate(self.days)}
+        self.minute_px = minute_px              # [D, 240, S]
+        self.daily_dates = list(daily_dates)    # 预热期 + 模拟期
+        self.daily_ohlc = daily_ohlc            # {'open'|'high'|'low'|'close': [DD, S]}
+        self.day_offset = len(self.daily_dates) - len(self.days)
+
+    # ---- 构造 ----
+
+    @classmethod
+    def synthetic(cls, symbols, base_prices=None, days=5, warmup_days=90,
+                  start=date(2025, 1, 6), seed=7, daily_vol=0.012):
+        """按几何随机游走生成可复现的合成行情，预热期日线以 base_price 收尾。"""
+        rng = np.random.default_rng(seed)
+        S = len(symbols)
+        base = np.array([float((base_prices or {}).get(s, 1.0 + 0.01 * i)) for i, s in enumerate(symbols)])
+
+        sim_days = [d.date() for d in pd.bdate_range(start=start, periods=days)]
+        warm_days = [d.date() for d in pd.bdate_range(end=start - timedelta(days=1), periods=warmup_days)]
+
+        # 预热期：从 base 反推历史收盘
+        w_ret = rng.normal(0.0, daily_vol, size=(warmup_days, S))
+        w_close = np.empty((warmup_days, S))
+        w_close[-1] = base
+        for i in range(warmup_days - 1, 0, -1):
+            w_close[i - 1] = w_close[i] / np.exp(w_ret[i])
+        w_open = np.vstack([w_close[:1], w_close[:-1]]) * np.exp(rng.normal(0.0, daily_vol / 4, size=(warmup_days, S)))
+        spread = np.abs(rng.normal(0.0, daily_vol, size=(warmup_days, S)))
+        w_high = np.maximum(w_open, w_close) * (1 + spread / 2)
+        w_low = np.minimum(w_open, w_close) * (1 - spread / 2)
+
+        # 模拟期：分钟级随机游走
+        m_sigma = daily_vol / np.sqrt(MINUTES_PER_DAY)
+        minute_px = np.empty((days, MINUTES_PER_DAY, S))
+        d_open = np.empty((days, S))
+        prev = base.copy()
+        for d in range(days):
+            p0 = prev * np.exp(rng.normal(0.0, daily_vol / 4, size=S))
+            path = p0 * np.exp(np.cumsum(rng.normal(0.0, m_sigma, size=(MINUTES_PER_DAY, S)), axis=0))
+            minute_px[d] = np.round(path, 3)
+            d_open[d] = np.round(p0, 3)
+            prev = minute_px[d, -1]
+        s_high = np.maximum(minute_px.max(axis=1), d_open)
+        s_low = np.minimum(minute_px.min(axis=1), d_open)
+
+        daily = {
+            'open': np.round(np.vstack([w_open, d_open]), 3),
+            'high': np.round(np.vstack([w_high, s_high]), 3),
+            'low': np.round(np.vstack([w_low, s_low]), 3),
+            'close': np.round(np.vstack([w_close, minute_px[:, -1, :]]), 3),
+        }
+        return cls(symbols, sim_days, minute_px, warm_days + sim_days, daily)
+
+    @classmethod
+    def from_config(cls, symbol_config, **kw):
+        """以 symbols.json 的 base_price 作为合成行情的锚点。"""
+        syms = list(symbol_config.keys())
+        bp = {s: (c or {}).get('base_price', 1.0) for s, c in symbol_config.items()}
+        return cls.synthetic(syms, base_prices=bp, **kw)
+
+    # ---- 查询 ----
+
+    def _locate(self, dt):
+        """返回 (模拟日下标, 已完成的分钟 K 线根数)；非模拟日返回 (None, 0)。"""
+        d = self.day_index.get(dt.date())
+        if d is None:
+            return None, 0
+        t = dt.time()
+        lo, hi = 0, MINUTES_PER_DAY
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if MINUTE_TIMES[mid] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return d, lo
+
+    def prev_close(self, d):
+        return self.daily_ohlc['close'][self.day_offset + d - 1]
+
+    def price_vector(self, dt):
+        """dt 时刻各标的最新价 (分钟收盘；开盘前为开盘价/昨收)。"""
+        d, n = self._locate(dt)
+        if d is None:
+            return None
+        if n > 0:
+            return self.minute_px[d, n - 1]
+        if dt.time() >= dtime(9, 25):
+            return self.daily_ohlc['open'][self.day_offset + d]
+        return self.prev_close(d)
+
+    def snapshot(self, symbols, dt):
+        px = self.price_vector(dt)
+        if px is None:
+            return {}
+        d, _ = self._locate(dt)
+        pre = self.prev_close(d)
+        out = {}
+        for s in symbols:
+            i = self.sym_index.get(s)
+            if i is None:
+                continue
+            pc = float(pre[i])
+            out[s] = {
+                'last_px': float(px[i]),
+                'preclose_px': pc,
+                'p_up_price': round(pc * 1.1, 3),
+                'p_down_price': round(pc * 0.9, 3),
+            }
+        return out
+
+    def limits(self, symbol, dt):
+        """(涨停价, 跌停价)，按昨收 ±10% 计算。"""
+        d, _ = self._locate(dt)
+        i = self.sym_index.get(symbol)
+        if d is None or i is None:
+            return None
+        pc = float(self.prev_close(d)[i])
+        return round(pc * 1.1, 3), round(pc * 0.9, 3)
+
+    def history(self, count, frequency, fields, symbols, dt, include=False):
+        if isinstance(fields, str):
+            fields = [fields]
+        d, n = self._locate(dt)
+        out = {}
+        if frequency == '1d':
+            end = (self.day_offset + d) if d is not None else len(self.daily_dates)
+            if include and d is not None:
+                end += 1
+            start = max(0, end - int(count))
+            idx = pd.DatetimeIndex(self.daily_dates[start:end])
+            for s in symbols:
+                i = self.sym_index.get(s)
+                if i is None:
+                    continue
+                out[s] = pd.DataFrame({f: self.daily_ohlc[f][start:end, i] for f in fields}, index=idx)
+            return out
+        # 分钟线：模拟期内连续拼接
+        if d is None:
+            return out
+        end = d * MINUTES_PER_DAY + n
+        start = max(0, end - int(count))
+        flat = self.minute_px.reshape(-1, len(self.symbols))
+        stamps = [datetime.combine(self.days[k // MINUTES_PER_DAY], MINUTE_TIMES[k % MINUTES_PER_DAY]) for k in range(start, end)]
+        idx = pd.DatetimeIndex(stamps)
+        for s in symbols:
+            i = self.sym_index.get(s)
+            if i is None:
+                continue
+            col = flat[start:end, i]
+            out[s] = pd.DataFrame({f: col for f in fields}, index=idx)
+        return out
+
+
+# ---------------- 内存账户与订单簿 ----------------
+
+class SimPosition:
+    __slots__ = ('sid', 'amount', 'enable_amount', 'cost_basis', 'last_sale_price')
+
+    def __init__(self, sid, amount=0, cost_basis=0.0):
+        self.sid = sid
+        self.amount = int(amount)
+        self.enable_amount = int(amount)
+        self.cost_basis = float(cost_basis)
+        self.last_sale_price = float(cost_basis)
+
+
+class SimOrder:
+    __slots__ = ('id', 'entrust_no', 'symbol', 'amount', 'filled', 'price', 'limit',
+                 'trade_price', 'status', 'entrust_bs', 'dt')
+
+    def __init__(self, entrust_no, symbol, amount, price, dt):
+        self.id = entrust_no
+        self.entrust_no = entrust_no
+        self.symbol = symbol
+        self.amount = int(amount)
+        self.filled = 0
+        self.price = float(price or 0.0)
+        self.limit = self.price
+        self.trade_price = 0.0
+        self.status = ST_REPORTED
+        self.entrust_bs = '1' if amount > 0 else '2'
+        self.dt = dt
+
+    @property
+    def remaining(self):
+        return abs(self.amount) - self.filled
+
+    def as_dict(self):
+        return {'entrust_no': self.entrust_no, 'symbol': self.symbol, 'status': self.status,
+                'amount': self.amount, 'price': self.price, 'entrust_bs': self.entrust_bs,
+                'filled': self.filled}
+
+
+class SimBroker:
+    """
+    内存账户：现金 + 持仓 + 当日订单簿。默认 T+1 (当日买入次日可卖)。
+    只负责记账；何时成交、成交多少由 tools.matching.MatchingEngine 决定。
+    """
+
+    def __init__(self, clock, cash=10_000_000.0, t0=False):
+        self.clock = clock
+        self.cash = float(cash)
+        self.t0 = t0
+        self.positions = {}
+        self.orders = {}
+        self._open = {}
+        self._seq = 0
+        self._bid = 0
+        self.n_orders = 0
+        self.n_cancels = 0
+        self.n_fills = 0
+
+    def seed_position(self, symbol, amount, cost):
+        self.positions[symbol] = SimPosition(symbol, amount, cost)
+
+    def position(self, symbol):
+        p = self.positions.get(symbol)
+        if p is None:
+            p = self.positions[symbol] = SimPosition(symbol)
+        return p
+
+    def new_day(self):
+        """日切：撤销昨日残单、清空当日委托、可用持仓解冻。"""
+        for o in self._open.values():
+            o.status = ST_PART_CANCELED if o.filled else ST_CANCELED
+        self._open.clear()
+        self.orders.clear()
+        for p in self.positions.values():
+            p.enable_amount = p.amount
+
+    def place(self, symbol, amount, limit_price=None, entrust_no=None, check=True):
+        """报单；entrust_no 指定委托号 (回放复用实盘编号)，check=False 跳过可用数量校验。"""
+        amount = int(amount)
+        if amount == 0:
+            return None
+        if check and amount < 0 and abs(amount) > self.position(symbol).enable_amount:
+            return None
+        if entrust_no is None:
+            self._seq += 1
+            eid = str(100000 + self._seq)
+        else:
+            eid = str(entrust_no)
+        o = SimOrder(eid, symbol, amount, limit_price, self.clock())
+        self.orders[eid] = o
+        self._open[eid] = o
+        self.n_orders += 1
+        return eid
+
+    def cancel(self, entrust_no):
+        o = self._open.pop(str(entrust_no), None)
+        if o is None:
+            return False
+        o.status = ST_PART_CANCELED if o.filled else ST_CANCELED
+        self.n_cancels += 1
+        return True
+
+    def open_orders(self, symbol=None):
+        return [o for o in self._open.values() if symbol is None or o.symbol == symbol]
+
+    def day_orders(self, symbol=None):
+        return [o for o in self.orders.values() if symbol is None or o.symbol == symbol]
+
+    def fill(self, o, qty, price):
+        """成交 qty 股，更新持仓/现金/订单，返回 PTrade 格式的成交推送。"""
+        qty = int(qty)
+        p = self.position(o.symbol)
+        if o.amount > 0:
+            new_amt = p.amount + qty
+            p.cost_basis = (p.cost_basis * p.amount + price * qty) / new_amt if new_amt else 0.0
+            p.amount = new_amt
+            if self.t0:
+                p.enable_amount += qty
+            self.cash -= price * qty
+        else:
+            p.amount -= qty
+            p.enable_amount = max(0, p.enable_amount - qty)
+            if p.amount <= 0:
+                p.cost_basis = 0.0
+            self.cash += price * qty
+        p.last_sale_price = price
+        o.trade_price = (o.trade_price * o.filled + price * qty) / (o.filled + qty)
+        o.filled += qty
+        o.status = ST_FILLED if o.filled >= abs(o.amount) else ST_PARTIAL
+        if o.status == ST_FILLED:
+            self._open.pop(o.entrust_no, None)
+        self._bid += 1
+        self.n_fills += 1
+        return {'entrust_no': o.entrust_no, 'business_id': str(900000 + self._bid),
+                'business_amount': qty, 'business_price': price, 'stock_code': o.symbol,
+                'entrust_bs': o.entrust_bs, 'status': o.status}
+
+
+class SimPortfolio:
+    def __init__(self, broker):
+        self._broker = broker
+
+    @property
+    def available_cash(self):
+        return self._broker.cash
+
+    @property
+    def positions(self):
+        return self._broker.positions
+
+
+class SimContext:
+    """PTrade context 替身：策略会在上面自由挂载属性。"""
+
+    def __init__(self, api):
+        self.current_dt = api.now_dt
+        self.portfolio = SimPortfolio(api.broker)
+
+
+# ---------------- PTrade 全局 API ----------------
+
+class PTradeAPI:
+    """
+    PTrade 全局函数的进程内实现，并统计每个 API 的调用次数 (calls)。
+    namespace() 返回注入策略模块全局变量的函数表。
+    """
+
+    API_NAMES = (
+        'get_snapshot', 'get_position', 'get_positions', 'get_open_orders', 'get_orders',
+        'get_order', 'get_all_orders', 'order', 'cancel_order_ex', 'get_history',
+        'run_daily', 'run_interval', 'get_parameter', 'set_parameter',
+        'get_research_path', 'get_user_name',
+    )
+
+    def __init__(self, bars, research_dir, user_name='sim', cash=10_000_000.0, t0=False, match_config=None):
+        self.bars = bars
+        self.research_dir = Path(research_dir)
+        self.research_dir.mkdir(parents=True, exist_ok=True)
+        self.user_name = user_name
+        self.now_dt = datetime.combine(bars.days[0], dtime(9, 0))
+        self.broker = SimBroker(lambda: self.now_dt, cash=cash, t0=t0)
+        self.engine = MatchingEngine(self.broker, limits=lambda s: self.bars.limits(s, self.now_dt),
+                                     config=match_config)
+        self.params = {}
+        self.daily_tasks = []
+        self.interval_tasks = []
+        self.calls = Counter()
+        self.log = logging.getLogger('ptrade.sim')
+        if not self.log.handlers:
+            self.log.addHandler(logging.NullHandler())
+
+    # ---- 时钟 ----
+
+    def set_time(self, dt):
+        self.now_dt = dt
+
+    def prices(self, dt=None):
+        px = self.bars.price_vector(dt or self.now_dt)
+        if px is None:
+            return {}
+        return dict(zip(self.bars.symbols, px.tolist()))
+
+    # ---- 行情 ----
+
+    def get_snapshot(self, security):
+        syms = [security] if isinstance(security, str) else list(security or [])
+        return self.bars.snapshot(syms, self.now_dt)
+
+    def get_history(self, count, frequency='1d', field='close', security_list=None,
+                    fq=None, include=False, fill='nan', is_dict=False):
+        syms = [security_list] if isinstance(security_list, str) else list(security_list or self.bars.symbols)
+        return self.bars.history(count, frequency, field, syms, self.now_dt, include=include)
+
+    # ---- 账户 ----
+
+    def get_position(self, security):
+        return self.broker.position(security)
+
+    def get_positions(self, security_list=None):
+        if security_list is None:
+            return dict(self.broker.positions)
+        syms = [security_list] if isinstance(security_list, str) else security_list
+        return {s: self.broker.position(s) for s in syms}
+
+    def get_open_orders(self, security=None):
+        return self.broker.open_orders(security)
+
+    def get_orders(self, security=None):
+        return self.broker.day_orders(security)
+
+    def get_order(self, order_id):
+        return self.broker.orders.get(str(order_id))
+
+    def get_all_orders(self, security=None):
+        return [o.as_dict() for o in self.broker.day_orders(security)]
+
+    def order(self, security, amount, limit_price=None):
+        self.engine.check_order(security, amount, limit_price)
+        return self.broker.place(security, amount, limit_price)
+
+    def cancel_order_ex(self, order_param):
+        if isinstance(order_param, dict):
+            eid = order_param.get('entrust_no')
+        else:
+            eid = getattr(order_param, 'entrust_no', None)
+        return self.broker.cancel(eid)
+
+    # ---- 调度 / 参数 / 环境 ----
+
+    def run_daily(self, context, func, time='9:31'):
+        self.daily_tasks.append((_parse_hhmm(time), func))
+
+    def run_interval(self, context, func, seconds=10):
+        self.interval_tasks.append((max(3, int(seconds)), func))
+
+    def get_parameter(self, key):
+        if key not in self.params:
+            raise KeyError(key)
+        return json.loads(self.params[key])
+
+    def set_parameter(self, key, value):
+        # 与平台一致：只接受可序列化对象
+        self.params[key] = json.dumps(value)
+
+    def get_research_path(self):
+        return str(self.research_dir) + '/'
+
+    def get_user_name(self):
+        return self.user_name
+
+    # ---- 注入 ----
+
+    def namespace(self):
+        ns = {'log': self.log}
+        calls = self.calls
+        for name in self.API_NAMES:
+            fn = getattr(self, name)
+
+            def counted(*a, _fn=fn, _name=name, **kw):
+                calls[_name] += 1
+                return _fn(*a, **kw)
+
+            counted.__name__ = name
+            ns[name] = counted
+        return ns
+
+    # ---- 时钟：替身本身即是注入给策略的模拟时钟 (vagird.set_clock) ----
+
+    def now(self):
+        return self.now_dt
+
+    def sleep(self, seconds):
+        self.now_dt = self.now_dt + timedelta(seconds=float(seconds))
+
+    def sim_modules(self):
+        """旧版策略文件 (没有 set_clock) 的兜底：把 datetime / time 模块替换成读模拟时间的版本。"""
+        api = self
+
+        class SimDateTime(_dt.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return api.now_dt
+
+            @classmethod
+            def today(cls):
+                return api.now_dt
+
+        dt_mod = types.ModuleType('datetime')
+        dt_mod.__dict__.update({k: getattr(_dt, k) for k in dir(_dt) if not k.startswith('__')})
+        dt_mod.datetime = SimDateTime
+
+        tm_mod = types.ModuleType('time')
+        tm_mod.__dict__.update({k: getattr(_time, k) for k in dir(_time) if not k.startswith('__')})
+        tm_mod.time = lambda: api.now_dt.timestamp()
+        tm_mod.sleep = api.sleep
+        return {'datetime': dt_mod, 'time': tm_mod}
+
+
+def load_strategy(path, api, module_name='vagird'):
+    """
+    以 PTrade 的方式加载策略文件：先注入全局 API，再执行模块代码，
+    然后把替身注册为策略时钟 (set_clock)，所有时间窗口/冷却期都跟随模拟时间。
+    没有 set_clock 的旧版策略文件退回到导入重定向 (datetime / time 换成模拟模块)。
+    """
+    path = Path(path)
+    source = path.read_text(encoding='utf-8')
+    mod = types.ModuleType(module_name)
+    mod.__file__ = str(path)
+    ns = mod.__dict__
+    ns.update(api.namespace())
+
+    if 'def set_clock' not in source:
+        fake = api.sim_modules()
+        real_import = builtins.__import__
+
+        def _import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level == 0 and name in fake:
+                return fake[name]
+            return real_import(name, globals, locals, fromlist, level)
+
+        sim_builtins = dict(builtins.__dict__)
+        sim_builtins['__import__'] = _import
+        ns['__builtins__'] = sim_builtins
+
+    exec(compile(source, str(path), 'exec'), ns)
+    if hasattr(mod, 'set_clock'):
+        mod.set_clock(api)
+    return mod
+
+
+def prepare_research_dir(research_dir, symbol_config, extra_configs=None):
+    """写入 config/symbols.json (以及可选的 strategy.json 等) 到研究目录。"""
+    root = Path(research_dir)
+    (root / 'config').mkdir(parents=True, exist_ok=True)
+    (root / 'config' / 'symbols.json').write_text(json.dumps(symbol_config, ensure_ascii=False, indent=2), encoding='utf-8')
+    for name, payload in (extra_configs or {}).items():
+        (root / 'config' / name).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding='utf-8')
+    return root
+
+
+def synthetic_universe(n, seed=11):
+    """生成 n 个标的的 symbols.json 配置，参数分布贴近实盘 ETF。"""
+    rng = np.random.default_rng(seed)
+    cfg = {}
+    for i in range(n):
+        sym = f"{510000 + i:06d}.SS" if i % 2 == 0 else f"{159000 + i:06d}.SZ"
+        px = round(float(rng.uniform(0.8, 8.0)), 3)
+        unit = max(100, int(round(1500 / px / 100)) * 100)
+        cfg[sym] = {'grid_unit': unit, 'initial_base_position': int(rng.integers(0, 20)) * 100,
+                    'base_price': px, 'dingtou_base': 850, 'dingtou_rate': 0.0058}
+    return cfg
+
+
+# ---------------- 时间线驱动 ----------------
+
+class SimRunner:
+    """
+    按交易日时间线驱动策略：
+    09:10 before_trading_start → run_daily 任务 → 每分钟 handle_data
+    → run_interval 任务 (仅连续竞价时段) → 15:30 after_trading_end。
+    每个事件执行前先按当前价撮合，并把已到期的成交回报送入 on_trade_response。
+    handle_data 的耗时与 API 调用增量逐 tick 记录在 self.ticks。
+    """
+
+    BEFORE_T = dtime(9, 10)
+    AFTER_T = dtime(15, 30)
+
+    def __init__(self, strategy, api, interval=True, seed_positions=True):
+        self.strategy = strategy
+        self.api = api
+        self.interval = interval
+        self.seed_positions = seed_positions
+        self.context = None
+        self.ticks = []          # [(耗时秒, 本 tick API 调用数)]
+        self.tick_calls = Counter()
+        self.trade_pushes = 0
+
+    def _seed(self):
+        cfg = self._symbol_config()
+        for sym, c in cfg.items():
+            amt = int((c or {}).get('initial_base_position', 0) or 0)
+            if amt > 0:
+                self.api.broker.seed_position(sym, amt, float(c.get('base_price', 1.0)))
+
+    def _symbol_config(self):
+        p = self.api.research_dir / 'config' / 'symbols.json'
+        return json.loads(p.read_text(encoding='utf-8')) if p.exists() else {}
+
+    def initialize(self):
+        if self.seed_positions:
+            self._seed()
+        self.api.set_time(datetime.combine(self.api.bars.days[0], dtime(9, 0)))
+        self.context = SimContext(self.api)
+        self.strategy.initialize(self.context)
+        return self.context
+
+    def _timeline(self, day):
+        ev = [(datetime.combine(day, self.BEFORE_T), 0, 'before', None)]
+        for t, fn in self.api.daily_tasks:
+            ev.append((datetime.combine(day, t), 1, 'daily', fn))
+        for t in MINUTE_TIMES:
+            ev.append((datetime.combine(day, t), 2, 'bar', None))
+        if self.interval:
+            for sec, fn in self.api.interval_tasks:
+                for s, e in SESSIONS:
+                    cur, end = datetime.combine(day, s), datetime.combine(day, e)
+                    while cur <= end:
+                        ev.append((cur, 3, 'interval', fn))
+                        cur += timedelta(seconds=sec)
+        ev.append((datetime.combine(day, self.AFTER_T), 4, 'after', None))
+        ev.sort(key=lambda x: (x[0], x[1]))
+        return ev
+
+    def _set_time(self, dt):
+        self.api.set_time(dt)
+        self.context.current_dt = dt
+
+    def _deliver(self, pushes):
+        if pushes:
+            self.trade_pushes += len(pushes)
+            self.strategy.on_trade_response(self.context, pushes)
+
+    def _sync_exchange(self, dt):
+        eng = self.api.engine
+        eng.match(dt, self.api.prices(dt))
+        self._deliver(eng.pop_due(dt))
+
+    def on_bar(self, dt):
+        """撮合 → 推送成交 → handle_data (计时)。"""
+        self._sync_exchange(dt)
+        before = sum(self.api.calls.values())
+        snap = Counter(self.api.calls)
+        t0 = _time.perf_counter()
+        self.strategy.handle_data(self.context, {})
+        el = _time.perf_counter() - t0
+        self.ticks.append((el, sum(self.api.calls.values()) - before))
+        self.tick_calls.update(self.api.calls - snap)
+
+    def run_day(self, day):
+        self.api.broker.new_day()
+        for dt, _, kind, fn in self._timeline(day):
+            self._set_time(dt)
+            if kind == 'bar':
+                self.on_bar(dt)
+            elif kind == 'interval':
+                self._sync_exchange(dt)
+                fn(self.context)
+            elif kind == 'daily':
+                fn(self.context)
+            elif kind == 'before' and hasattr(self.strategy, 'before_trading_start'):
+                self.strategy.before_trading_start(self.context, {})
+            elif kind == 'after' and hasattr(self.strategy, 'after_trading_end'):
+                self.strategy.after_trading_end(self.context, {})
+
+    def run(self, days=None):
+        if self.context is None:
+            self.initialize()
+        for day in (days or self.api.bars.days):
+            self.run_day(day)
+        return self
+
+    def summary(self):
+        el = np.array([t[0] for t in self.ticks]) * 1000.0 if self.ticks else np.zeros(1)
+        n = max(1, len(self.ticks))
+        b = self.api.broker
+        return {
+            'ticks': len(self.ticks),
+            'symbols': len(self.api.bars.symbols),
+            'tick_ms_mean': float(el.mean()),
+            'tick_ms_p50': float(np.percentile(el, 50)),
+            'tick_ms_p99': float(np.percentile(el, 99)),
+            'tick_ms_max': float(el.max()),
+            'api_calls_per_tick': round(sum(t[1] for t in self.ticks) / n, 2),
+            'api_calls_per_tick_by_name': {k: round(v / n, 2) for k, v in self.tick_calls.most_common()},
+            'api_calls_total': dict(self.api.calls.most_common()),
+            'orders': b.n_orders, 'cancels': b.n_cancels, 'fills': b.n_fills,
+            'trade_pushes': self.trade_pushes,
+            **self.api.engine.stats(),
+        }
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+确定性回放引擎 (Deterministic Replay)
+
+读取策略在实盘/模拟盘开启 replay.record 后写下的 replay/<日期>.jsonl，
+把分钟快照与成交推送按原顺序重新喂给 handle_data / on_trade_response，
+订单与持仓 API 由进程内替身扮演：
+- 报单按 (标的, 数量, 价格) 复用录制时的委托号或拒单原因
+- 持仓与当日委托按录制的账户增量 (acct) 对齐，丢失/延迟的成交推送原样复现
+- 订单状态查询优先返回录制结果
+- 日线取自 init 记录，分钟线由录制的快照拼接
+run_interval 任务只在有补单待触发时才逐 3 秒推进，其余时间直接跳过，回放以 CPU 速度进行。
+
+    python -m tools.replay run  <录制目录>  --out out_a
+    python -m tools.replay run  <录制目录>  --out out_b --strategy 3.13.14.py
+    python -m tools.replay diff out_a out_b          # state/*.json 逐字节比对
+"""
+
+import argparse
+import json
+import sys
+import time as _time
+from collections import defaultdict, deque
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from tools.ptrade_sim import (ACTIVE_STATUS, SESSIONS, PTradeAPI, SimContext, SimRunner, load_strategy,
+                              prepare_research_dir)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def read_recording(path):
+    """逐行解析录制文件，返回 [(datetime, kind, payload)]；末尾被截断的半行直接忽略。"""
+    out = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            out.append((datetime.fromisoformat(rec['t']), rec['k'], rec['d']))
+    return out
+
+
+def recording_days(rec_dir, start=None, end=None):
+    files = sorted(Path(rec_dir).glob('*.jsonl'))
+    days = []
+    for f in files:
+        try:
+            d = date.fromisoformat(f.stem)
+        except ValueError:
+            continue
+        if (start and d < start) or (end and d > end):
+            continue
+        days.append((d, f))
+    return days
+
+
+# ---------------- 录制行情仓库 ----------------
+
+class ReplayBars:
+    """与 BarStore 同接口：快照取最近一条 snap 记录，日线来自 init，分钟线由快照拼接。"""
+
+    def __init__(self, days):
+        self.days = list(days)
+        self.symbols = []
+        self._snap = {}
+        self._daily = defaultdict(dict)    # sym -> {date_str: (o, h, l, c)}
+        self._minute = defaultdict(list)   # sym -> [(dt, px)]
+
+    def add_daily(self, daily):
+        for sym, rows in (daily or {}).items():
+            book = self._daily[sym]
+            for d, o, h, l, c in rows:
+                book[d] = (o, h, l, c)
+
+    def set_snapshot(self, dt, snaps):
+        self._snap = snaps
+        minute = dt.replace(second=0, microsecond=0)
+        for sym, snap in snaps.items():
+            px = snap.get('last_px') or snap.get('last') or snap.get('price')
+            if px:
+                bars = self._minute[sym]
+                if bars and bars[-1][0] == minute:
+                    bars[-1] = (minute, px)
+                else:
+                    bars.append((minute, px))
+
+    def snapshot(self, symbols, dt):
+        return {s: self._snap[s] for s in symbols if s in self._snap}
+
+    def limits(self, symbol, dt):
+        snap = self._snap.get(symbol)
+        if not snap:
+            return None
+        return snap.get('p_up_price'), snap.get('p_down_price')
+
+    def price_vector(self, dt):
+        return None
+
+    def history(self, count, frequency, fields, symbols, dt, include=False):
+        if isinstance(fields, str):
+            fields = [fields]
+        out = {}
+        if frequency == '1d':
+            cutoff = dt.strftime('%Y-%m-%d')
+            for s in symbols:
+                book = self._daily.get(s)
+                if not book:
+                    continue
+                keys = sorted(k for k in book if (k <= cutoff if include else k < cutoff))[-int(count):]
+                cols = {'open': 0, 'high': 1, 'low': 2, 'close': 3}
+                out[s] = pd.DataFrame({f: [book[k][cols[f]] for k in keys] for f in fields},
+                                      index=pd.DatetimeIndex(keys))
+            return out
+        for s in symbols:
+            bars = [b for b in self._minute.get(s, ()) if b[0] <= dt][-int(count):]
+            if not bars:
+                continue
+            out[s] = pd.DataFrame({f: [b[1] for b in bars] for f in fields},
+                                  index=pd.DatetimeIndex([b[0] for b in bars]))
+        return out
+
+
+# ---------------- 回放版 PTrade API ----------------
+
+class ReplayAPI(PTradeAPI):
+    def __init__(self, bars, research_dir, **kw):
+        super().__init__(bars, research_dir, **kw)
+        self._orders = defaultdict(deque)   # (sym, amount, price) -> deque[录制结果]
+        self._ostat = defaultdict(deque)    # entrust_no -> deque[status]
+        self._deferred = {}                 # entrust_no -> 录制行 (替身中尚未报出)
+        self.diverged_orders = 0
+
+    def load_day(self, records):
+        self._orders.clear()
+        self._ostat.clear()
+        self._deferred.clear()
+        for _, kind, d in records:
+            if kind == 'order':
+                self._orders[(d['s'], int(d['a']), round(float(d['p'] or 0), 3))].append(d)
+            elif kind == 'ostat':
+                self._ostat[str(d['no'])].append(d['s'])
+
+    def get_snapshot(self, security):
+        syms = [security] if isinstance(security, str) else list(security or [])
+        return self.bars.snapshot(syms, self.now_dt)
+
+    def order(self, security, amount, limit_price=None):
+        q = self._orders.get((security, int(amount), round(float(limit_price or 0), 3)))
+        if q:
+            rec = q.popleft()
+            if rec.get('err'):
+                raise RuntimeError(rec['err'])
+            if not rec.get('no'):
+                return None
+            eid = self.broker.place(security, amount, limit_price, entrust_no=rec['no'], check=False)
+            row = self._deferred.pop(str(rec['no']), None)
+            if row:
+                self._apply_order_row(str(rec['no']), row)
+            return eid
+        # 策略行为与录制时不同：用独立编号段，避免与实盘委托号冲突
+        self.diverged_orders += 1
+        self.broker._seq += 1
+        return self.broker.place(security, amount, limit_price, entrust_no=f'R{self.broker._seq}')
+
+    def get_order(self, order_id):
+        q = self._ostat.get(str(order_id))
+        if q:
+            return {'entrust_no': str(order_id), 'status': q.popleft()}
+        return self.broker.orders.get(str(order_id))
+
+    def _apply_order_row(self, eid, row):
+        o = self.broker.orders[eid]
+        _, _, _, filled, status, trade_px = row
+        o.filled, o.status, o.trade_price = int(filled or 0), str(status), float(trade_px or 0)
+        if o.status in ACTIVE_STATUS:
+            self.broker._open[eid] = o
+        else:
+            self.broker._open.pop(eid, None)
+
+    def sync_account(self, acct):
+        """
+        按录制的账户增量对齐替身持仓与当日委托。
+        同一 tick 内较晚才报出的委托可能先出现在增量里：替身里还没有的委托先挂起，
+        等策略在回放中真正报出该委托号时再套用，避免“未卜先知”。
+        """
+        for sym, (amt, enable, cost) in (acct.get('pos') or {}).items():
+            p = self.broker.position(sym)
+            p.amount, p.enable_amount, p.cost_basis = int(amt), int(enable), float(cost)
+        for eid, row in (acct.get('ord') or {}).items():
+            if eid in self.broker.orders:
+                self._apply_order_row(eid, row)
+            else:
+                self._deferred[eid] = row
+
+
+# ---------------- 回放驱动 ----------------
+
+class ReplayDriver(SimRunner):
+    def __init__(self, strategy, api, day_files):
+        super().__init__(strategy, api, interval=True, seed_positions=False)
+        self.day_files = day_files
+        self.interval_sec = 3
+
+    # ---- run_interval 惰性推进 ----
+
+    def _first_tick(self, day):
+        return datetime.combine(day, SESSIONS[0][0])
+
+    def _next_tick(self, cur):
+        nxt = cur + timedelta(seconds=self.interval_sec)
+        for s, e in SESSIONS:
+            s_dt, e_dt = datetime.combine(cur.date(), s), datetime.combine(cur.date(), e)
+            if nxt < s_dt:
+                return s_dt
+            if nxt <= e_dt:
+                return nxt
+        return None
+
+    def _interval_needed(self):
+        return any(st.get('_rehang_due_ts') for st in getattr(self.context, 'state', {}).values())
+
+    def _run_intervals(self, until, inclusive=False):
+        while self._tick is not None and (self._tick < until or (inclusive and self._tick <= until)):
+            if self._interval_needed():
+                self._set_time(self._tick)
+                for _, fn in self.api.interval_tasks:
+                    fn(self.context)
+                self._tick = self._next_tick(self._tick)
+            else:
+                # 无待补单：直接跳到 until 之前最后一个 3 秒网格点之后
+                gap = (until - self._tick).total_seconds()
+                steps = int(gap // self.interval_sec)
+                if steps <= 0:
+                    self._tick = self._next_tick(self._tick)
+                    continue
+                jump = self._tick + timedelta(seconds=steps * self.interval_sec)
+                if jump.date() != self._tick.date():
+                    self._tick = None
+                else:
+                    self._tick = jump if any(datetime.combine(jump.date(), s) <= jump <= datetime.combine(jump.date(), e)
+                                             for s, e in SESSIONS) else self._next_tick(jump)
+
+    def _run_daily_tasks(self, until):
+        while self._daily and self._daily[0][0] <= until:
+            t, fn = self._daily.popleft()
+            self._run_intervals(t)
+            self._set_time(t)
+            fn(self.context)
+
+    def _advance_to(self, dt):
+        self._run_daily_tasks(dt)
+        self._run_intervals(dt)
+        self._set_time(dt)
+
+    # ---- 主流程 ----
+
+    def _bootstrap(self, init, t):
+        root = self.api.research_dir
+        prepare_research_dir(root, init.get('cfg') or {})
+        self.api.bars.symbols = list((init.get('cfg') or {}).keys())
+        (root / 'state').mkdir(parents=True, exist_ok=True)
+        for sym, store in (init.get('state') or {}).items():
+            (root / 'state' / f'{sym}.json').write_text(json.dumps(store, indent=2), encoding='utf-8')
+        self.api.set_time(t)
+        self.context = SimContext(self.api)
+        self.strategy.initialize(self.context)
+
+    def _seed_positions(self, init):
+        for sym, (amt, enable, cost) in (init.get('pos') or {}).items():
+            p = self.api.broker.position(sym)
+            p.amount, p.enable_amount, p.cost_basis = int(amt), int(enable), float(cost)
+
+    def replay_day(self, day, path):
+        records = read_recording(path)
+        init = next((d for t, k, d in records if k == 'init'), None)
+        init_t = next((t for t, k, d in records if k == 'init'), datetime.combine(day, self.BEFORE_T))
+        self.api.broker.new_day()
+        self.api.load_day(records)
+        if init:
+            self.api.bars.add_daily(init.get('daily'))
+            self._seed_positions(init)
+        if self.context is None:
+            self._bootstrap(init or {}, init_t)
+
+        self._daily = deque(sorted(((datetime.combine(day, t), fn) for t, fn in self.api.daily_tasks), key=lambda x: x[0]))
+        self._tick = self._first_tick(day)
+        pre_t = init_t if (init and init.get('phase') == 'pre') else datetime.combine(day, self.BEFORE_T)
+        self._advance_to(pre_t)
+        self.strategy.before_trading_start(self.context, {})
+
+        for t, kind, d in records:
+            if kind == 'snap':
+                self._advance_to(t)
+                self.api.bars.set_snapshot(t, d)
+                before = sum(self.api.calls.values())
+                t0 = _time.perf_counter()
+                self.strategy.handle_data(self.context, {})
+                self.ticks.append((_time.perf_counter() - t0, sum(self.api.calls.values()) - before))
+            elif kind == 'acct':
+                self._advance_to(t)
+                self.api.sync_account(d)
+            elif kind == 'trade':
+                self._advance_to(t)
+                self.trade_pushes += len(d or [])
+                self.strategy.on_trade_response(self.context, d)
+
+        end_t = datetime.combine(day, SESSIONS[-1][1])
+        self._run_daily_tasks(end_t)
+        self._run_intervals(end_t, inclusive=True)
+        self._set_time(datetime.combine(day, self.AFTER_T))
+        if hasattr(self.strategy, 'after_trading_end'):
+            self.strategy.after_trading_end(self.context, {})
+
+    def run(self):
+        for day, path in self.day_files:
+            self.replay_day(day, path)
+        return self
+
+
+def build_replay(rec_dir, out_dir, strategy_path=None, start=None, end=None):
+    day_files = recording_days(rec_dir, start, end)
+    if not day_files:
+        raise SystemExit(f'{rec_dir} 下没有录制文件')
+    bars = ReplayBars([d for d, _ in day_files])
+    api = ReplayAPI(bars, out_dir)
+    strat = load_strategy(strategy_path or ROOT / 'vagird.py', api)
+    return ReplayDriver(strat, api, day_files)
+
+
+def diff_states(dir_a, dir_b):
+    """逐字节比对两次回放的 state/*.json，返回不一致的文件名列表。"""
+    a, b = Path(dir_a) / 'state', Path(dir_b) / 'state'
+    names = sorted({p.name for p in a.glob('*.json')} | {p.name for p in b.glob('*.json')})
+    bad = []
+    for n in names:
+        pa, pb = a / n, b / n
+        if not (pa.exists() and pb.exists()) or pa.read_bytes() != pb.read_bytes():
+            bad.append(n)
+    return bad
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='vagird 确定性回放')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    r = sub.add_parser('run', help='回放录制目录 (research_path/replay)')
+    r.add_argument('recording')
+    r.add_argument('--out', required=True, help='回放用的研究目录 (state/ logs/ reports/ 写在这里)')
+    r.add_argument('--strategy', default=None)
+    r.add_argument('--from', dest='start', type=date.fromisoformat, default=None)
+    r.add_argument('--to', dest='end', type=date.fromisoformat, default=None)
+    d = sub.add_parser('diff', help='逐字节比对两次回放的 state/*.json')
+    d.add_argument('a')
+    d.add_argument('b')
+    args = ap.parse_args(argv)
+
+    if args.cmd == 'diff':
+        bad = diff_states(args.a, args.b)
+        for n in bad:
+            print(f'DIFF {n}')
+        print('一致' if not bad else f'{len(bad)} 个文件不一致')
+        return 1 if bad else 0
+
+    t0 = _time.perf_counter()
+    drv = build_replay(args.recording, args.out, args.strategy, args.start, args.end).run()
+    out = drv.summary()
+    out.update({'days': len(drv.day_files), 'wall_s': round(_time.perf_counter() - t0, 3),
+                'diverged_orders': drv.api.diverged_orders})
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+并行参数扫描 (Parameter Sweep)
+
+把参数网格展开成全部组合，在进程池里逐个跑 tools.backtest 的向量化回测，输出排名表。
+- 行情只生成一次，落盘为 .npy，工作进程以 mmap 只读打开，多核共享同一份页缓存；
+- 每个组合的结果一完成就追加到 results.jsonl，中断后带 --resume 重跑会跳过已完成的组合；
+- 全部结束后按 --rank 指标排序写出 ranked.csv，并打印前 --top 名。
+
+参数名规则：
+- 不带点的键是 symbols.json 里的标的参数 (grid_unit / max_grid_count / dingtou_base / dingtou_rate /
+  tp_cool_weeks / tp_min_weeks / tp_min_value ...)，对全部标的生效；
+  取值写成 "x1.5" 表示按各标的原配置等比缩放 (grid_unit、dingtou_base 这类各标的不同的量)；
+- 带点的键是 strategy.json 的分节参数 (market.unlock_atr_multiplier / market.max_stack_size /
+  va.value_threshold_k ...)，经 StrategyConfig 原有的加载路径生效。
+
+    python -m tools.sweep --grid sweep.json --years 10 --freq 1d --out sweep_out
+    python -m tools.sweep -p grid_unit=x0.5,x1,x2 -p market.max_stack_size=3,5,8 -p va.value_threshold_k=0.8,1,1.5
+
+sweep.json 示例：
+    {"grid_unit": ["x0.5", "x1", "x2"], "max_grid_count": [8, 12, 16],
+     "market.unlock_atr_multiplier": [3, 5, 8], "va.value_threshold_k": [0.8, 1.0]}
+"""
+
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time as _time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from tools.backtest import ROOT, BacktestData, VectorBacktest
+
+_WORKER = {}
+
+
+def _parse_value(v):
+    if isinstance(v, str):
+        s = v.strip()
+        if s.startswith('x'):
+            return s
+        for cast in (int, float):
+            try:
+                return cast(s)
+            except ValueError:
+                pass
+        return {'true': True, 'false': False}.get(s.lower(), s)
+    return v
+
+
+def parse_params(items):
+    """['grid_unit=x0.5,x1', 'market.max_stack_size=3,5'] -> {'grid_unit': ['x0.5', 'x1'], ...}"""
+    grid = {}
+    for item in items or ():
+        key, _, vals = item.partition('=')
+        if not vals:
+            raise ValueError(f'参数格式应为 key=v1,v2,...: {item}')
+        grid[key.strip()] = [_parse_value(v) for v in vals.split(',')]
+    return grid
+
+
+def expand(grid):
+    """参数网格 -> 组合列表 (键顺序固定，保证编号可复现)。"""
+    keys = sorted(grid)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*(grid[k] for k in keys))]
+
+
+def combo_key(params):
+    return json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+
+def apply_params(symbol_config, params):
+    """返回 (标的配置, strategy.json 内容)；不修改传入的原配置。"""
+    sym_cfg = {s: dict(c) for s, c in symbol_config.items()}
+    strat_cfg = {}
+    for key, val in params.items():
+        if '.' in key:
+            section, _, name = key.partition('.')
+            strat_cfg.setdefault(section, {})[name] = val
+            continue
+        for sym, c in sym_cfg.items():
+            if isinstance(val, str) and val.startswith('x'):
+                orig = c.get(key, 0)
+                scaled = orig * float(val[1:])
+                if key == 'grid_unit':
+                    scaled = max(100, int(round(scaled / 100)) * 100)
+                elif isinstance(orig, int):
+                    scaled = int(round(scaled))
+                c[key] = scaled
+            else:
+                c[key] = val
+    return sym_cfg, strat_cfg
+
+
+# ---------------- 工作进程 ----------------
+
+def _init_worker(data_dir, symbol_config):
+    _WORKER['data'] = BacktestData.load(data_dir, mmap_mode='r')
+    _WORKER['cfg'] = symbol_config
+
+
+def _run_one(idx, params):
+    sym_cfg, strat_cfg = apply_params(_WORKER['cfg'], params)
+    t0 = _time.perf_counter()
+    try:
+        res = VectorBacktest(_WORKER['data'], sym_cfg, strategy_config=strat_cfg or None).run()
+    except Exception as e:
+        return {'idx': idx, 'params': params, 'error': f'{type(e).__name__}: {e}'}
+    row = {'idx': idx, 'params': params}
+    row.update(res.summary())
+    row['market_value'] = round(sum(r['market_value'] for r in res.per_symbol.values()), 2)
+    row['run_s'] = round(_time.perf_counter() - t0, 3)
+    return row
+
+
+# ---------------- 主进程 ----------------
+
+def _load_done(path):
+    done = {}
+    if path.exists():
+        for line in path.read_text(encoding='utf-8').splitlines():
+            if line.strip():
+                row = json.loads(line)
+                done[combo_key(row['params'])] = row
+    return done
+
+
+def ranked_table(rows, rank='total_pnl', ascending=False):
+    flat = []
+    for r in rows:
+        if 'error' in r:
+            continue
+        item = {k: v for k, v in r.items() if k != 'params'}
+        item.update(r['params'])
+        flat.append(item)
+    df = pd.DataFrame(flat)
+    if df.empty:
+        return df
+    return df.sort_values(rank, ascending=ascending, kind='stable').reset_index(drop=True)
+
+
+def run_sweep(grid, symbol_config, data, out_dir, workers=None, rank='total_pnl', resume=False, progress=None):
+    """
+    data: BacktestData (会落盘到 out_dir/bars 供工作进程 mmap)；返回排序后的 DataFrame。
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    data_dir = data.save(out_dir / 'bars')
+    results_path = out_dir / 'results.jsonl'
+    done = _load_done(results_path) if resume else {}
+    if not resume and results_path.exists():
+        results_path.unlink()
+
+    combos = expand(grid)
+    todo = [(i, p) for i, p in enumerate(combos) if combo_key(p) not in done]
+    rows = [done[combo_key(p)] for p in combos if combo_key(p) in done]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo) or 1))
+    with results_path.open('a', encoding='utf-8') as fh, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(str(data_dir), symbol_config)) as pool:
+        futures = [pool.submit(_run_one, i, p) for i, p in todo]
+        for n, fut in enumerate(as_completed(futures), 1):
+            row = fut.result()
+            rows.append(row)
+            fh.write(json.dumps(row, ensure_ascii=False) + '\n')
+            fh.flush()
+            if progress:
+                progress(n, len(todo), row)
+
+    table = ranked_table(rows, rank=rank)
+    table.to_csv(out_dir / 'ranked.csv', index=False, encoding='utf-8-sig')
+    return table
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='vagird 并行参数扫描')
+    ap.add_argument('--grid', default=None, help='参数网格 JSON 文件')
+    ap.add_argument('-p', '--param', action='append', default=[], help='key=v1,v2,...，可重复')
+    ap.add_argument('--config', default=str(ROOT / 'config' / 'symbols.json'))
+    ap.add_argument('--years', type=float, default=3.0)
+    ap.add_argument('--freq', choices=('1m', '1d'), default='1d')
+    ap.add_argument('--seed', type=int, default=7)
+    ap.add_argument('--vol', type=float, default=0.012)
+    ap.add_argument('--workers', type=int, default=None, help='进程数 (默认 CPU 核数)')
+    ap.add_argument('--rank', default='total_pnl', help='排序指标 (results 中的任一数值列)')
+    ap.add_argument('--top', type=int, default=20)
+    ap.add_argument('--out', default=None, help='输出目录 (默认临时目录)')
+    ap.add_argument('--resume', action='store_true', help='跳过 results.jsonl 中已完成的组合')
+    args = ap.parse_args(argv)
+
+    grid = json.loads(Path(args.grid).read_text(encoding='utf-8')) if args.grid else {}
+    grid.update(parse_params(args.param))
+    if not grid:
+        ap.error('至少需要 --grid 或一个 -p 参数')
+    cfg = json.loads(Path(args.config).read_text(encoding='utf-8'))
+    out_dir = Path(args.out or tempfile.mkdtemp(prefix='vagird_sweep_'))
+    data = BacktestData.from_config(cfg, years=args.years, freq=args.freq, seed=args.seed, daily_vol=args.vol)
+
+    t0 = _time.perf_counter()
+    total = len(expand(grid))
+    print(f'🧪 {total} 个组合 | {len(cfg)} 标的 | {args.years} 年 {args.freq} | 输出 {out_dir}')
+
+    def _progress(n, m, row):
+        if 'error' in row:
+            print(f'  [{n}/{m}] ❌ {row["params"]}: {row["error"]}')
+        elif n == m or n % max(1, m // 20) == 0:
+            print(f'  [{n}/{m}] {_time.perf_counter() - t0:.1f}s')
+
+    table = run_sweep(grid, cfg, data, out_dir, workers=args.workers, rank=args.rank,
+                      resume=args.resume, progress=_progress)
+    print(f'✅ 完成，用时 {_time.perf_counter() - t0:.1f}s，排名表: {out_dir / "ranked.csv"}')
+    if not table.empty:
+        cols = [args.rank] + [c for c in ('total_pnl', 'grid_pnl', 'fills') if c != args.rank] + sorted(grid)
+        with pd.option_context('display.width', 200, 'display.max_columns', 50):
+            print(table[cols].head(args.top).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
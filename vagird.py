@@ -35,9 +35,14 @@
 import json
 import logging
 import math
+import os
+import re
 import time
 import heapq  # 引入堆队列算法
-from collections import deque
+import atexit
+import queue
+import threading
+from collections import deque, namedtuple
 from datetime import datetime
 from datetime import time as dtime
 from datetime import timedelta
@@ -49,9 +54,81 @@ import pandas as pd
 
 # ---------------- 全局句柄 ----------------
 LOG_FH = None
+RESEARCH_ROOT = None    # get_research_path() 的缓存
 LOG_DATE = None
+LOG_DIR = None          # research_path('logs')，首次使用时解析一次 (后台写线程不再触碰 PTrade 接口)
+LOG_Q = None            # 有界日志队列 -> 后台写线程
+LOG_THREAD = None
+LOG_DROPPED = 0         # 队列满时丢弃的条数 (写线程追上后补记一行)
+LOG_LOCK = threading.Lock()     # 日志/事件文件句柄与 LOG_DROPPED 的互斥锁 (交易线程、报表线程、写线程共用)
+EVENT_DIR = None        # research_path('events')，同 LOG_DIR 只在主线程解析一次
+EVENT_FH = None         # events/<日期>.jsonl 二进制追加句柄 (tell() 即字节偏移)
+EVENT_IDX_FH = None     # events/<日期>.idx 分钟偏移索引 "HH:MM 偏移"
+EVENT_DATE = None
+EVENT_MINUTE = ''       # 索引里已登记的最后一分钟
+REPLAY_FH = None
+REPLAY_DATE = None
+REPLAY_ACCT = {'pos': {}, 'ord': {}}
+STATE_DIRTY = {}        # 待落盘的标的 -> state (写后合并)
+STATE_FLUSHED = {}      # 标的 -> 上次落盘时刻
+STATE_BYTES = {}        # 标的 -> 上次落盘内容 (内容未变则跳过写盘)
+JOURNAL_FH = {}         # 标的 -> state/<标的>.journal 追加句柄 (预写日志)
+JOURNAL_LEN = {}        # 标的 -> 快照之后已追加的日志条数
+ATR_CACHE = {}          # (标的, 交易日, 周期) -> 网格 ATR/收盘价 (日线指标一天只算一次)
+MACRO_ATR_CACHE = {}    # (标的, 交易日, 周期) -> 宏观截尾 ATR/收盘价 (全标的一次批量计算)
+MACRO_TP_LEVELS = {}    # 标的 -> (atr, 三档触发线, 三档回撤线)，atr 不变则复用
+TICK_CACHE = {}         # 标的 -> 最小报价单位 (整数价位，1 = 0.001 元)
+VA_SCHEDULE = {}        # (定投基数, 周增长率) -> 累计定投前缀和 [0, 第1周, 第1~2周, ...]
+INTRADAY_RV = {}        # 标的 -> IntradayRV 日内波动累加器 (由行情快照逐分钟推进)
+BOOK = None             # PortfolioBook 组合数组 (handle_data 向量化筛选需要动作的标的)
 __version__ = 'GEMINI-3.13.15'
 
+# ---------------- 时钟 (Clock) ----------------
+# 所有时间窗口 / 冷却期 / 补单到期判断统一经由 CLOCK.now()，不再直接读 datetime.now()。
+# 实盘用系统时钟；回测用 context.current_dt；离线回放/仿真由驱动方注入模拟时钟，
+# 2 秒补单延迟、60 秒冷却在模拟时钟下只是时间戳比较，整日回放以 CPU 速度完成。
+
+class WallClock:
+    """系统时钟 (实盘/模拟盘默认)。"""
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class ContextClock:
+    """回测时钟：跟随 context.current_dt，sleep 不等待。"""
+    def __init__(self, context):
+        self.context = context
+
+    def now(self):
+        return getattr(self.context, 'current_dt', None) or datetime.now()
+
+    def sleep(self, seconds):
+        pass
+
+class SimClock:
+    """模拟时钟：由驱动方 set() 推进，sleep 只推进虚拟时间。"""
+    def __init__(self, start=None):
+        self._now = start or datetime(2000, 1, 1)
+
+    def now(self):
+        return self._now
+
+    def set(self, dt):
+        self._now = dt
+
+    def sleep(self, seconds):
+        self._now = self._now + timedelta(seconds=float(seconds))
+
+CLOCK = WallClock()
+
+def set_clock(clock):
+    """替换全局时钟 (任何提供 now()/sleep() 的对象)，传 None 恢复系统时钟。"""
+    global CLOCK
+    CLOCK = clock if clock is not None else WallClock()
+    return CLOCK
+
 # ---------------- 配置管理类 ----------------
 
 class StrategyConfig:
@@ -101,6 +178,46 @@ class StrategyConfig:
     BOOT = SimpleNamespace()
     BOOT.GRACE_SECONDS = 180
 
+    # --- 行情录制配置 (离线回放用，默认关闭) ---
+    REPLAY = SimpleNamespace()
+    REPLAY.RECORD = False
+    REPLAY.DAILY_BARS = 80      # 每日 init 记录附带的日线根数 (覆盖宏观 ATR 所需窗口)
+
+    # --- 状态落盘配置 (写后合并) ---
+    PERSIST = SimpleNamespace()
+    PERSIST.FLUSH_SEC = 60      # 同一标的两次常规落盘的最小间隔；成交/宏观止盈立即同步落盘
+    PERSIST.JOURNAL = True      # 堆栈/成交变更先追加到 state/<标的>.journal，快照落盘时压实清空
+    PERSIST.JOURNAL_FSYNC = True    # 成交类日志条目写入后立即 fsync
+    PERSIST.COMPACT_RECORDS = 200   # 日志累计超过该条数时提前压实为快照
+
+    # --- 运行监控 (API 调用计数 + 分阶段耗时) ---
+    PERF = SimpleNamespace()
+    PERF.ENABLE = True
+    PERF.WINDOW = 240           # 分位数统计的滚动样本数 (每个阶段/接口/标的各自保留最近 N 次)
+    PERF.FLUSH_SEC = 60         # reports/perf_metrics.json 刷新间隔
+    PERF.WARN_RATIO = 0.5       # 单 tick 耗时超过 run_cycle 的该比例即告警 (60s 周期即将超时)
+    PERF.SCREEN = False         # 连续竞价时段先用组合数组向量化筛选，只有需要动作的标的才走逐标的 Python 流程 (实盘验证前默认关闭)
+
+    # --- 文件日志 (异步批量写盘) ---
+    LOGGING = SimpleNamespace()
+    LOGGING.ASYNC = True            # 关闭则退回逐行同步写盘
+    LOGGING.QUEUE_SIZE = 20000      # 有界队列容量，满了丢弃并计数，绝不阻塞交易回调
+    LOGGING.BATCH = 1000            # 写线程单批最多合并的条数
+    LOGGING.FLUSH_TIMEOUT = 1.0     # 成交/异常日志同步等待落盘的上限 (秒)
+
+    # --- 结构化事件流 (events/<日期>.jsonl，tools/events.py 查询) ---
+    EVENTS = SimpleNamespace()
+    EVENTS.ENABLE = True
+
+    # --- 报表面板 ---
+    REPORT = SimpleNamespace()
+    REPORT.DASHBOARD_MIN = 1        # HUD 面板刷新间隔 (分钟)；行片段有缓存，只重建输入变化的行
+    REPORT.ASYNC = True             # PnL / 面板 / 日报 CSV 交给后台报表线程，交易线程只付快照拷贝
+    REPORT.DRAIN_SEC = 30.0         # 盘后等待后台报表收尾的上限 (秒)
+    REPORT.HTML = True              # 服务端渲染 strategy_dashboard.html；关掉后只写 dashboard.json 数据源
+    REPORT.FEED = True              # dashboard.json 快照 + series/<日期>.jsonl 日内序列，供 dashboard_live.html 轮询
+    REPORT.SERIES_MIN = 5           # 日内序列降采样粒度 (分钟)：每个时间桶只记第一帧
+
     @classmethod
     def load(cls, context):
         """
@@ -113,7 +230,8 @@ class StrategyConfig:
         
         # 第二层：读取最高阶法典 strategy.json
         # 【核心修复】：只要底层任何一个文件变了，强迫 strategy.json 重新执行覆盖！
-        cls._load_strategy_config(context, force=(c1 or c2 or c3))
+        c4 = cls._load_strategy_config(context, force=(c1 or c2 or c3))
+        if c1 or c2 or c3 or c4: book_touch()     # 阈值变了，组合数组里的触发线全部作废
         
         # 将关键参数注入到 context 以便兼容旧代码习惯
         context.delay_after_cancel_seconds = cls.DEBUG.DELAY_AFTER_CANCEL
@@ -192,7 +310,47 @@ class StrategyConfig:
             if 'unlock_atr_multiplier' in mkt: cls.MARKET.UNLOCK_ATR_MULTIPLIER = float(mkt['unlock_atr_multiplier'])
             if 'max_stack_size' in mkt: cls.MARKET.MAX_STACK_SIZE = int(mkt['max_stack_size'])
 
-            # 4. 全局风控与其他
+            # 4. 行情录制
+            rep = j.get('replay', {})
+            if 'record' in rep: cls.REPLAY.RECORD = bool(rep['record'])
+            if 'daily_bars' in rep: cls.REPLAY.DAILY_BARS = max(1, int(rep['daily_bars']))
+
+            # 5. 状态落盘
+            per = j.get('persist', {})
+            if 'flush_seconds' in per: cls.PERSIST.FLUSH_SEC = max(0.0, float(per['flush_seconds']))
+            if 'journal' in per: cls.PERSIST.JOURNAL = bool(per['journal'])
+            if 'journal_fsync' in per: cls.PERSIST.JOURNAL_FSYNC = bool(per['journal_fsync'])
+            if 'compact_records' in per: cls.PERSIST.COMPACT_RECORDS = max(1, int(per['compact_records']))
+
+            # 6. 运行监控
+            prf = j.get('perf', {})
+            if 'enable' in prf: cls.PERF.ENABLE = bool(prf['enable'])
+            if 'window' in prf: cls.PERF.WINDOW = max(10, int(prf['window']))
+            if 'flush_seconds' in prf: cls.PERF.FLUSH_SEC = max(0.0, float(prf['flush_seconds']))
+            if 'warn_ratio' in prf: cls.PERF.WARN_RATIO = float(prf['warn_ratio'])
+            if 'screen' in prf: cls.PERF.SCREEN = bool(prf['screen'])
+
+            # 7. 文件日志
+            lg = j.get('logging', {})
+            if 'async' in lg: cls.LOGGING.ASYNC = bool(lg['async'])
+            if 'queue_size' in lg: cls.LOGGING.QUEUE_SIZE = max(100, int(lg['queue_size']))
+            if 'batch' in lg: cls.LOGGING.BATCH = max(1, int(lg['batch']))
+            if 'flush_timeout' in lg: cls.LOGGING.FLUSH_TIMEOUT = max(0.0, float(lg['flush_timeout']))
+
+            # 8. 结构化事件流
+            ev = j.get('events', {})
+            if 'enable' in ev: cls.EVENTS.ENABLE = bool(ev['enable'])
+
+            # 9. 报表面板
+            rp = j.get('report', {})
+            if 'dashboard_minutes' in rp: cls.REPORT.DASHBOARD_MIN = max(1, int(rp['dashboard_minutes']))
+            if 'async' in rp: cls.REPORT.ASYNC = bool(rp['async'])
+            if 'drain_seconds' in rp: cls.REPORT.DRAIN_SEC = max(0.0, float(rp['drain_seconds']))
+            if 'html' in rp: cls.REPORT.HTML = bool(rp['html'])
+            if 'feed' in rp: cls.REPORT.FEED = bool(rp['feed'])
+            if 'series_minutes' in rp: cls.REPORT.SERIES_MIN = max(1, int(rp['series_minutes']))
+
+            # 10. 全局风控与其他
             if 'credit_limit' in j: cls.CREDIT_LIMIT = int(j['credit_limit'])
             
             info('⚙️ [Config] Strategy统一配置已完成全局覆盖加载')
@@ -260,42 +418,444 @@ class OrderUtils:
         """判断是否为卖单"""
         return (order_dict['amount'] < 0) or (order_dict['entrust_bs'] == '2')
 
+class AccountView:
+    """
+    【单 tick 账户视图】一次 handle_data / 补单巡检内，持仓与挂单各只向柜台拉取一次 (全标的)，
+    挂单只 normalize 一次，所有热路径函数共用内存结果。
+    自己报单/撤单/收到成交后按标的作废，该标的下次访问时单独重拉；
+    视图未开启时 (成交回调、盘前盘后) 直接透传实时接口，行为与原来一致。
+    """
+    def __init__(self):
+        self.active = False
+        self._symbols = []
+        self._pos = None
+        self._oo = None
+        self._stale_pos = set()
+        self._stale_oo = set()
+
+    def begin(self, symbols):
+        self.active = True
+        self._symbols = list(symbols or [])
+        self._pos = self._oo = None
+        self._stale_pos, self._stale_oo = set(), set()
+
+    def end(self):
+        self.active = False
+        self._pos = self._oo = None
+
+    def invalidate(self, symbol):
+        book_touch(symbol)
+        if not self.active: return
+        self._stale_pos.add(symbol)
+        self._stale_oo.add(symbol)
+
+    def position(self, symbol):
+        if not self.active: return get_position(symbol)
+        if self._pos is None:
+            self._pos = {}
+            try:
+                for k, v in (get_positions(self._symbols) or {}).items():
+                    self._pos[convert_symbol_to_standard(str(k))] = v
+            except Exception as e:
+                debug('⚠️ [AccountView] 批量持仓获取失败，改为逐标的: {}', e)
+        if symbol in self._stale_pos or symbol not in self._pos:
+            self._stale_pos.discard(symbol)
+            self._pos[symbol] = get_position(symbol)
+        return self._pos[symbol]
+
+    def position_arrays(self, symbols):
+        """持仓数量 / 成本价数组 (与 symbols 同序)，供组合数组向量化筛选；同样只走一次批量持仓接口。"""
+        pos = [self.position(sym) for sym in symbols]
+        return (np.fromiter((p.amount for p in pos), float, len(pos)),
+                np.fromiter((p.cost_basis for p in pos), float, len(pos)))
+
+    def open_order_arrays(self, symbols):
+        """活跃挂单笔数 / 卖单冻结量数组 (与 symbols 同序)，同样只走一次批量挂单接口。"""
+        n_open, frozen = np.zeros(len(symbols)), np.zeros(len(symbols))
+        if self.active and symbols: self.open_orders(symbols[0])     # 触发一次批量拉取
+        oo, stale = (self._oo, self._stale_oo) if self.active else ({}, ())
+        is_active, is_sell = OrderUtils.is_active, OrderUtils.is_sell
+        for i, sym in enumerate(symbols):
+            orders = oo.get(sym) if sym not in stale else None
+            if orders is None: orders = self.open_orders(sym)
+            for o_info in orders:
+                if is_active(o_info):
+                    n_open[i] += 1
+                    if is_sell(o_info): frozen[i] += abs(o_info['amount'])
+        return n_open, frozen
+
+    def open_orders(self, symbol):
+        """该标的全部挂单的 normalize 结果 (原始对象在 'original')。"""
+        if not self.active: return [OrderUtils.normalize(o) for o in (get_open_orders(symbol) or [])]
+        if self._oo is None:
+            try:
+                grouped = {}
+                for o in (get_open_orders() or []):
+                    o_info = OrderUtils.normalize(o)
+                    grouped.setdefault(o_info['std_symbol'], []).append(o_info)
+                self._oo = {sym: grouped.get(sym, []) for sym in self._symbols}
+            except Exception as e:
+                self._oo = {}
+                debug('⚠️ [AccountView] 批量挂单获取失败，改为逐标的: {}', e)
+        if symbol in self._stale_oo or symbol not in self._oo:
+            self._stale_oo.discard(symbol)
+            self._oo[symbol] = [OrderUtils.normalize(o) for o in (get_open_orders(symbol) or [])]
+        return self._oo[symbol]
+
+ACCOUNT = AccountView()
+
+class _PerfScope:
+    __slots__ = ('mon', 'phase', 'sym', 't0', 'prev')
+
+    def __init__(self, mon, phase, sym):
+        self.mon, self.phase, self.sym = mon, phase, sym
+
+    def __enter__(self):
+        m = self.mon
+        self.prev = (m.phase, m.sym)
+        m.phase, m.sym = self.phase, self.sym
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t0
+        m = self.mon
+        m.phase, m.sym = self.prev
+        m.record(('phase', self.phase) if self.sym is None else ('sym', self.phase, self.sym), dt)
+        if self.phase == 'tick' and self.sym is None: m.last_tick = dt
+        return False
+
+class _NullScope:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+class PerfMonitor:
+    """
+    【运行监控】包裹 PTrade 全局 API 与 handle_data 各阶段，统计调用次数、总耗时与滚动 p50/p99：
+    - ('api', 接口名)：每次柜台/行情调用的耗时，并按 (阶段, 接口)、(标的, 接口) 计数；
+    - ('phase', 阶段)：整段循环耗时；('sym', 阶段, 标的)：单标的在该阶段的耗时。
+    计时只有两次 perf_counter + 一次 deque 追加；按交易日清零，结果写 reports/perf_metrics.json 并进 HUD。
+    """
+    API_NAMES = ('get_snapshot', 'get_position', 'get_positions', 'get_open_orders', 'get_orders', 'get_order',
+                 'get_all_orders', 'order', 'cancel_order_ex', 'get_history', 'get_parameter', 'set_parameter',
+                 'get_research_path')
+    _NULL = _NullScope()
+
+    def __init__(self):
+        self.phase = None
+        self.sym = None
+        self.last_tick = 0.0
+        self.overruns = 0
+        self.date = None
+        self.flushed_at = None
+        self.stats = {}
+        self.calls = {}
+        self.last = None        # 最近一次 flush 的汇总 (只读，供后台报表线程渲染)
+
+    def reset(self, date=None):
+        self.stats, self.calls = {}, {}
+        self.overruns, self.date = 0, date
+
+    def scope(self, phase, sym=None):
+        return _PerfScope(self, phase, sym) if StrategyConfig.PERF.ENABLE else self._NULL
+
+    def record(self, key, dt):
+        st = self.stats.get(key)
+        if st is None:
+            st = self.stats[key] = [0, 0.0, deque(maxlen=StrategyConfig.PERF.WINDOW)]
+        st[0] += 1
+        st[1] += dt
+        st[2].append(dt)
+
+    def wrap_api(self, ns):
+        """把模块全局里的 PTrade 接口换成计时版本 (重复调用不会重复包裹)。"""
+        import builtins
+        for name in self.API_NAMES:
+            fn = ns.get(name, getattr(builtins, name, None))
+            if not callable(fn) or getattr(fn, '_perf_wrapped', False): continue
+            ns[name] = self._timed(name, fn)
+
+    def _timed(self, name, fn):
+        mon, key = self, ('api', name)
+        def timed(*a, **kw):
+            if not StrategyConfig.PERF.ENABLE: return fn(*a, **kw)
+            t0 = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            finally:
+                mon.record(key, time.perf_counter() - t0)
+                ck = (mon.phase, name)
+                mon.calls[ck] = mon.calls.get(ck, 0) + 1
+                if mon.sym is not None:
+                    sk = ('sym', mon.sym, name)
+                    mon.calls[sk] = mon.calls.get(sk, 0) + 1
+        timed._perf_wrapped = True
+        timed.__name__ = name
+        return timed
+
+    @staticmethod
+    def _summary(st):
+        samples = sorted(st[2])
+        n = len(samples)
+        return {'count': st[0], 'total_ms': round(st[1] * 1000, 3),
+                'p50_ms': round(samples[int(0.50 * (n - 1))] * 1000, 3) if n else 0.0,
+                'p99_ms': round(samples[int(0.99 * (n - 1))] * 1000, 3) if n else 0.0}
+
+    def snapshot(self, budget_s=60):
+        phases, apis, symbols = {}, {}, {}
+        for key, st in self.stats.items():
+            if key[0] == 'phase': phases[key[1]] = self._summary(st)
+            elif key[0] == 'api': apis[key[1]] = self._summary(st)
+            else: symbols.setdefault(key[2], {})[key[1]] = self._summary(st)
+        for key, n in self.calls.items():
+            if key[0] == 'sym':
+                symbols.setdefault(key[1], {}).setdefault('api_calls', {})[key[2]] = n
+            elif key[0] in phases:
+                phases[key[0]].setdefault('api_calls', {})[key[1]] = n
+        tick = phases.get('tick', {})
+        return {'updated': CLOCK.now().strftime('%Y-%m-%d %H:%M:%S'), 'date': self.date,
+                'window': StrategyConfig.PERF.WINDOW, 'budget_s': budget_s,
+                'tick_p99_ratio': round(tick.get('p99_ms', 0.0) / 1000 / budget_s, 4) if budget_s else None,
+                'overruns': self.overruns, 'phases': phases, 'apis': apis, 'symbols': symbols}
+
+    def end_tick(self, context):
+        """tick 结束：检查是否逼近周期上限，并按 FLUSH_SEC 滚动写出 JSON。"""
+        if not StrategyConfig.PERF.ENABLE: return
+        budget = getattr(context, 'run_cycle', 60) or 60
+        if self.last_tick > budget * StrategyConfig.PERF.WARN_RATIO:
+            self.overruns += 1
+            info('⏱️ [Perf] 本 tick 耗时 {:.2f}s，已超过运行周期 {}s 的 {:.0%}', self.last_tick, budget, StrategyConfig.PERF.WARN_RATIO)
+        now = CLOCK.now()
+        if self.flushed_at is None or (now - self.flushed_at).total_seconds() >= StrategyConfig.PERF.FLUSH_SEC:
+            self.flush(context)
+
+    def flush(self, context):
+        self.flushed_at = CLOCK.now()
+        try:
+            path = research_path('reports', 'perf_metrics.json')
+            tmp = path.with_name(path.name + '.tmp')
+            self.last = self.snapshot(getattr(context, 'run_cycle', 60) or 60)
+            tmp.write_text(json.dumps(self.last, ensure_ascii=False, indent=1), encoding='utf-8')
+            tmp.replace(path)
+        except Exception as e:
+            debug('⚠️ [Perf] 监控数据写出失败: {}', e)
+
+    def render_html(self, budget_s=60, snap=None):
+        """HUD 面板的运行监控区块：各阶段 p50/p99 与 API 调用量 (snap 为已发布的汇总时不再读实时统计)。"""
+        if snap is None: snap = self.snapshot(budget_s)
+        if not snap['phases']: return ''
+        rows = ''
+        for name, st in sorted(snap['phases'].items(), key=lambda kv: -kv[1]['total_ms']):
+            calls = ' '.join(f'{k}:{v}' for k, v in sorted(st.get('api_calls', {}).items(), key=lambda kv: -kv[1]))
+            rows += (f"<tr><td>{name}</td><td>{st['count']}</td><td>{st['total_ms'] / max(st['count'], 1):.1f}</td>"
+                     f"<td>{st['p50_ms']:.1f}</td><td>{st['p99_ms']:.1f}</td><td style=\"white-space:normal;\">{calls}</td></tr>")
+        ratio = snap['tick_p99_ratio'] or 0.0
+        color = '#f7768e' if ratio > StrategyConfig.PERF.WARN_RATIO else '#9ece6a'
+        return f"""
+        <div style="margin-top: 20px; color: #a9b1d6; font-size: 13px;">
+            <div style="margin-bottom: 8px;"><b>⏱️ 运行监控 (Perf)</b> &nbsp; tick p99 占周期 <span style="color:{color}; font-weight:bold;">{ratio:.1%}</span> (周期 {budget_s}s, 告警 {snap['overruns']} 次, 更新 {snap['updated']})</div>
+            <table style="width:100%; font-size:12px;"><tr><th>阶段</th><th>次数</th><th>均值ms</th><th>p50 ms</th><th>p99 ms</th><th>API 调用</th></tr>{rows}</table>
+        </div>
+        """
+
+PERF = PerfMonitor()
+
+def install_perf_hooks():
+    """初始化时包裹 PTrade 全局接口 (StrategyConfig.PERF.ENABLE 关闭时计时器直接透传)。"""
+    PERF.wrap_api(globals())
+
 # ---------------- 通用路径与工具函数 ----------------
 
 def research_path(*parts) -> Path:
-    p = Path(get_research_path()).joinpath(*parts)
+    """研究目录只向平台解析一次 (后台写日志/报表线程不再触碰 PTrade 接口)。"""
+    global RESEARCH_ROOT
+    if RESEARCH_ROOT is None: RESEARCH_ROOT = Path(get_research_path())
+    p = RESEARCH_ROOT.joinpath(*parts)
     p.parent.mkdir(parents=True, exist_ok=True)
     return p
 
-def _ensure_daily_logfile():
+def _log_dir():
+    global LOG_DIR
+    if LOG_DIR is None:
+        LOG_DIR = research_path('logs')
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+    return LOG_DIR
+
+def _open_daily_logfile(date_str):
+    """按日期切换 logs/<日期>_strategy.log (主线程同步写与后台写线程共用)。"""
     global LOG_FH, LOG_DATE
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    if LOG_DATE != today_str or LOG_FH is None:
-        try:
-            if LOG_FH:
-                LOG_FH.flush()
-                LOG_FH.close()
-        except:
-            pass
-        log_dir = research_path('logs')
-        log_dir.mkdir(parents=True, exist_ok=True)
-        log_path = log_dir / f"{today_str}_strategy.log"
-        LOG_FH = open(log_path, 'a', encoding='utf-8')
-        LOG_DATE = today_str
+    if LOG_DATE == date_str and LOG_FH is not None: return LOG_FH
+    try:
+        if LOG_FH:
+            LOG_FH.flush()
+            LOG_FH.close()
+    except:
+        pass
+    LOG_FH = open(_log_dir() / f"{date_str}_strategy.log", 'a', encoding='utf-8')
+    LOG_DATE = date_str
+    return LOG_FH
+
+def _ensure_daily_logfile():
+    today_str = CLOCK.now().strftime('%Y-%m-%d')
+    log_path = _log_dir() / f"{today_str}_strategy.log"
+    try: log.info(f'🔍 日志写入 {log_path}')
+    except: pass
+    return log_path
+
+def _event_dir():
+    global EVENT_DIR
+    if EVENT_DIR is None:
+        EVENT_DIR = research_path('events')
+        EVENT_DIR.mkdir(parents=True, exist_ok=True)
+    return EVENT_DIR
+
+def _open_daily_eventfile(date_str):
+    """按日期切换 events/<日期>.jsonl 与 events/<日期>.idx；盘中重启时从索引末行接上已登记的分钟。"""
+    global EVENT_FH, EVENT_IDX_FH, EVENT_DATE, EVENT_MINUTE
+    for fh in (EVENT_FH, EVENT_IDX_FH):
         try:
-            log.info(f'🔍 日志切换到 {log_path}')
+            if fh: fh.close()
         except:
             pass
-        return log_path
-    return research_path('logs', f"{today_str}_strategy.log")
+    idx_path = _event_dir() / f"{date_str}.idx"
+    EVENT_MINUTE = ''
+    try:
+        lines = idx_path.read_bytes().split()
+        if len(lines) >= 2: EVENT_MINUTE = lines[-2].decode()
+    except OSError:
+        pass
+    EVENT_FH = open(_event_dir() / f"{date_str}.jsonl", 'ab')
+    EVENT_IDX_FH = open(idx_path, 'ab')
+    EVENT_DATE = date_str
+    return EVENT_FH
+
+def _write_event(ts, payload):
+    """一条事件一行 JSON；每个新的分钟先把该分钟首条记录的字节偏移登记进索引。"""
+    global EVENT_MINUTE
+    date_str = f"{ts:%Y-%m-%d}"
+    fh = EVENT_FH if (date_str == EVENT_DATE and EVENT_FH is not None) else _open_daily_eventfile(date_str)
+    minute = f"{ts:%H:%M}"
+    if minute > EVENT_MINUTE:
+        EVENT_IDX_FH.write(f"{minute} {fh.tell()}\n".encode())
+        EVENT_MINUTE = minute
+    etype, symbol, fields = payload
+    rec = {'ts': f"{ts:%Y-%m-%d %H:%M:%S}", 't': etype, 's': symbol}
+    rec.update(fields)
+    fh.write(json.dumps(rec, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8') + b'\n')
+
+def _write_log_lines(records):
+    """
+    records: [(datetime, level, text)]；按记录自身的日期跨午夜切换文件，整批写完只 flush 一次。
+    level 为 'EVENT' 的记录 (text 为 (类型, 标的, 字段)) 改写到结构化事件文件。
+    """
+    fh = None
+    wrote_event = False
+    for ts, level, text in records:
+        if level == 'EVENT':
+            _write_event(ts, text)
+            wrote_event = True
+            continue
+        date_str = f"{ts:%Y-%m-%d}"
+        if fh is None or date_str != LOG_DATE: fh = _open_daily_logfile(date_str)
+        fh.write(f"{ts:%Y-%m-%d %H:%M:%S} - {level} - {text}\n")
+    if fh: fh.flush()
+    if wrote_event:
+        EVENT_FH.flush()
+        EVENT_IDX_FH.flush()
+
+def _write_log_locked(records):
+    """同步写路径：日切时 _open_daily_logfile 会关闭旧句柄，多线程写必须串行。"""
+    with LOG_LOCK:
+        try: _write_log_lines(records)
+        except Exception: pass
 
-def info(msg, *args):
-    text = msg.format(*args)
+def _log_dropped():
+    global LOG_DROPPED
+    with LOG_LOCK: LOG_DROPPED += 1
+
+def _log_writer_loop(q):
+    """【后台写线程】阻塞取一条，再把队列里现成的全部捎上 (至多 BATCH 条) 一次写盘。"""
+    global LOG_DROPPED
+    while True:
+        item = q.get()
+        batch, waiters, stop = [], [], False
+        while True:
+            if item is None: stop = True
+            elif isinstance(item, threading.Event): waiters.append(item)
+            else: batch.append(item)
+            if stop or len(batch) >= StrategyConfig.LOGGING.BATCH: break
+            try: item = q.get_nowait()
+            except queue.Empty: break
+        with LOG_LOCK:
+            n, LOG_DROPPED = LOG_DROPPED, 0
+        if n: batch.append((batch[-1][0] if batch else CLOCK.now(), 'WARN', f'⚠️ 日志队列已满，丢弃 {n} 条'))
+        _write_log_locked(batch)
+        for ev in waiters: ev.set()
+        if stop: return
+
+def _start_log_writer():
+    global LOG_Q, LOG_THREAD
+    if LOG_THREAD is not None and LOG_THREAD.is_alive(): return True
+    try:
+        _log_dir()
+        LOG_Q = queue.Queue(maxsize=StrategyConfig.LOGGING.QUEUE_SIZE)
+        LOG_THREAD = threading.Thread(target=_log_writer_loop, args=(LOG_Q,), name='vagird-log', daemon=True)
+        LOG_THREAD.start()
+        return True
+    except Exception:
+        LOG_Q = LOG_THREAD = None
+        return False
+
+def log_flush(timeout=None):
+    """等待队列中已有的日志全部落盘 (成交、异常、日终时调用)。"""
+    if LOG_THREAD is None or not LOG_THREAD.is_alive(): return
+    ev = threading.Event()
+    try: LOG_Q.put(ev, timeout=StrategyConfig.LOGGING.FLUSH_TIMEOUT)
+    except queue.Full: return
+    ev.wait(StrategyConfig.LOGGING.FLUSH_TIMEOUT if timeout is None else timeout)
+
+def _log_shutdown():
+    if LOG_THREAD is None or not LOG_THREAD.is_alive(): return
+    try: LOG_Q.put(None, timeout=StrategyConfig.LOGGING.FLUSH_TIMEOUT)
+    except queue.Full: return
+    LOG_THREAD.join(StrategyConfig.LOGGING.FLUSH_TIMEOUT)
+
+atexit.register(_log_shutdown)
+
+def info(msg, *args, flush=False):
+    """
+    平台日志同步输出；文件日志进有界队列由后台线程批量写盘，交易回调不再等磁盘。
+    flush=True (成交、异常) 时等到本条落盘再返回。可在报表线程中调用 (同步写路径加锁)。
+    """
+    text = msg.format(*args) if args else msg
     log.info(text)
-    _ensure_daily_logfile()
-    if LOG_FH:
-        LOG_FH.write(f"{datetime.now():%Y-%m-%d %H:%M:%S} - INFO - {text}\n")
-        LOG_FH.flush()
+    record = (CLOCK.now(), 'INFO', text)
+    if StrategyConfig.LOGGING.ASYNC and _start_log_writer():
+        try: LOG_Q.put_nowait(record)
+        except queue.Full: _log_dropped()
+        if flush: log_flush()
+        return
+    _write_log_locked([record])
+
+def debug(msg, *args):
+    """调试级日志：StrategyConfig.DEBUG.ENABLE 关闭时连格式化都不做。"""
+    if StrategyConfig.DEBUG.ENABLE: info(msg, *args)
+
+def emit_event(etype, symbol, **fields):
+    """
+    关键决策的结构化事件 (守门员拦截 / 棘轮 / 堆栈融合 / 成交 / 巡检撤单 / VA 调整 / 宏观止盈档位)。
+    与文件日志共用有界队列和后台写线程，JSON 序列化也在写线程完成；字段只传标量。
+    """
+    if not StrategyConfig.EVENTS.ENABLE: return
+    record = (CLOCK.now(), 'EVENT', (etype, symbol, fields))
+    try: _event_dir()
+    except Exception: return
+    if StrategyConfig.LOGGING.ASYNC and _start_log_writer():
+        try: LOG_Q.put_nowait(record)
+        except queue.Full: _log_dropped()
+        return
+    _write_log_locked([record])
 
 def get_saved_param(key, default=None):
     try:
@@ -365,43 +925,552 @@ def is_valid_price(x):
     except:
         return False
 
+# ---------------- 价格阶梯 (Price Ladder) ----------------
+
+PRICE_TICKS = 1000      # 整数价位 = 价格 × 1000 (0.001 元一档)；阶梯键与网格报价共用
+
+# 交易所最小报价单位 (整数价位)：(后缀, 代码前缀, 单位)。场内基金/债券 0.001 元，其余 (股票) 0.01 元
+TICK_TABLE = (('.SS', ('5', '1'), 1), ('.SZ', ('15', '16', '18', '12'), 1))
+STOCK_TICK = 10
+
+def symbol_tick(symbol):
+    tick = TICK_CACHE.get(symbol)
+    if tick is None:
+        code, tick = str(symbol or ''), STOCK_TICK
+        for suffix, prefixes, size in TICK_TABLE:
+            if code.endswith(suffix) and code.startswith(prefixes):
+                tick = size
+                break
+        TICK_CACHE[symbol] = tick
+    return tick
+
+def to_ticks(price, tick=1, side=0):
+    """
+    价格 -> 整数价位，按 tick 取整；tick=1 与原 round(x, 3) 口径一致。
+    side=-1 / +1 时向下 / 向上取整到 tick (股票 0.01 元档的买价 / 卖价，避免四舍五入把买卖价挤到同一价位)。
+    """
+    if tick == 1: return int(round(round(price, 3) * PRICE_TICKS))
+    x = price * PRICE_TICKS / tick
+    if side < 0: return int(math.floor(x + 1e-6)) * tick
+    if side > 0: return int(math.ceil(x - 1e-6)) * tick
+    return int(round(x)) * tick
+
+class PriceLadder:
+    """
+    【网格堆栈】buy_stack / sell_stack 的价位阶梯：整数价位键 -> 数量，同价位自动合并。
+    存的值沿用原堆口径 (买单为价格，卖单为 -价格)，键最小的一端是"栈顶" (对冲最先吃掉的那笔)，
+    键最大的一端是"远端" (破锁 / 容量裁剪融合的极值)。两端各一个惰性删除的堆：
+    取/弹两端、入库合并、远端两笔融合都是 O(log n)，有序遍历 O(n log n)。
+    JSON 仍是 [[值, 数量], ...] (按键升序)，与旧版状态文件互通。
+    """
+    __slots__ = ('levels', '_lo', '_hi')
+
+    def __init__(self, items=()):
+        self.levels = {}        # 键 -> 数量
+        self._lo = []           # 键的最小堆 (栈顶端)
+        self._hi = []           # -键的最小堆 (远端)
+        for value, qty in items: self.push(value, qty)
+
+    @staticmethod
+    def key(value):
+        return int(round(value * PRICE_TICKS))
+
+    @classmethod
+    def from_json(cls, raw, default_qty):
+        """兼容旧状态里只有价格、没有数量的条目 (按一格网格单位补齐)。"""
+        return cls((tuple(item) if isinstance(item, (list, tuple)) else (item, default_qty)) for item in raw or ())
+
+    def to_json(self):
+        return [[k / PRICE_TICKS, q] for k, q in sorted(self.levels.items())]
+
+    def copy(self):
+        other = PriceLadder()
+        other.levels = dict(self.levels)
+        other._lo, other._hi = list(self._lo), list(self._hi)
+        return other
+
+    def __len__(self): return len(self.levels)
+    def __bool__(self): return bool(self.levels)
+    def __iter__(self): return iter(self.items())
+    def __repr__(self): return f'PriceLadder({self.to_json()})'
+    def __eq__(self, other):
+        levels = getattr(other, 'levels', None)     # 按结构比较 (离线工具可能各自加载一份策略模块)
+        return self.levels == levels if isinstance(levels, dict) else NotImplemented
+    __hash__ = None
+
+    def items(self, reverse=False, limit=None):
+        """按键升序 (reverse=True 为降序) 的 (值, 数量)；limit 只取一端的前几档。"""
+        if limit is None: keys = sorted(self.levels, reverse=reverse)
+        else: keys = (heapq.nlargest if reverse else heapq.nsmallest)(limit, self.levels)
+        return [(k / PRICE_TICKS, self.levels[k]) for k in keys]
+
+    def total(self):
+        return sum(self.levels.values())
+
+    def push(self, value, qty):
+        """入库；同价位已存在则合并数量并返回合并后的数量，否则返回 None。"""
+        k = self.key(value)
+        if k in self.levels:
+            self.levels[k] += qty
+            return self.levels[k]
+        self.levels[k] = qty
+        heapq.heappush(self._lo, k)
+        heapq.heappush(self._hi, -k)
+        if len(self._lo) > 2 * len(self.levels) + 16: self._compact()
+        return None
+
+    def _compact(self):
+        self._lo = sorted(self.levels)
+        self._hi = sorted(-k for k in self.levels)
+
+    def top_key(self):
+        lo = self._lo
+        while lo and lo[0] not in self.levels: heapq.heappop(lo)
+        return lo[0] if lo else None
+
+    def _far_key(self):
+        hi = self._hi
+        while hi and -hi[0] not in self.levels: heapq.heappop(hi)
+        return -hi[0] if hi else None
+
+    def top(self):
+        k = self.top_key()
+        return None if k is None else (k / PRICE_TICKS, self.levels[k])
+
+    def far(self):
+        k = self._far_key()
+        return None if k is None else (k / PRICE_TICKS, self.levels[k])
+
+    def pop_top(self):
+        k = self.top_key()
+        return (k / PRICE_TICKS, self.levels.pop(k))
+
+    def pop_far(self):
+        k = self._far_key()
+        return (k / PRICE_TICKS, self.levels.pop(k))
+
+    def consume_top(self, qty):
+        """栈顶价位扣减 qty，扣完即删除该档。"""
+        k = self.top_key()
+        left = self.levels[k] - qty
+        if left > 0: self.levels[k] = left
+        else: del self.levels[k]
+
+# ---------------- 标的状态记录 ----------------
+
+class SymbolState:
+    """
+    【标的状态】固定槽位 (__slots__) 的状态记录，字段分两段：
+    PERSISTED 为落盘白名单 (to_json 只遍历这一段)，TRANSIENT 为盘中计时器/缓存 (重启即清空)。
+    热路径直接读写属性；保留 dict 风格接口 (state['x'] / get / pop / in / items) 兼容旧代码与报表。
+    未赋值的槽位视同字典里没有这个键；配置里的未知键放进 _extra。
+    """
+    VERSION = 1     # 落盘格式版本 (_v)；没有 _v 的旧文件按 0 处理，字段与 1 相同
+    PERSISTED = ('symbol', 'base_price', 'grid_unit', 'max_position', 'last_week_position', 'base_position',
+                 'initial_base_position', 'initial_position_value',
+                 'grid_atr_rate', 'macro_atr_rate', 'buy_stack', 'sell_stack', 'credit_limit',
+                 'history_pnl', '_fill_tracker', 'buy_grid_spacing', 'sell_grid_spacing',
+                 'dingtou_base', 'dingtou_rate', '_tp_hwm_ratio', '_tp_tier', '_macro_sell_ids',
+                 'tp_cool_weeks', 'tp_min_weeks', 'tp_min_value', 'wm_map', 'wm_pnl',
+                 'max_grid_count', '_drip_amount', '_drip_remain_weeks',
+                 '_journal_seq', 'filled_order_ids', 'trade_week_set')
+    TRANSIENT = ('va_last_update_dt', '_halt_next_log_dt', '_oo_last', '_recover_until', '_after_cancel_until',
+                 '_oo_drop_seen_ts', '_pos_jump_seen_ts', '_pos_confirm_deadline', '_rehang_due_ts',
+                 '_ignore_place_until', '_pending_ignore_ids', '_last_order_ts', '_last_order_bp',
+                 '_last_trade_ts', '_last_pos_seen', '_last_fill_dt', 'last_fill_price',
+                 '_up_limit', '_down_limit', '_quote')
+    __slots__ = PERSISTED + TRANSIENT + ('_extra',)
+    FIELDS = frozenset(PERSISTED + TRANSIENT)
+    OPTIONAL = ('_pending_ignore_ids', '_last_order_ts', '_last_order_bp')   # 沿用“不存在 = 未发生”的语义，用 get/pop 访问
+    LEGACY = ('scale_factor', 'pending_fill_amount', 'used_atr_rate', 'cached_atr_ema')
+
+    def __init__(self, **fields):
+        self._extra = {}
+        for k in self.TRANSIENT:
+            if k not in self.OPTIONAL: setattr(self, k, None)
+        self._oo_last = 0
+        for k, v in fields.items(): self[k] = v
+
+    @classmethod
+    def from_json(cls, sym, saved, cfg):
+        """
+        [Global Ver: v3.13.15] [Func Ver: 1.6]
+        终极防御：将防崩装甲武装到数值型字段，彻底消灭 float + None 的数学运算崩溃。
+        saved 为落盘快照 (已重放日志)，cfg 为 symbols.json 中该标的的配置。
+        """
+        st = cls(**cfg)
+        saved_initial_base = saved.get('initial_base_position')
+        actual_initial_base = saved_initial_base if saved_initial_base is not None else cfg.get('initial_base_position', 0)
+
+        saved_initial_val = saved.get('initial_position_value')
+        actual_initial_val = saved_initial_val if saved_initial_val is not None else (actual_initial_base * cfg.get('base_price', 1.0))
+
+        max_grids = cfg.get('max_grid_count', 12)
+
+        st.symbol = sym
+        st.initial_base_position = actual_initial_base
+        st.base_position = saved.get('base_position', actual_initial_base)
+        st.last_week_position = saved.get('last_week_position', actual_initial_base)
+        st.initial_position_value = actual_initial_val
+
+        st.dingtou_base = saved.get('dingtou_base') if saved.get('dingtou_base') is not None else cfg.get('dingtou_base', 0)
+        st.dingtou_rate = saved.get('dingtou_rate') if saved.get('dingtou_rate') is not None else cfg.get('dingtou_rate', 0)
+
+        st.base_price = saved.get('base_price', cfg.get('base_price', 1.0))
+        st.grid_unit = saved.get('grid_unit', cfg.get('grid_unit', 100))
+
+        st.buy_grid_spacing = saved.get('buy_grid_spacing', 0.005)
+        st.sell_grid_spacing = saved.get('sell_grid_spacing', 0.005)
+
+        st.tp_cool_weeks = cfg.get('tp_cool_weeks', saved.get('tp_cool_weeks', StrategyConfig.VA.TP_COOL_WEEKS))
+        st.tp_min_weeks = cfg.get('tp_min_weeks', saved.get('tp_min_weeks', StrategyConfig.VA.TP_MIN_WEEKS))
+        st.tp_min_value = cfg.get('tp_min_value', saved.get('tp_min_value', StrategyConfig.VA.TP_MIN_VALUE))
+
+        st.filled_order_ids = set(saved.get('filled_order_ids') or [])
+        st.trade_week_set = set(saved.get('trade_week_set') or [])
+
+        st.max_grid_count = max_grids
+        st.max_position = saved.get('base_position', actual_initial_base) + saved.get('grid_unit', cfg.get('grid_unit', 100)) * max_grids
+
+        st.grid_atr_rate = saved.get('grid_atr_rate', saved.get('used_atr_rate', None))
+        st.macro_atr_rate = saved.get('macro_atr_rate', None)
+
+        st.buy_stack = PriceLadder.from_json(saved.get('buy_stack'), st.grid_unit)
+        st.sell_stack = PriceLadder.from_json(saved.get('sell_stack'), st.grid_unit)
+        st.credit_limit = cfg.get('credit_limit', saved.get('credit_limit', StrategyConfig.CREDIT_LIMIT))
+
+        st._fill_tracker = saved.get('_fill_tracker') or {}
+
+        # 🌟 V3.13.15 核心修复：数值型字段的严格 is not None 护航
+        st.history_pnl = saved.get('history_pnl') if saved.get('history_pnl') is not None else 0.0
+        st._tp_hwm_ratio = saved.get('_tp_hwm_ratio') if saved.get('_tp_hwm_ratio') is not None else 0.0
+        st._tp_tier = saved.get('_tp_tier') if saved.get('_tp_tier') is not None else 0
+
+        st._macro_sell_ids = saved.get('_macro_sell_ids') or []
+
+        st._drip_amount = saved.get('_drip_amount') if saved.get('_drip_amount') is not None else 0.0
+        st._drip_remain_weeks = saved.get('_drip_remain_weeks') if saved.get('_drip_remain_weeks') is not None else 0
+
+        st.wm_map = saved.get('wm_map') or {}
+        # 🌟 V3.13.15 核心修复：防止 current_V + state['wm_pnl'] 数学崩溃
+        st.wm_pnl = saved.get('wm_pnl') if saved.get('wm_pnl') is not None else 0.0
+        st._journal_seq = int(saved.get('_journal_seq') or 0)
+
+        st._pending_ignore_ids = saved.get('_pending_ignore_ids') or []
+
+        for k in cls.LEGACY: st._extra.pop(k, None)
+        return st
+
+    def to_json(self):
+        """落盘字典：只遍历 PERSISTED；堆栈写成 [[价, 量], ...]，集合排序后写出，并带格式版本 _v。"""
+        # 集合按委托号数值顺序落盘：截断时保留最新的 ID，且同一状态总是写出同样的字节 (便于回放比对)
+        ids = sorted(getattr(self, 'filled_order_ids', None) or (), key=lambda x: (len(x), x))
+        ids = ids[-StrategyConfig.MAX_SAVED_FILLED_IDS:]
+        self.filled_order_ids = set(ids)
+
+        store = {k: getattr(self, k, None) for k in self.PERSISTED[:-2]}
+        for k in ('buy_stack', 'sell_stack'):
+            if isinstance(store[k], PriceLadder): store[k] = store[k].to_json()
+        store['filled_order_ids'] = ids
+        store['trade_week_set'] = sorted(getattr(self, 'trade_week_set', None) or ())
+        store['_v'] = self.VERSION
+        return store
+
+    # ---- dict 兼容接口 ----
+
+    def __getitem__(self, k):
+        if k in self.FIELDS:
+            try: return getattr(self, k)
+            except AttributeError: raise KeyError(k) from None
+        return self._extra[k]
+
+    def __setitem__(self, k, v):
+        if k in self.FIELDS: setattr(self, k, v)
+        else: self._extra[k] = v
+
+    def __delitem__(self, k):
+        if k in self.FIELDS:
+            try: delattr(self, k)
+            except AttributeError: raise KeyError(k) from None
+        else: del self._extra[k]
+
+    def __contains__(self, k):
+        return hasattr(self, k) if k in self.FIELDS else k in self._extra
+
+    def get(self, k, default=None):
+        return getattr(self, k, default) if k in self.FIELDS else self._extra.get(k, default)
+
+    def pop(self, k, *default):
+        try: v = self[k]
+        except KeyError:
+            if default: return default[0]
+            raise
+        del self[k]
+        return v
+
+    def setdefault(self, k, default=None):
+        if k not in self: self[k] = default
+        return self[k]
+
+    def update(self, other=(), **kw):
+        for k, v in dict(other, **kw).items(): self[k] = v
+
+    def keys(self):
+        return [k for k in self.__slots__[:-1] if hasattr(self, k)] + list(self._extra)
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f"SymbolState({self.get('symbol')!r}, base={self.get('base_price')!r}, unit={self.get('grid_unit')!r})"
+
 # ---------------- 状态保存 ----------------
 
+def _state_store(state):
+    """
+    [Global Ver: v3.13.10] [Func Ver: 1.2]
+    落盘白名单见 SymbolState.PERSISTED；普通字典 (离线工具/旧调用) 先转成 SymbolState 再导出。
+    """
+    if not isinstance(state, SymbolState): state = SymbolState(**state)
+    return state.to_json()
+
 def save_state(symbol, state):
     """
-    [Global Ver: v3.13.10] [Func Ver: 1.1]
-    加入 _drip_amount 和 _drip_remain_weeks 滴灌引擎状态持久化白名单
+    【原子落盘】紧凑 JSON 先写临时文件再 rename，进程中途崩溃也不会留下半截文件；
+    与上次落盘内容逐字节相同则跳过写盘 (含 set_parameter)。快照已覆盖预写日志，随后压实清空日志。
     """
-    ids = list(state.get('filled_order_ids', set()))
-    state['filled_order_ids'] = set(ids[-StrategyConfig.MAX_SAVED_FILLED_IDS:])
-    
-    store_keys = ['symbol', 'base_price', 'grid_unit', 'max_position', 'last_week_position', 'base_position', 
-                  'initial_base_position', 'initial_position_value',
-                  'grid_atr_rate', 'macro_atr_rate', 'buy_stack', 'sell_stack', 'credit_limit', 
-                  'history_pnl', '_fill_tracker', 'buy_grid_spacing', 'sell_grid_spacing',
-                  'dingtou_base', 'dingtou_rate', '_tp_hwm_ratio', '_tp_tier', '_macro_sell_ids',
-                  'tp_cool_weeks', 'tp_min_weeks', 'tp_min_value', 'wm_map', 'wm_pnl',
-                  'max_grid_count', '_drip_amount', '_drip_remain_weeks'] # 🌟 V3.13.10 补丁：独立滴灌引擎状态入库
-    
-    store = {k: state.get(k) for k in store_keys}
-    
-    store['filled_order_ids'] = ids[-StrategyConfig.MAX_SAVED_FILLED_IDS:]
-    store['trade_week_set'] = list(state.get('trade_week_set', []))
-    set_saved_param(f'state_{symbol}', store)
-    research_path('state', f'{symbol}.json').write_text(json.dumps(store, indent=2), encoding='utf-8')
+    text = json.dumps(_state_store(state), separators=(',', ':'))
+    STATE_DIRTY.pop(symbol, None)
+    STATE_FLUSHED[symbol] = CLOCK.now()
+    if STATE_BYTES.get(symbol) != text:
+        set_saved_param(f'state_{symbol}', json.loads(text))
+        path = research_path('state', f'{symbol}.json')
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            fh.write(text)
+            if JOURNAL_LEN.get(symbol) and StrategyConfig.PERSIST.JOURNAL_FSYNC:
+                fh.flush()
+                os.fsync(fh.fileno())   # 快照先落到磁盘，再清空日志
+        tmp.replace(path)
+        STATE_BYTES[symbol] = text
+    _journal_compact(symbol)
+
+def safe_save_state(symbol, state, sync=False):
+    """
+    【写后合并】默认只标脏，由 flush_states 按 PERSIST.FLUSH_SEC 合并落盘；
+    成交、宏观止盈等不可丢失的状态跃迁传 sync=True 立即落盘。
+    """
+    STATE_DIRTY[symbol] = state
+    book_touch(symbol)
+    if sync: _flush_one(symbol)
 
-def safe_save_state(symbol, state):
+def _flush_one(symbol):
+    state = STATE_DIRTY.get(symbol)
+    if state is None: return
     try:
         save_state(symbol, state)
     except Exception as e:
+        STATE_DIRTY[symbol] = state     # 保留脏标记，下个落盘周期重试
         info('[{}] ⚠️ 状态保存失败: {}', symbol, e)
 
+def journal_state(symbol, state, keys=(), ft=None, fid=None, durable=False):
+    """
+    【预写日志】把一次变更追加为 state/<标的>.journal 的一行小记录，并标脏等待快照合并：
+    {"n": 序号, "s": {字段: 新值}, "ft": {委托号: 已记成交量}, "fid": [完结委托号]}
+    "s" 记字段的完整新值 (堆栈只有几档)，重放幂等；durable=True (成交) 时 fsync。
+    关闭日志时退化为原来的行为：durable 同步落快照，否则只标脏。
+    """
+    if not StrategyConfig.PERSIST.JOURNAL:
+        safe_save_state(symbol, state, sync=durable)
+        return
+    STATE_DIRTY[symbol] = state
+    book_touch(symbol)
+    seq = int(state.get('_journal_seq') or 0) + 1
+    rec = {'n': seq}
+    if keys: rec['s'] = {k: (v.to_json() if isinstance(v, PriceLadder) else v) for k, v in ((k, state.get(k)) for k in keys)}
+    if ft: rec['ft'] = ft
+    if fid: rec['fid'] = list(fid)
+    try:
+        fh = JOURNAL_FH.get(symbol)
+        if fh is None:
+            fh = JOURNAL_FH[symbol] = open(research_path('state', f'{symbol}.journal'), 'a', encoding='utf-8')
+        fh.write(json.dumps(rec, separators=(',', ':')) + '\n')
+        fh.flush()
+        if durable and StrategyConfig.PERSIST.JOURNAL_FSYNC: os.fsync(fh.fileno())
+        state['_journal_seq'] = seq
+        JOURNAL_LEN[symbol] = JOURNAL_LEN.get(symbol, 0) + 1
+    except Exception as e:
+        info('[{}] ⚠️ 预写日志失败，改为同步落盘: {}', symbol, e)
+        _flush_one(symbol)
+        return
+    if JOURNAL_LEN[symbol] >= StrategyConfig.PERSIST.COMPACT_RECORDS: _flush_one(symbol)
+
+def _journal_compact(symbol):
+    """快照已包含全部日志条目：清空日志文件。"""
+    if not JOURNAL_LEN.get(symbol): return
+    fh = JOURNAL_FH.get(symbol)
+    if fh is not None:
+        fh.seek(0)
+        fh.truncate()
+    else:
+        research_path('state', f'{symbol}.journal').write_text('', encoding='utf-8')
+    JOURNAL_LEN[symbol] = 0
+
+def _journal_replay(symbol, saved):
+    """
+    启动时在快照 (原始 JSON 字典) 上重放序号大于快照 _journal_seq 的日志条目。
+    崩溃时写了一半的末行解析失败直接跳过；快照写完、日志未清空时残留的旧条目按序号跳过。
+    """
+    path = research_path('state', f'{symbol}.journal')
+    if not path.exists(): return saved
+    base = int(saved.get('_journal_seq') or 0)
+    text = path.read_text(encoding='utf-8', errors='ignore')
+    if text and not text.endswith('\n'):
+        with path.open('a', encoding='utf-8') as fh: fh.write('\n')   # 半行收尾，后续追加不会粘连
+    lines = [ln for ln in text.splitlines() if ln.strip()]
+    applied = 0
+    for line in lines:
+        try:
+            rec = json.loads(line)
+            seq = int(rec['n'])
+        except (ValueError, KeyError, TypeError):
+            continue
+        if seq <= base: continue
+        saved.update(rec.get('s') or {})
+        if rec.get('ft'):
+            saved['_fill_tracker'] = {**(saved.get('_fill_tracker') or {}), **rec['ft']}
+        if rec.get('fid'):
+            ids = list(saved.get('filled_order_ids') or [])
+            saved['filled_order_ids'] = ids + [i for i in rec['fid'] if i not in ids]
+        saved['_journal_seq'] = base = seq
+        applied += 1
+    JOURNAL_LEN[symbol] = len(lines)
+    if applied: info('♻️ [{}] 预写日志重放 {} 条 (快照之后的堆栈/成交变更)', symbol, applied)
+    return saved
+
+def flush_states(force=False):
+    """落盘到期的脏状态；force=True 时 (日终/盘后/热重载) 全部落盘。成交库缓冲每次都落盘。"""
+    TRADES.flush()
+    if not STATE_DIRTY: return
+    now = CLOCK.now()
+    for sym in list(STATE_DIRTY):
+        last = STATE_FLUSHED.get(sym)
+        if force or last is None or (now - last).total_seconds() >= StrategyConfig.PERSIST.FLUSH_SEC:
+            _flush_one(sym)
+
+# ---------------- 行情录制 (Replay Recorder) ----------------
+
+def _replay_open(context, phase='intraday'):
+    """
+    按交易日打开 replay/<日期>.jsonl (只追加)。新文件先写一条 init 记录：
+    标的配置 + 持仓 + 状态白名单 + 近 N 日日线，离线回放据此复原当日起点。
+    """
+    global REPLAY_FH, REPLAY_DATE, REPLAY_ACCT
+    now_dt = context.current_dt
+    today_str = now_dt.strftime('%Y-%m-%d')
+    if REPLAY_DATE == today_str and REPLAY_FH is not None: return REPLAY_FH
+    try:
+        if REPLAY_FH: REPLAY_FH.close()
+    except: pass
+    REPLAY_FH = open(research_path('replay', f'{today_str}.jsonl'), 'a', encoding='utf-8')
+    REPLAY_DATE = today_str
+
+    symbols = list(getattr(context, 'symbol_list', []) or [])
+    pos, daily = {}, {}
+    for sym in symbols:
+        try:
+            p = get_position(sym)
+            pos[sym] = [p.amount, p.enable_amount, p.cost_basis]
+        except Exception: pass
+    try:
+        hist = get_history(StrategyConfig.REPLAY.DAILY_BARS, '1d', ['open', 'high', 'low', 'close'], security_list=symbols)
+        for sym in symbols:
+            df = hist.get(sym) if isinstance(hist, dict) else None
+            if df is None or df.empty: continue
+            daily[sym] = [[ix.strftime('%Y-%m-%d'), *map(float, row)] for ix, row in zip(df.index, df[['open', 'high', 'low', 'close']].values)]
+    except Exception: pass
+    init = {'phase': phase, 'cfg': getattr(context, 'symbol_config', {}), 'pos': pos, 'daily': daily,
+            'state': {sym: _state_store(st) for sym, st in context.state.items()}}
+    REPLAY_ACCT = {'pos': dict(pos), 'ord': {}}
+    _replay_write(now_dt, 'init', init)
+    return REPLAY_FH
+
+def _replay_write(dt, kind, payload):
+    REPLAY_FH.write(json.dumps({'t': str(dt), 'k': kind, 'd': payload}, ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+    REPLAY_FH.flush()
+
+def _replay_record(context, kind, payload):
+    """
+    录制一条事件：snap (分钟快照) / trade (成交推送) / order (报单结果) / ostat (订单状态查询结果)。
+    未开启录制时零开销返回；录制失败绝不影响交易。
+    """
+    if not StrategyConfig.REPLAY.RECORD: return
+    try:
+        _replay_open(context)
+        _replay_write(context.current_dt, kind, payload)
+    except Exception as e:
+        log.error(f"行情录制失败: {e}")
+
+def _replay_account(context):
+    """
+    录制账户增量 (acct)：持仓 [数量, 可用, 成本] 与当日委托 [标的, 数量, 价格, 已成, 状态, 成交均价]，
+    只写出与上一条相比发生变化的条目。回放据此对齐替身账户，丢失/延迟的成交推送也能被忠实复现。
+    """
+    if not StrategyConfig.REPLAY.RECORD: return
+    try:
+        _replay_open(context)
+        pos_delta, ord_delta = {}, {}
+        for sym in context.symbol_list:
+            p = get_position(sym)
+            row = [p.amount, p.enable_amount, p.cost_basis]
+            if REPLAY_ACCT['pos'].get(sym) != row:
+                pos_delta[sym] = REPLAY_ACCT['pos'][sym] = row
+        for o in get_orders() or []:
+            o_info = OrderUtils.normalize(o)
+            eid = o_info['entrust_no']
+            if not eid: continue
+            if isinstance(o, dict):
+                filled, trade_px = o.get('filled', 0), o.get('trade_price', 0)
+            else:
+                filled, trade_px = getattr(o, 'filled', 0), getattr(o, 'trade_price', 0)
+            row = [o_info['std_symbol'], o_info['amount'], o_info['price'], filled, o_info['status'], trade_px]
+            if REPLAY_ACCT['ord'].get(eid) != row:
+                ord_delta[eid] = REPLAY_ACCT['ord'][eid] = row
+        if pos_delta or ord_delta:
+            _replay_write(context.current_dt, 'acct', {'pos': pos_delta, 'ord': ord_delta})
+    except Exception as e:
+        log.error(f"账户录制失败: {e}")
+
+def _place_order(context, symbol, amount, limit_price):
+    """统一报单出口：录制报单结果 (委托号或拒单原因)，异常原样抛给调用方处理。"""
+    try:
+        eid = order(symbol, amount, limit_price=limit_price)
+    except Exception as e:
+        _replay_record(context, 'order', {'s': symbol, 'a': amount, 'p': limit_price, 'err': str(e)})
+        raise
+    finally:
+        ACCOUNT.invalidate(symbol)
+    _replay_record(context, 'order', {'s': symbol, 'a': amount, 'p': limit_price, 'no': str(eid) if eid else None})
+    return eid
+
 # ---------------- 初始化与时间窗口判断 ----------------
 
 def initialize(context):
     log_file = _ensure_daily_logfile()
     log.info(f'🔍 日志同时写入到 {log_file}')
     context.env = check_environment()
+    # 回测没有真实的墙钟时间，时间窗口与冷却期跟随回测时间轴 (外部注入的时钟优先)
+    if '回测' in context.env and isinstance(CLOCK, WallClock):
+        set_clock(ContextClock(context))
     info("当前环境：{}", context.env)
     context.run_cycle = get_saved_param('run_cycle_seconds', 60)
 
@@ -438,11 +1507,12 @@ def initialize(context):
     for sym, cfg in context.symbol_config.items():
         init_symbol_state(context, sym, cfg)
 
-    context.boot_dt = getattr(context, 'current_dt', None) or datetime.now()
+    context.boot_dt = getattr(context, 'current_dt', None) or CLOCK.now()
     context.last_report_time = None
     context.initial_cleanup_done = False
     
     StrategyConfig.load(context)
+    install_perf_hooks()
     _repair_state_logic(context)
     
     if '回测' not in context.env:
@@ -460,94 +1530,16 @@ def initialize(context):
 
 def init_symbol_state(context, sym, cfg):
     """
-    [Global Ver: v3.13.15] [Func Ver: 1.6]
-    终极防御：将防崩装甲武装到数值型字段，彻底消灭 float + None 的数学运算崩溃。
+    [Global Ver: v3.13.15] [Func Ver: 1.7]
+    读取快照 + 重放预写日志，字段装配与数值防崩见 SymbolState.from_json。
     """
     state_file = research_path('state', f'{sym}.json')
     saved = json.loads(state_file.read_text(encoding='utf-8')) if state_file.exists() else get_saved_param(f'state_{sym}', {}) or {}
+    saved = _journal_replay(sym, dict(saved))
     
-    st = {**cfg}
-    
-    saved_initial_base = saved.get('initial_base_position')
-    actual_initial_base = saved_initial_base if saved_initial_base is not None else cfg.get('initial_base_position', 0)
-    
-    saved_initial_val = saved.get('initial_position_value')
-    actual_initial_val = saved_initial_val if saved_initial_val is not None else (actual_initial_base * cfg.get('base_price', 1.0))
-
-    max_grids = cfg.get('max_grid_count', 12)
-
-    st.update({
-        'symbol': sym, 
-        'initial_base_position': actual_initial_base, 
-        'base_position': saved.get('base_position', actual_initial_base),
-        'last_week_position': saved.get('last_week_position', actual_initial_base),
-        'initial_position_value': actual_initial_val, 
-        
-        'dingtou_base': saved.get('dingtou_base') if saved.get('dingtou_base') is not None else cfg.get('dingtou_base', 0),
-        'dingtou_rate': saved.get('dingtou_rate') if saved.get('dingtou_rate') is not None else cfg.get('dingtou_rate', 0),
-        
-        'base_price': saved.get('base_price', cfg.get('base_price', 1.0)),
-        'grid_unit': saved.get('grid_unit', cfg.get('grid_unit', 100)),
-        
-        'buy_grid_spacing': saved.get('buy_grid_spacing', 0.005),
-        'sell_grid_spacing': saved.get('sell_grid_spacing', 0.005),
-        
-        'tp_cool_weeks': cfg.get('tp_cool_weeks', saved.get('tp_cool_weeks', StrategyConfig.VA.TP_COOL_WEEKS)),
-        'tp_min_weeks': cfg.get('tp_min_weeks', saved.get('tp_min_weeks', StrategyConfig.VA.TP_MIN_WEEKS)),
-        'tp_min_value': cfg.get('tp_min_value', saved.get('tp_min_value', StrategyConfig.VA.TP_MIN_VALUE)),
-        
-        'filled_order_ids': set(saved.get('filled_order_ids') or []),
-        'trade_week_set': set(saved.get('trade_week_set') or []),
-        
-        'max_grid_count': max_grids,
-        'max_position': saved.get('base_position', actual_initial_base) + saved.get('grid_unit', cfg.get('grid_unit', 100)) * max_grids,
-        
-        'grid_atr_rate': saved.get('grid_atr_rate', saved.get('used_atr_rate', None)),
-        'macro_atr_rate': saved.get('macro_atr_rate', None),
-        
-        'buy_stack': [],
-        'sell_stack': [],
-        'credit_limit': cfg.get('credit_limit', saved.get('credit_limit', StrategyConfig.CREDIT_LIMIT)),
-        
-        '_fill_tracker': saved.get('_fill_tracker') or {}, 
-        
-        # 🌟 V3.13.15 核心修复：数值型字段的严格 is not None 护航
-        'history_pnl': saved.get('history_pnl') if saved.get('history_pnl') is not None else 0.0,
-        '_tp_hwm_ratio': saved.get('_tp_hwm_ratio') if saved.get('_tp_hwm_ratio') is not None else 0.0,
-        '_tp_tier': saved.get('_tp_tier') if saved.get('_tp_tier') is not None else 0,
-        
-        '_macro_sell_ids': saved.get('_macro_sell_ids') or [],
-        
-        '_drip_amount': saved.get('_drip_amount') if saved.get('_drip_amount') is not None else 0.0,
-        '_drip_remain_weeks': saved.get('_drip_remain_weeks') if saved.get('_drip_remain_weeks') is not None else 0,
-        
-        'va_last_update_dt': None,
-        '_halt_next_log_dt': None,
-        '_oo_last': 0,
-        '_recover_until': None,
-        '_after_cancel_until': None,
-        '_oo_drop_seen_ts': None,
-        '_pos_jump_seen_ts': None,
-        '_pos_confirm_deadline': None,
-        '_rehang_due_ts': None,
-        '_ignore_place_until': None,
-        '_pending_ignore_ids': saved.get('_pending_ignore_ids') or [],
-        'wm_map': saved.get('wm_map') or {},
-        
-        # 🌟 V3.13.15 核心修复：防止 current_V + state['wm_pnl'] 数学崩溃
-        'wm_pnl': saved.get('wm_pnl') if saved.get('wm_pnl') is not None else 0.0
-    })
-
-    for key in ['buy_stack', 'sell_stack']:
-        raw = saved.get(key) or []
-        for item in raw:
-            st[key].append(tuple(item) if isinstance(item, (list, tuple)) else (item, st['grid_unit']))
-        heapq.heapify(st[key])
-
-    for k in ['scale_factor', 'pending_fill_amount', 'used_atr_rate', 'cached_atr_ema']:
-        if k in st: st.pop(k)
-        
+    st = SymbolState.from_json(sym, saved, cfg)
     context.state[sym] = st
+    if JOURNAL_LEN.get(sym): STATE_DIRTY[sym] = st   # 有日志待压实：下个落盘周期写成快照
     context.latest_data[sym] = st['base_price']
     context.should_place_order_map[sym] = True
     context.mark_halted[sym] = False
@@ -567,7 +1559,7 @@ def audit_initial_consistency(context, symbol):
         # 理论上 Stack 里应该有多少股
         theoretical_stack_shares = actual_pos - base_pos
         # 实际上 Stack 里记录了多少股
-        current_stack_shares = sum(item[1] for item in state['buy_stack'])
+        current_stack_shares = state['buy_stack'].total()
         
         if theoretical_stack_shares != current_stack_shares:
             info("⚠️ [{}] 审计异常: 实盘持仓网格部分 {} 股, 但 Stack 记录 {} 股。差额: {}。请检查 JSON。", 
@@ -585,14 +1577,10 @@ def _repair_state_logic(context):
         weeks = len(state.get('trade_week_set', []))
         if weeks <= 0: continue
             
-        d_base = state.get('dingtou_base', 0)
-        d_rate = state.get('dingtou_rate', 0)
-        acc_invest = sum(d_base * (1 + d_rate)**w for w in range(1, weeks + 1))
-        target_val = state['initial_position_value'] + acc_invest
         price = state['base_price']
         if price <= 0: continue
             
-        theoretical_pos = int(target_val / price / 100) * 100
+        theoretical_pos = va_target_shares(state, weeks, price)
         current_pos = state['base_position']
         
         if current_pos < theoretical_pos * 0.70 and theoretical_pos > state['initial_base_position']:
@@ -604,15 +1592,15 @@ def _repair_state_logic(context):
             info(f"[{dsym(context, sym)}] ✅ 修复完成。底仓已重置为 {theoretical_pos}")
 
 def is_main_trading_time():
-    now = datetime.now().time()
+    now = CLOCK.now().time()
     return (dtime(9, 30) <= now <= dtime(11, 30)) or (dtime(13, 0) <= now <= dtime(15, 0))
 
 def is_auction_time():
-    now = datetime.now().time()
+    now = CLOCK.now().time()
     return dtime(9, 15) <= now < dtime(9, 25)
 
 def is_order_blocking_period():
-    now = datetime.now().time()
+    now = CLOCK.now().time()
     return dtime(9, 25) <= now < dtime(9, 30)
 
 # ---------------- 启动后清理与收敛 ----------------
@@ -624,14 +1612,17 @@ def before_trading_start(context, data):
     except Exception as e:
         info('⚠️ [Pre-Market] 盘前配置同步异常: {}', e)
 
+    try: refresh_atr_cache(context)
+    except Exception as e: info('⚠️ [Pre-Market] 网格ATR预热异常: {}', e)
+
+    if StrategyConfig.REPLAY.RECORD:
+        try: _replay_open(context, phase='pre')
+        except Exception as e: info('⚠️ [Replay] 录制文件打开失败: {}', e)
+
     if '回测' not in context.env:
-        info('🔄 [PnL Reset] 强制重置 PnL 状态并回溯补算 (Scope: 45 days)...')
-        context.pnl_metrics = {} 
-        try:
-            _calculate_local_pnl_lifo(context) 
-        except Exception as e:
-            info('⚠️ PnL 补算遇到轻微错误: {} (后续会重试)', e)
-        generate_html_report(context)
+        # PnL 账本是增量的，无需清空重算；记账与面板交给后台报表线程，盘前清理不再等它
+        info('🔄 [PnL] 盘前增量记账与面板刷新已提交后台报表线程')
+        REPORTER.submit('pre', _report_pre_market, context, _report_snapshot(context))
         context.last_report_time = context.current_dt
 
     if context.initial_cleanup_done: return
@@ -668,6 +1659,7 @@ def after_initialize_cleanup(context):
             for o_info in to_cancel:
                 try:
                     cancel_order_ex(o_info['original'])
+                    ACCOUNT.invalidate(o_info['std_symbol'])
                     if OrderUtils.is_sell(o_info):
                         o_sym = o_info['std_symbol']
                         if o_sym in context.pending_frozen:
@@ -677,7 +1669,7 @@ def after_initialize_cleanup(context):
                     pass
 
     except Exception as e:
-        info('❌ 启动清理主流程异常: {}', e)
+        info('❌ 启动清理主流程异常: {}', e, flush=True)
     
     for sym in context.symbol_list:
         context.pending_frozen[sym] = 0
@@ -700,7 +1692,7 @@ def get_order_status(entrust_no):
         return ''
 
 def cancel_all_orders_by_symbol(context, symbol):
-    current_open_orders = get_open_orders(symbol) or []
+    current_open_orders = ACCOUNT.open_orders(symbol)
     total = 0
     cancelled_ids = set()
     
@@ -711,8 +1703,7 @@ def cancel_all_orders_by_symbol(context, symbol):
         context.canceled_cache = {'date': today, 'orders': set()}
     cache = context.canceled_cache['orders']
 
-    for o in current_open_orders:
-        order_info = OrderUtils.normalize(o)
+    for order_info in current_open_orders:
         if order_info['std_symbol'] != symbol: continue
 
         entrust_no = order_info['entrust_no']
@@ -723,6 +1714,7 @@ def cancel_all_orders_by_symbol(context, symbol):
             continue
             
         final_status = get_order_status(entrust_no)
+        _replay_record(context, 'ostat', {'no': entrust_no, 's': final_status})
         if final_status in ('8', '4', '5', '6'): continue
             
         cache.add(entrust_no)
@@ -730,6 +1722,7 @@ def cancel_all_orders_by_symbol(context, symbol):
         info('[{}] 👉 发现并尝试撤销遗留挂单 entrust_no={}', dsym(context, symbol), entrust_no)
         try:
             cancel_order_ex({'entrust_no': entrust_no, 'symbol': order_info['raw_symbol']})
+            ACCOUNT.invalidate(symbol)
             cancelled_ids.add(entrust_no)
             if OrderUtils.is_sell(order_info):
                 frozen = abs(order_info['amount'])
@@ -760,14 +1753,8 @@ def place_auction_orders(context):
         adjust_grid_unit(state)
         context.latest_data[sym] = state['base_price']
         
-        base = state['base_price']
         unit = state['grid_unit']
         
-        # 1. 原始计算
-        buy_sp, sell_sp = state['buy_grid_spacing'], state['sell_grid_spacing']
-        buy_p = round(base * (1 - buy_sp), 3)
-        sell_p = round(base * (1 + sell_sp), 3)
-        
         # [v3.8 同步升级] -----------------------------------------------
         # 提前获取持仓数据，判定 VA 建仓特权
         position = get_position(sym)
@@ -780,8 +1767,8 @@ def place_auction_orders(context):
         thresh_low = max(1, max_grids // 3)
         bypass_buy_block = (pos < target_base_pos + thresh_low * unit)
         
-        # 调用守门员 (7参数)，传入特权标志
-        buy_p, sell_p = _apply_price_guard(context, state, buy_p, sell_p, buy_sp, sell_sp, bypass_buy_block)
+        # 理论价 + 守门员修正 (grid_quote 缓存)，传入特权标志
+        buy_p, sell_p = _apply_price_guard(context, state, bypass_buy_block)
         # ---------------------------------------------------------------
         
         if pos + unit <= state['max_position']:
@@ -802,9 +1789,9 @@ def place_auction_orders(context):
 
     for task in orders_batch:
         try:
-            if count > 0 and count % 5 == 0: time.sleep(0.05)
+            if count > 0 and count % 5 == 0: CLOCK.sleep(0.05)
             # 发单
-            eid = order(task['symbol'], task['amount'], limit_price=task['price'])
+            eid = _place_order(context, task['symbol'], task['amount'], task['price'])
             
             if eid:
                 # 记录 Tracker
@@ -834,8 +1821,15 @@ def _fetch_quotes_via_snapshot(context):
     if isinstance(snaps, list):
         snaps = { (s.get('symbol') or s.get('stock_code') or s.get('security') or ''): s for s in snaps if isinstance(s, dict) }
 
+    if StrategyConfig.REPLAY.RECORD:
+        _replay_account(context)
+        # 只录制策略实际读取的字段，保持文件紧凑
+        _replay_record(context, 'snap', {sym: {k: v for k, v in snap.items() if k in ('last_px', 'last', 'price', 'p_up_price', 'p_down_price')}
+                                         for sym, snap in snaps.items() if isinstance(snap, dict)})
+
     now_dt = context.current_dt
-    got, miss_list = 0, []
+    now_ts = now_dt.timestamp()
+    fresh, miss_list = {}, []
     for sym in symbols:
         snap = snaps.get(sym)
         px = None
@@ -843,19 +1837,25 @@ def _fetch_quotes_via_snapshot(context):
             px = snap.get('last_px')
             if not is_valid_price(px): px = snap.get('last') or snap.get('price')
             
-            # 【核心】缓存物理涨跌停边界
-            if sym in context.state:
-                context.state[sym]['_up_limit'] = snap.get('p_up_price')
-                context.state[sym]['_down_limit'] = snap.get('p_down_price')
+            # 【核心】缓存物理涨跌停边界 (变化时组合数组标脏，报价缓存随之重算)
+            st = context.state.get(sym)
+            if st is not None:
+                up, down = snap.get('p_up_price'), snap.get('p_down_price')
+                if up != st._up_limit or down != st._down_limit:
+                    st._up_limit, st._down_limit = up, down
+                    book_touch(sym)
 
         if is_valid_price(px):
             px = float(px)
             context.latest_data[sym] = px
             context.last_valid_price[sym] = px
             context.last_valid_ts[sym] = now_dt
-            got += 1
+            fresh[sym] = px
+            if BOOK is not None: BOOK.quote(sym, px, now_ts)
         else:
             miss_list.append(sym)
+    got = len(fresh)
+    _update_intraday_metrics(context, fresh)
 
     if StrategyConfig.DEBUG.ENABLE:
         need_log = False
@@ -898,7 +1898,7 @@ def _remember_fill(context, key):
 def _in_reopen_window(now_t: dtime):
     anchors = [dtime(9,30,0), dtime(10,30,0), dtime(13,0,0)]
     for a in anchors:
-        if abs((datetime.combine(datetime.today(), now_t) - datetime.combine(datetime.today(), a)).total_seconds()) <= 35:
+        if abs((datetime.combine(CLOCK.now(), now_t) - datetime.combine(CLOCK.now(), a)).total_seconds()) <= 35:
             return True
     return False
 
@@ -909,7 +1909,16 @@ def check_pending_rehangs(context):
     now_t = context.current_dt.time()
     if (now_t.hour == 9 and now_t.minute == 30) or (now_t.hour == 13 and now_t.minute == 0): return
 
-    now_wall = datetime.now()
+    now_wall = CLOCK.now()
+    ACCOUNT.begin(context.symbol_list)
+    try:
+        with PERF.scope('rehang'):
+            _check_pending_rehangs(context, now_wall)
+    finally:
+        ACCOUNT.end()
+    flush_states()
+
+def _check_pending_rehangs(context, now_wall):
     for sym in context.symbol_list:
         if sym not in context.state: continue
         state = context.state[sym]
@@ -917,6 +1926,7 @@ def check_pending_rehangs(context):
         
         if rehang_ts and now_wall >= rehang_ts:
             info('[{}] ⏰ 补单冷却期已过, 触发挂单...', dsym(context, sym))
+            _replay_account(context)
             state['_rehang_due_ts'] = None
             ignore_ids = set(state.get('_pending_ignore_ids', []))
             if '_pending_ignore_ids' in state: state.pop('_pending_ignore_ids')
@@ -926,69 +1936,111 @@ def check_pending_rehangs(context):
 
 def _recalc_pending_frozen(context, symbol):
     try:
-        orders = get_open_orders(symbol) or []
         frozen = 0
-        for o in orders:
-            order_info = OrderUtils.normalize(o)
+        for order_info in ACCOUNT.open_orders(symbol):
             if OrderUtils.is_active(order_info) and OrderUtils.is_sell(order_info):
                 frozen += abs(order_info['amount'])
         context.pending_frozen[symbol] = frozen
         return frozen
     except Exception as e:
-        if StrategyConfig.DEBUG.ENABLE:
-            info('[{}] ⚠️ 同步冻结量失败: {}', dsym(context, symbol), e)
+        debug('[{}] ⚠️ 同步冻结量失败: {}', dsym(context, symbol), e)
         return context.pending_frozen.get(symbol, 0)
 
 # ---------------- 【核心】公共风控守门员 ----------------
 
-def _apply_price_guard(context, state, buy_p, sell_p, buy_sp, sell_sp, bypass_buy_block=False):
+GridQuote = namedtuple('GridQuote', 'theo_buy theo_sell sell_anchor buy_anchor buy_fix sell_fix down up')
+
+def grid_quote(state):
+    """
+    【网格报价缓存】理论买卖价、守门员修正价、涨跌停边界全部是整数价位 (PRICE_TICKS)，
+    只在基准价 / 间距 / 栈顶 / 授信 / 涨跌停变化时重算一次，竞价、挂单、棘轮、巡检共用。
+    buy_fix / sell_fix 为守门员会给出的修正价 (不触发为 None)，down / up 为跌停 / 涨停 (无效为 None)。
+    """
+    buy_stack, sell_stack = state.buy_stack, state.sell_stack
+    key = (state.base_price, state.buy_grid_spacing, state.sell_grid_spacing, state.credit_limit,
+           buy_stack.top_key() if buy_stack else None, sell_stack.top_key() if sell_stack else None,
+           state._up_limit, state._down_limit)
+    hit = state._quote
+    if hit is not None and hit[0] == key: return hit[1]
+
+    base, buy_sp, sell_sp, credit, buy_anchor, sell_top, up, down = key
+    tick = symbol_tick(state.symbol)
+    if is_valid_price(base):
+        # 买价向下、卖价向上取整，且至少离基准一档：小间距 + 0.01 元档时不会被挤成同价
+        theo_buy = min(to_ticks(base * (1 - buy_sp), tick, -1), to_ticks(base, tick, -1) - tick)
+        theo_sell = max(to_ticks(base * (1 + sell_sp), tick, 1), to_ticks(base, tick, 1) + tick)
+    else: theo_buy = theo_sell = 0
+    sell_anchor = -sell_top if sell_top is not None else None
+    buy_fix = sell_fix = None
+    if (credit or 0) <= 0:
+        # 【核心修复】买价等于或高于栈顶卖价 (>=)、卖价等于或低于栈顶买价 (<=) 都要修正，强制拉开最小利润空间
+        if sell_anchor is not None and theo_buy >= sell_anchor:
+            p = sell_anchor / PRICE_TICKS
+            fix = min(to_ticks(p - (p * buy_sp), tick, -1), sell_anchor // tick * tick - tick)     # 至少低于锚点一档
+            if fix < theo_buy: buy_fix = fix
+        if buy_anchor is not None and theo_sell <= buy_anchor:
+            p = buy_anchor / PRICE_TICKS
+            fix = max(to_ticks(p + (p * sell_sp), tick, 1), -(-buy_anchor // tick) * tick + tick)  # 至少高于锚点一档
+            if fix > theo_sell: sell_fix = fix
+    q = GridQuote(theo_buy, theo_sell, sell_anchor, buy_anchor, buy_fix, sell_fix,
+                  to_ticks(down) if is_valid_price(down) else None, to_ticks(up) if is_valid_price(up) else None)
+    state._quote = (key, q)
+    return q
+
+def _guard_ticks(context, state, bypass_buy_block=False):
     """
     [Global Ver: v3.12.14] 
     修复同价买卖摩擦漏洞：将边界判定从严格小于(<)改为小于等于(<=)，强制拉开最小利润空间。
+    修正价取自 grid_quote 缓存，这里只负责放行/拦截的决策与留痕；返回 (买, 卖) 整数价位。
     """
-    final_buy_p, final_sell_p = buy_p, sell_p
-    sym = state.get('symbol', 'Unknown')
-    
+    q = grid_quote(state)
+    buy_t, sell_t = q.theo_buy, q.theo_sell
+    sym = state.symbol
+
     # 1. 守门员逻辑：买入检查 (防止高位追高接回空单)
-    sell_stack = state.get('sell_stack', [])
-    if sell_stack:
-        max_sell_price = -sell_stack[0][0] 
-        # 【核心修复】：改为 >= 1e-5，只要买价等于或高于上一笔卖价，强制向下修正
-        if final_buy_p >= max_sell_price - 1e-5:
-            credit = state.get('credit_limit', 0)
-            if credit <= 0:
-                corrected = round(max_sell_price - (max_sell_price * buy_sp), 3)
-                if corrected < final_buy_p:
-                    if bypass_buy_block:
-                        info('[{}] 🛡️ 守门员(买): 触发【VA建仓特权】！无视历史卖飞价({:.3f})，放行挂单: {:.3f}', 
-                             dsym(context, sym), max_sell_price, final_buy_p)
-                    else:
-                        info('[{}] 🛡️ 守门员拦截(买): 防止高位接回/同价摩擦. 原:{:.3f} 修正:{:.3f} (栈顶卖价:{:.3f})', 
-                             dsym(context, sym), final_buy_p, corrected, max_sell_price)
-                        final_buy_p = corrected
+    if q.buy_fix is not None:
+        raw, corrected, anchor = buy_t / PRICE_TICKS, q.buy_fix / PRICE_TICKS, q.sell_anchor / PRICE_TICKS
+        if bypass_buy_block:
+            info('[{}] 🛡️ 守门员(买): 触发【VA建仓特权】！无视历史卖飞价({:.3f})，放行挂单: {:.3f}', 
+                 dsym(context, sym), anchor, raw)
+            emit_event('guard', sym, side='buy', action='bypass', raw=raw, corrected=corrected, anchor=anchor)
+        else:
+            info('[{}] 🛡️ 守门员拦截(买): 防止高位接回/同价摩擦. 原:{:.3f} 修正:{:.3f} (栈顶卖价:{:.3f})', 
+                 dsym(context, sym), raw, corrected, anchor)
+            emit_event('guard', sym, side='buy', action='intercept', raw=raw, corrected=corrected, anchor=anchor)
+            buy_t = q.buy_fix
 
     # 2. 守门员逻辑：卖出检查 (防止低位割肉或同价白打工)
-    buy_stack = state.get('buy_stack', [])
-    if buy_stack:
-        min_buy_price = buy_stack[0][0]
-        # 【核心修复】：改为 <= 1e-5，只要卖价等于或低于上一笔买价，强制向上修正
-        if final_sell_p <= min_buy_price + 1e-5:
-            credit = state.get('credit_limit', 0)
-            if credit <= 0:
-                corrected = round(min_buy_price + (min_buy_price * sell_sp), 3)
-                if corrected > final_sell_p:
-                    info('[{}] 🛡️ 守门员拦截(卖): 防止低位割肉/同价摩擦. 原:{:.3f} 修正:{:.3f} (栈顶买价:{:.3f})', 
-                         dsym(context, sym), final_sell_p, corrected, min_buy_price)
-                    final_sell_p = corrected
-                
-    return final_buy_p, final_sell_p
+    if q.sell_fix is not None:
+        raw, corrected, anchor = sell_t / PRICE_TICKS, q.sell_fix / PRICE_TICKS, q.buy_anchor / PRICE_TICKS
+        info('[{}] 🛡️ 守门员拦截(卖): 防止低位割肉/同价摩擦. 原:{:.3f} 修正:{:.3f} (栈顶买价:{:.3f})', 
+             dsym(context, sym), raw, corrected, anchor)
+        emit_event('guard', sym, side='sell', action='intercept', raw=raw, corrected=corrected, anchor=anchor)
+        sell_t = q.sell_fix
+
+    return buy_t, sell_t
+
+def _apply_price_guard(context, state, bypass_buy_block=False):
+    """守门员修正后的 (买, 卖) 挂单价 (元)。"""
+    buy_t, sell_t = _guard_ticks(context, state, bypass_buy_block)
+    return buy_t / PRICE_TICKS, sell_t / PRICE_TICKS
 
 # ---------------- 网格限价挂单主逻辑 ----------------
 
+# 挂单闸门参数：逐标的流程与 PortfolioBook.screen / _screen_timers 共用，改动闸门时两边必须同步
+RATCHET_BAND = 0.10         # 现价偏离基准在 ±10% 内影子棘轮才生效
+ORDER_COOLDOWN_SEC = 30     # 两次常规挂单的最小间隔
+TRADE_COOLDOWN_SEC = 60     # 成交后暂停常规挂单的时长
+
+def _in_ratchet_band(price, base):
+    """影子棘轮生效区间 (标量与 NumPy 数组通用)。"""
+    return abs(price / base - 1) <= RATCHET_BAND
+
 def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_lock=False, ignore_entrust_nos=None):
     """
     [Global Ver: v3.11.0]
     增加 影子棘轮机制 (Ghost Ratchet)，在守门员拦截时基准价依然如影随形。
+    闸门 (冷却、停牌、守门员、破锁、涨跌停、棘轮) 改动需同步 _screen_timers 与 PortfolioBook.screen。
     """
     if context.current_dt.time() >= dtime(14, 55): return
 
@@ -996,12 +2048,12 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
     now_dt = context.current_dt
     
     if not bypass_lock:
-        ignore_until = state.get('_ignore_place_until')
-        if ignore_until and datetime.now() < ignore_until: return
+        ignore_until = state._ignore_place_until
+        if ignore_until and CLOCK.now() < ignore_until: return
 
-    if state.get('_rehang_due_ts') is not None: return
-    if (not ignore_cooldown) and state.get('_last_trade_ts') \
-       and (now_dt - state['_last_trade_ts']).total_seconds() < 60:
+    if state._rehang_due_ts is not None: return
+    last_trade = state._last_trade_ts
+    if (not ignore_cooldown) and last_trade and (now_dt - last_trade).total_seconds() < TRADE_COOLDOWN_SEC:
         return
 
     if is_order_blocking_period(): return
@@ -1026,20 +2078,19 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
     boot_grace = (now_dt - getattr(context, 'boot_dt', now_dt)).total_seconds() < StrategyConfig.BOOT.GRACE_SECONDS
     allow_tickless = boot_grace or is_auction_time()
 
-    base = state['base_price']
-    unit, buy_sp, sell_sp = state['grid_unit'], state['buy_grid_spacing'], state['sell_grid_spacing']
+    base = state.base_price
+    unit, buy_sp = state.grid_unit, state.buy_grid_spacing
     
     # 提前获取持仓与缺口信息
-    position = get_position(symbol)
+    position = ACCOUNT.position(symbol)
     pos = position.amount 
-    target_base_pos = state.get('base_position', 0)
+    target_base_pos = state.base_position
     
-    # 1. 原始计算 (网格理论挂单价)
-    theo_buy_p = round(base * (1 - buy_sp), 3)
-    theo_sell_p = round(base * (1 + sell_sp), 3)
-    buy_p, sell_p = theo_buy_p, theo_sell_p
+    # 1. 原始计算 (网格理论挂单价，整数价位；基准与间距不变时取缓存)
+    q = grid_quote(state)
+    theo_buy_t, theo_sell_t = q.theo_buy, q.theo_sell
     
-    if not is_valid_price(buy_p) or not is_valid_price(sell_p): return
+    if theo_buy_t <= 0 or theo_sell_t <= 0: return
 
     # ==========================================
     # V3.13.9.2: VA 建仓特权动态锚定“浅水区”边界 (取代硬编码的 5)
@@ -1049,13 +2100,13 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
     bypass_buy_block = (pos < target_base_pos + thresh_low * unit)
 
     # [第一次守门] 携带 bypass_buy_block 标志
-    buy_p, sell_p = _apply_price_guard(context, state, buy_p, sell_p, buy_sp, sell_sp, bypass_buy_block)
+    buy_t, sell_t = _guard_ticks(context, state, bypass_buy_block)
 
     # ==========================================
     # v3.9/v3.10 模块 B: ATR 天地锁破锁机制 (纯空间加权融合)
     # ==========================================
-    if buy_p > 0 and sell_p > 0:
-        gap_pct = (sell_p - buy_p) / buy_p
+    if buy_t > 0 and sell_t > 0:
+        gap_pct = (sell_t - buy_t) / buy_t
         
         # [V3.12.5 紧急修复] 破锁机制属于微观网格防御，对接高敏 Grid_ATR
         atr_pct = calculate_grid_atr(context, symbol, atr_period=14)
@@ -1070,17 +2121,14 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
                  dsym(context, symbol), gap_pct, UNLOCK_MULTIPLIER, UNLOCK_MULTIPLIER * atr_pct)
             
             # 计算买卖盘被守门员扭曲的程度
-            distortion_buy = theo_buy_p - buy_p
-            distortion_sell = sell_p - theo_sell_p
+            distortion_buy = theo_buy_t - buy_t
+            distortion_sell = sell_t - theo_sell_t
             
             if distortion_buy > distortion_sell and state['sell_stack']:
                 # 买盘扭曲严重，说明是历史卖飞单惹的祸 (处理 sell_stack)
                 if len(state['sell_stack']) >= 2:
-                    sorted_sells = sorted(state['sell_stack'], key=lambda x: x[0], reverse=True)
-                    o1, o2 = sorted_sells[0], sorted_sells[1]
-                    
-                    state['sell_stack'].remove(o1)
-                    state['sell_stack'].remove(o2)
+                    # 远端两笔 = 存值最大的两笔 (卖单存 -价格，即实际价格最低的两笔)
+                    o1, o2 = state['sell_stack'].pop_far(), state['sell_stack'].pop_far()
                     
                     p1, v1 = -o1[0], o1[1]
                     p2, v2 = -o2[0], o2[1]
@@ -1090,22 +2138,20 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
                     v_merge = v1 + v2
                     
                     # 重新压入栈 (转化回 -price)
-                    heapq.heappush(state['sell_stack'], (-p_merge, v_merge))
+                    state['sell_stack'].push(-p_merge, v_merge)
                     info('[{}] 🧬 空间融合(软化空头): 极低卖飞单 {:.3f}({}股) 与 {:.3f}({}股) 融合为新防线: {:.3f}({}股)', 
                          dsym(context, symbol), p1, v1, p2, v2, p_merge, v_merge)
+                    emit_event('merge', symbol, kind='lock_break', stack='sell', p1=p1, v1=v1, p2=p2, v2=v2, price=p_merge, qty=v_merge)
                 else:
-                    removed_record = state['sell_stack'].pop(0)
+                    removed_record = state['sell_stack'].pop_top()
                     info('[{}] 🔪 破锁(清空头): 仅剩单笔极值，直接剔除极低卖飞单: 价:{:.3f} 量:{}', 
                          dsym(context, symbol), -removed_record[0], removed_record[1])
+                    emit_event('merge', symbol, kind='lock_break_drop', stack='sell', price=-removed_record[0], qty=removed_record[1])
                      
             elif distortion_sell > distortion_buy and state['buy_stack']:
                 # 卖盘扭曲严重，说明是历史套牢单惹的祸 (处理 buy_stack)
                 if len(state['buy_stack']) >= 2:
-                    sorted_buys = sorted(state['buy_stack'], key=lambda x: x[0], reverse=True)
-                    o1, o2 = sorted_buys[0], sorted_buys[1]
-                    
-                    state['buy_stack'].remove(o1)
-                    state['buy_stack'].remove(o2)
+                    o1, o2 = state['buy_stack'].pop_far(), state['buy_stack'].pop_far()
                     
                     p1, v1 = o1[0], o1[1]
                     p2, v2 = o2[0], o2[1]
@@ -1114,33 +2160,32 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
                     p_merge = round((p1 * v1 + p2 * v2) / (v1 + v2), 3)
                     v_merge = v1 + v2
                     
-                    heapq.heappush(state['buy_stack'], (p_merge, v_merge))
+                    state['buy_stack'].push(p_merge, v_merge)
                     info('[{}] 🧬 空间融合(软化多头): 极高套牢单 {:.3f}({}股) 与 {:.3f}({}股) 融合为新防线: {:.3f}({}股)', 
                          dsym(context, symbol), p1, v1, p2, v2, p_merge, v_merge)
+                    emit_event('merge', symbol, kind='lock_break', stack='buy', p1=p1, v1=v1, p2=p2, v2=v2, price=p_merge, qty=v_merge)
                 else:
-                    removed_record = state['buy_stack'].pop(0)
+                    removed_record = state['buy_stack'].pop_top()
                     info('[{}] 🔪 破锁(清多头): 仅剩单笔极值，移交极高套牢单至VA底仓: 价:{:.3f} 量:{}', 
                          dsym(context, symbol), removed_record[0], removed_record[1])
+                    emit_event('merge', symbol, kind='lock_break_drop', stack='buy', price=removed_record[0], qty=removed_record[1])
             
-            # 清理后必须重新堆化
-            heapq.heapify(state['sell_stack'])
-            heapq.heapify(state['buy_stack'])
+            journal_state(symbol, state, ('buy_stack', 'sell_stack'))
             
             # 融合软化了极值阻力后，重新过一次守门员，获取健康的网格挂单价
-            buy_p, sell_p = _apply_price_guard(context, state, theo_buy_p, theo_sell_p, buy_sp, sell_sp, bypass_buy_block)
-            info('[{}] ♻️ 融合破锁后重新排单: 买 {:.3f} | 卖 {:.3f}', dsym(context, symbol), buy_p, sell_p)
+            buy_t, sell_t = _guard_ticks(context, state, bypass_buy_block)
+            info('[{}] ♻️ 融合破锁后重新排单: 买 {:.3f} | 卖 {:.3f}', dsym(context, symbol), buy_t / PRICE_TICKS, sell_t / PRICE_TICKS)
 
-    up_limit = state.get('_up_limit')
-    down_limit = state.get('_down_limit')
+    buy_p, sell_p = buy_t / PRICE_TICKS, sell_t / PRICE_TICKS
     can_place_buy = True
     can_place_sell = True
 
-    if is_valid_price(up_limit) and is_valid_price(down_limit):
-        if buy_p < down_limit:
-            info('[{}] 🛡️ 空间封锁：买价 {:.3f} 低于跌停线 {:.3f}，暂停挂买。', dsym(context, symbol), buy_p, down_limit)
+    if q.up is not None and q.down is not None:
+        if buy_t < q.down:
+            info('[{}] 🛡️ 空间封锁：买价 {:.3f} 低于跌停线 {:.3f}，暂停挂买。', dsym(context, symbol), buy_p, q.down / PRICE_TICKS)
             can_place_buy = False
-        if sell_p > up_limit:
-            info('[{}] 🛡️ 空间封锁：卖价 {:.3f} 高于涨停线 {:.3f}，暂停挂卖。', dsym(context, symbol), sell_p, up_limit)
+        if sell_t > q.up:
+            info('[{}] 🛡️ 空间封锁：卖价 {:.3f} 高于涨停线 {:.3f}，暂停挂卖。', dsym(context, symbol), sell_p, q.up / PRICE_TICKS)
             can_place_sell = False
 
     # ==========================================
@@ -1150,27 +2195,30 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
     ratchet_enabled = (not allow_tickless) and is_valid_price(price)
 
     if ratchet_enabled:
-        if abs(price / base - 1) <= 0.10:
+        if _in_ratchet_band(price, base):
             is_in_low_pos_range = (pos - unit <= state['base_position'])
             is_in_high_pos_range = (pos + unit >= state['max_position'])
             
             # 判定理论网格价是否被守门员强制扭曲拦截
-            is_sell_blocked_by_guard = (sell_p > theo_sell_p)
-            is_buy_blocked_by_guard = (buy_p < theo_buy_p)
+            is_sell_blocked_by_guard = (sell_t > theo_sell_t)
+            is_buy_blocked_by_guard = (buy_t < theo_buy_t)
             
             # 触发条件：不仅在极限仓位时跟随，在被守门员拦截时也如影随形地跟随
-            ratchet_up = (price >= theo_sell_p) and (is_in_low_pos_range or is_sell_blocked_by_guard)
-            ratchet_down = (price <= theo_buy_p) and (is_in_high_pos_range or is_buy_blocked_by_guard)
+            price_t = to_ticks(price)
+            ratchet_up = (price_t >= theo_sell_t) and (is_in_low_pos_range or is_sell_blocked_by_guard)
+            ratchet_down = (price_t <= theo_buy_t) and (is_in_high_pos_range or is_buy_blocked_by_guard)
+            theo_buy_p, theo_sell_p = theo_buy_t / PRICE_TICKS, theo_sell_t / PRICE_TICKS
             
             if ratchet_up:
                 info('[{}] 🚀 影子棘轮上移(拦截/空仓): 触及理论卖价 {:.3f}，基准抬至 {:.3f}', dsym(context, symbol), theo_sell_p, theo_sell_p)
+                emit_event('ratchet', symbol, dir='up', old=base, new=theo_sell_p, price=price, guard=is_sell_blocked_by_guard)
                 state['base_price'] = theo_sell_p
                 cancelled_ids = cancel_all_orders_by_symbol(context, symbol)
                 if cancelled_ids: state['_pending_ignore_ids'] = list(cancelled_ids)
                 
                 # 核心修复：把接力棒交给异步补单机制，延迟 2 秒让 API 消化撤单
                 delay_s = StrategyConfig.DEBUG.DELAY_AFTER_CANCEL
-                state['_rehang_due_ts'] = datetime.now() + timedelta(seconds=max(delay_s, 2.0))
+                state['_rehang_due_ts'] = CLOCK.now() + timedelta(seconds=max(delay_s, 2.0))
                 
                 state.pop('_last_order_ts', None)
                 state.pop('_last_order_bp', None)
@@ -1179,13 +2227,14 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
                 
             elif ratchet_down:
                 info('[{}] ⚓ 影子棘轮下移(拦截/满仓): 触及理论买价 {:.3f}，基准降至 {:.3f}', dsym(context, symbol), theo_buy_p, theo_buy_p)
+                emit_event('ratchet', symbol, dir='down', old=base, new=theo_buy_p, price=price, guard=is_buy_blocked_by_guard)
                 state['base_price'] = theo_buy_p
                 cancelled_ids = cancel_all_orders_by_symbol(context, symbol)
                 if cancelled_ids: state['_pending_ignore_ids'] = list(cancelled_ids)
                 
                 # 核心修复：把接力棒交给异步补单机制
                 delay_s = StrategyConfig.DEBUG.DELAY_AFTER_CANCEL
-                state['_rehang_due_ts'] = datetime.now() + timedelta(seconds=max(delay_s, 2.0))
+                state['_rehang_due_ts'] = CLOCK.now() + timedelta(seconds=max(delay_s, 2.0))
                 
                 state.pop('_last_order_ts', None)
                 state.pop('_last_order_bp', None)
@@ -1194,25 +2243,23 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
 
     if not ignore_cooldown:
         last_ts = state.get('_last_order_ts')
-        if last_ts and (now_dt - last_ts).seconds < 30: return
+        if last_ts and (now_dt - last_ts).seconds < ORDER_COOLDOWN_SEC: return
         last_bp = state.get('_last_order_bp')
         if last_bp and abs(base / last_bp - 1) < buy_sp / 2: return
     
     state['_last_order_ts'], state['_last_order_bp'] = now_dt, base
 
     try:
-        raw_open_orders = get_open_orders(symbol) or []
         open_orders = []
         ignore_set = set(ignore_entrust_nos) if ignore_entrust_nos else set()
         filled_ids = state.get('filled_order_ids', set())
         
-        for o in raw_open_orders:
-             order_info = OrderUtils.normalize(o)
+        for order_info in ACCOUNT.open_orders(symbol):
              if OrderUtils.is_active(order_info):
                  eid = order_info['entrust_no']
                  if eid and eid in ignore_set: continue
                  if eid and eid in filled_ids: continue
-                 open_orders.append(o)
+                 open_orders.append(order_info['original'])
         
         same_buy = any(o.amount > 0 for o in open_orders)
         same_sell = any(o.amount < 0 for o in open_orders)
@@ -1226,7 +2273,7 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
         if can_place_buy and not same_buy and pos + unit <= state['max_position']:
             try:
                 # buy_p 已被完美修正
-                eid = order(symbol, unit, limit_price=buy_p)
+                eid = _place_order(context, symbol, unit, buy_p)
                 if eid: state['_fill_tracker'][str(eid)] = 0.0
                 info('[{}] --> 发起买入委托: {}股 @ {:.3f}', dsym(context, symbol), unit, buy_p)
             except Exception as e:
@@ -1243,7 +2290,7 @@ def place_limit_orders(context, symbol, state, ignore_cooldown=False, bypass_loc
         if can_place_sell and can_sell and real_enable >= unit and pos - unit >= state['base_position']:
             try:
                 # sell_p 已被完美修正
-                eid = order(symbol, -unit, limit_price=sell_p)
+                eid = _place_order(context, symbol, -unit, sell_p)
                 if eid: state['_fill_tracker'][str(eid)] = 0.0
                 info('[{}] --> 发起卖出委托: {}股 @ {:.3f} (可用:{}, 冻结:{})', dsym(context, symbol), unit, sell_p, enable_amount, pending_frozen)
                 context.pending_frozen[symbol] = pending_frozen + unit
@@ -1269,10 +2316,15 @@ def on_trade_response(context, trade_list):
     """
     if not hasattr(context, 'processed_business_ids'):
         context.processed_business_ids = deque(maxlen=2000)
+
+    if StrategyConfig.REPLAY.RECORD:
+        _replay_account(context)
+        _replay_record(context, 'trade', trade_list)
         
     for tr in trade_list:
         status = str(tr.get('status'))
         if status not in ['7', '8']: continue
+        ACCOUNT.invalidate(convert_symbol_to_standard(tr.get('stock_code', '')))
         
         bid = str(tr.get('business_id', ''))
         
@@ -1312,19 +2364,22 @@ def on_trade_response(context, trade_list):
         # [v3.12.0] 多空物理隔离：如果是宏观止盈单，不走网格对冲逻辑
         # ==========================================
         is_macro_sell = entrust_no in state.get('_macro_sell_ids', [])
+        emit_event('fill', sym, side='buy' if fill_amount > 0 else 'sell', qty=abs(fill_amount), price=price,
+                   entrust_no=entrust_no, business_id=bid, status=status, macro=is_macro_sell)
         
         if not is_macro_sell:
             process_trade_logic(context, sym, price, fill_amount)
         else:
-            info('📦 [{}] 宏观止盈大单斩获成交! (ID:{}, 股数:{})，跳过底层网格堆栈记录。', dsym(context, sym), entrust_no[-6:], abs(fill_amount))
+            info('📦 [{}] 宏观止盈大单斩获成交! (ID:{}, 股数:{})，跳过底层网格堆栈记录。', dsym(context, sym), entrust_no[-6:], abs(fill_amount), flush=True)
 
         if '_fill_tracker' not in state: state['_fill_tracker'] = {}
         if entrust_no:
             state['_fill_tracker'][entrust_no] = state['_fill_tracker'].get(entrust_no, 0.0) + abs(fill_amount)
+        fill_keys = ()
         
         if not is_macro_sell:
             info('✅ [{}] 成交回报! 方向: {}, 数量: {}, 价格: {:.3f} (ID:{}, Sts:{})', 
-                 dsym(context, sym), trade_dir, abs(fill_amount), price, bid[-6:] if bid else 'N/A', status)
+                 dsym(context, sym), trade_dir, abs(fill_amount), price, bid[-6:] if bid else 'N/A', status, flush=True)
 
         is_fully_filled = (status == '8')
 
@@ -1337,12 +2392,13 @@ def on_trade_response(context, trade_list):
                 state['_last_fill_dt'] = context.current_dt
                 state['last_fill_price'] = price
                 state['base_price'] = price
+                fill_keys = ('base_price',)
 
             cancelled_ids = cancel_all_orders_by_symbol(context, sym)
             if cancelled_ids: state['_pending_ignore_ids'] = list(cancelled_ids)
 
             delay_s = StrategyConfig.DEBUG.DELAY_AFTER_CANCEL
-            state['_rehang_due_ts'] = datetime.now() + timedelta(seconds=max(delay_s, 2.0))
+            state['_rehang_due_ts'] = CLOCK.now() + timedelta(seconds=max(delay_s, 2.0))
             
             context.mark_halted[sym] = False
             context.last_valid_price[sym] = price
@@ -1359,7 +2415,10 @@ def on_trade_response(context, trade_list):
         try: state['_last_pos_seen'] = get_position(sym).amount
         except: state['_last_pos_seen'] = None
             
-        safe_save_state(sym, state)
+        # 成交记一条预写日志并 fsync，快照按常规节奏合并落盘
+        journal_state(sym, state, fill_keys,
+                      ft={entrust_no: state['_fill_tracker'][entrust_no]} if entrust_no else None,
+                      fid=[entrust_no] if (is_fully_filled and entrust_no) else None, durable=True)
 
 def process_trade_logic(context, symbol, fill_price, fill_amount):
     """
@@ -1384,14 +2443,8 @@ def process_trade_logic(context, symbol, fill_price, fill_amount):
             
         # 2. 取出对手单 (Peek)
         # SellStack存的是(-price, unit), BuyStack存的是(price, unit)
-        if is_buy:
-            top_record = target_stack[0] # peek
-            stack_price = -top_record[0] # 还原正数
-            stack_qty = top_record[1]
-        else:
-            top_record = target_stack[0] # peek
-            stack_price = top_record[0]
-            stack_qty = top_record[1]
+        top_value, stack_qty = target_stack.top()
+        stack_price = -top_value if is_buy else top_value # 还原正数
             
         # 3. 计算配对利润 (Pnl Check)
         trade_pnl = (stack_price - fill_price) if is_buy else (fill_price - stack_price)
@@ -1411,15 +2464,8 @@ def process_trade_logic(context, symbol, fill_price, fill_amount):
              dsym(context, symbol), "买入平空" if is_buy else "卖出平多", 
              fill_price, match_qty, stack_price, pnl_realized)
              
-        # 更新堆栈
-        heapq.heappop(target_stack) # 先弹出
-        if stack_qty > match_qty:
-            # 没吃完，把剩下的放回去
-            left_qty = stack_qty - match_qty
-            if is_buy:
-                heapq.heappush(target_stack, (-stack_price, left_qty))
-            else:
-                heapq.heappush(target_stack, (stack_price, left_qty))
+        # 更新堆栈 (没吃完的余量留在原价位)
+        target_stack.consume_top(match_qty)
         
         remaining_qty -= match_qty
         
@@ -1432,18 +2478,15 @@ def process_trade_logic(context, symbol, fill_price, fill_amount):
         # 入库前查重 (避免同价位堆积)
         check_val = fill_price if is_buy else -fill_price
         
-        if not any(abs(item[0] - check_val) < 1e-5 for item in my_stack):
-            heapq.heappush(my_stack, (check_val, remaining_qty))
+        merged_qty = my_stack.push(check_val, remaining_qty)
+        if merged_qty is None:
             info('[{}] 📥 [新单入库] {} Qty:{} @ {:.3f}', 
                  dsym(context, symbol), "买入开多" if is_buy else "卖出开空", remaining_qty, fill_price)
         else:
-             for i, item in enumerate(my_stack):
-                 if abs(item[0] - check_val) < 1e-5:
-                     my_stack[i] = (item[0], item[1] + remaining_qty)
-                     heapq.heapify(my_stack) # 重新堆化
-                     info('[{}] ➕ [加仓合并] {} Qty:{} 合并入 {:.3f}', 
-                          dsym(context, symbol), "买入" if is_buy else "卖出", remaining_qty, fill_price)
-                     break
+            info('[{}] ➕ [加仓合并] {} Qty:{} 合并入 {:.3f}', 
+                 dsym(context, symbol), "买入" if is_buy else "卖出", remaining_qty, fill_price)
+            emit_event('merge', symbol, kind='same_price', stack='buy' if is_buy else 'sell',
+                       price=fill_price, qty=merged_qty)
 
         # -----------------------------------------------------------
         # [v3.10.0] 容量裁剪防死锁 (Stack Size Limit Merging)
@@ -1453,37 +2496,33 @@ def process_trade_logic(context, symbol, fill_price, fill_amount):
         while len(my_stack) > max_size:
             if is_buy:
                 # 处理 buy_stack: 找出实际价格最高的两个多单融合
-                sorted_buys = sorted(my_stack, key=lambda x: x[0], reverse=True)
-                o1, o2 = sorted_buys[0], sorted_buys[1]
-                my_stack.remove(o1)
-                my_stack.remove(o2)
+                o1, o2 = my_stack.pop_far(), my_stack.pop_far()
                 
                 p1, v1 = o1[0], o1[1]
                 p2, v2 = o2[0], o2[1]
                 p_merge = round((p1 * v1 + p2 * v2) / (v1 + v2), 3)
                 v_merge = v1 + v2
                 
-                heapq.heappush(my_stack, (p_merge, v_merge))
+                my_stack.push(p_merge, v_merge)
                 info('[{}] 📦 容量裁剪(多头超载): 极高套牢单 {:.3f}({}股) 与 {:.3f}({}股) 融合为: {:.3f}({}股)', 
                      dsym(context, symbol), p1, v1, p2, v2, p_merge, v_merge)
+                emit_event('merge', symbol, kind='capacity', stack='buy', p1=p1, v1=v1, p2=p2, v2=v2, price=p_merge, qty=v_merge)
             else:
                 # 处理 sell_stack: 找出实际价格最低的两个空单融合 (存的是-price)
-                sorted_sells = sorted(my_stack, key=lambda x: x[0], reverse=True)
-                o1, o2 = sorted_sells[0], sorted_sells[1]
-                my_stack.remove(o1)
-                my_stack.remove(o2)
+                o1, o2 = my_stack.pop_far(), my_stack.pop_far()
                 
                 p1, v1 = -o1[0], o1[1]
                 p2, v2 = -o2[0], o2[1]
                 p_merge = round((p1 * v1 + p2 * v2) / (v1 + v2), 3)
                 v_merge = v1 + v2
                 
-                heapq.heappush(my_stack, (-p_merge, v_merge))
+                my_stack.push(-p_merge, v_merge)
                 info('[{}] 📦 容量裁剪(空头超载): 极低卖飞单 {:.3f}({}股) 与 {:.3f}({}股) 融合为: {:.3f}({}股)', 
                      dsym(context, symbol), p1, v1, p2, v2, p_merge, v_merge)
-                     
-        # 裁剪操作打乱了原本底层数组的顺序，必须重新堆化
-        heapq.heapify(my_stack)
+                emit_event('merge', symbol, kind='capacity', stack='sell', p1=p1, v1=v1, p2=p2, v2=v2, price=p_merge, qty=v_merge)
+
+    # 堆栈与已实现盈亏先进预写日志 (由调用方的成交记录统一 fsync)
+    journal_state(symbol, state, ('buy_stack', 'sell_stack', 'history_pnl'))
 
 def on_order_filled(context, symbol, order):
     """
@@ -1509,26 +2548,26 @@ def on_order_filled(context, symbol, order):
     process_trade_logic(context, symbol, order.price, real_amount)
     
 def _fill_recover_watch(context, symbol, state):
+    """掉单/持仓跳变补偿；观察窗口判定改动需同步 _screen_timers。"""
     now_dt = context.current_dt
     in_window = False
     if _in_reopen_window(now_dt.time()): in_window = True
-    if state.get('_after_cancel_until') and now_dt <= state['_after_cancel_until']: in_window = True
-    if state.get('_recover_until') and now_dt <= state['_recover_until']: in_window = True
+    if state._after_cancel_until and now_dt <= state._after_cancel_until: in_window = True
+    if state._recover_until and now_dt <= state._recover_until: in_window = True
 
     if not in_window:
-        if state.get('_last_pos_seen') is None:
-            try: state['_last_pos_seen'] = get_position(symbol).amount
+        if state._last_pos_seen is None:
+            try: state._last_pos_seen = ACCOUNT.position(symbol).amount
             except Exception: pass
-        if state.get('_oo_drop_seen_ts') or state.get('_pos_jump_seen_ts'):
-             state['_oo_drop_seen_ts'] = None
-             state['_pos_jump_seen_ts'] = None
-             state['_pos_confirm_deadline'] = None
+        if state._oo_drop_seen_ts or state._pos_jump_seen_ts:
+             state._oo_drop_seen_ts = None
+             state._pos_jump_seen_ts = None
+             state._pos_confirm_deadline = None
         return
 
     try:
-        oo = [o for o in (get_open_orders(symbol) or []) if OrderUtils.is_active(OrderUtils.normalize(o))]
-        oo_n = len(oo)
-        pos_now = get_position(symbol).amount
+        oo_n = sum(1 for o_info in ACCOUNT.open_orders(symbol) if OrderUtils.is_active(o_info))
+        pos_now = ACCOUNT.position(symbol).amount
     except Exception as e:
         return
 
@@ -1578,18 +2617,18 @@ def _fill_recover_watch(context, symbol, state):
         key = _make_fill_key(symbol, amount, price, now_dt)
         if not _is_dup_fill(context, key):
             _remember_fill(context, key)
-            synth = SimpleNamespace(order_id=f"SYN-{int(time.time())}", amount=amount, filled=abs(amount), price=price)
+            synth = SimpleNamespace(order_id=f"SYN-{int(CLOCK.now().timestamp())}", amount=amount, filled=abs(amount), price=price)
             try:
                 on_order_filled(context, symbol, synth)
             except Exception as e:
-                info('[{}] ❌ FILL-RECOVER 调用 on_order_filled 失败: {}', dsym(context, symbol), e)
+                info('[{}] ❌ FILL-RECOVER 调用 on_order_filled 失败: {}', dsym(context, symbol), e, flush=True)
 
     state['_oo_drop_seen_ts'] = None
     state['_pos_jump_seen_ts'] = None
     state['_pos_confirm_deadline'] = None
     state['_oo_last'] = oo_n
     state['_last_pos_seen'] = pos_now
-    safe_save_state(symbol, state)
+    safe_save_state(symbol, state, sync=True)
 
 # ---------------- 主动巡检与修正 ----------------
 
@@ -1613,6 +2652,7 @@ def patrol_and_correct_orders(context, symbol, state):
                 
                 if eid not in tracker:
                     tracker[eid] = float(filled_qty)
+                    journal_state(symbol, state, ft={eid: tracker[eid]})
                     continue
                     
                 processed_qty = tracker[eid]
@@ -1624,6 +2664,8 @@ def patrol_and_correct_orders(context, symbol, state):
                     real_amount = delta * direction
                     
                     info('🕵️ [{}] [补录] 发现漏单! 漏:{} (总成:{} vs 已记:{})', dsym(context, symbol), delta, filled_qty, processed_qty)
+                    emit_event('fill', symbol, side='buy' if direction > 0 else 'sell', qty=delta, price=trade_price,
+                               entrust_no=eid, source='patrol', macro=eid in state.get('_macro_sell_ids', []))
                     
                     # [V3.12.0] 如果是宏观止盈单，漏单补录也不入网格账本
                     if eid in state.get('_macro_sell_ids', []):
@@ -1633,6 +2675,7 @@ def patrol_and_correct_orders(context, symbol, state):
                     
                     tracker[eid] = float(filled_qty)
                     state['history_pnl'] = state.get('history_pnl', 0.0) 
+                    journal_state(symbol, state, ft={eid: tracker[eid]}, durable=True)
                     
             state['_fill_tracker'] = tracker
         except Exception as e:
@@ -1644,36 +2687,29 @@ def patrol_and_correct_orders(context, symbol, state):
     if not is_valid_price(context.latest_data.get(symbol)): return 
 
     try:
-        position = get_position(symbol)
+        position = ACCOUNT.position(symbol)
         pos = position.amount 
         enable_amount = position.enable_amount
-        open_orders = [o for o in (get_open_orders(symbol) or []) if OrderUtils.is_active(OrderUtils.normalize(o))]
+        open_orders = [o_info['original'] for o_info in ACCOUNT.open_orders(symbol) if OrderUtils.is_active(o_info)]
 
         base_pos = state['base_position']
         max_pos = state['max_position']
         unit = state['grid_unit']
-        base_price = state['base_price']
-        buy_sp, sell_sp = state['buy_grid_spacing'], state['sell_grid_spacing']
-        buy_p = round(base_price * (1 - buy_sp), 3)
-        sell_p = round(base_price * (1 + sell_sp), 3)
-        
         # 🌟 V3.13.9.2：VA 建仓特权动态锚定“浅水区”边界 (取代硬编码的 5)
         max_grids = state.get('max_grid_count', 12)
         thresh_low = max(1, max_grids // 3)
         bypass_buy_block = (pos < base_pos + thresh_low * unit)
-        buy_p, sell_p = _apply_price_guard(context, state, buy_p, sell_p, buy_sp, sell_sp, bypass_buy_block)
-
-        up_limit = state.get('_up_limit')
-        down_limit = state.get('_down_limit')
+        buy_t, sell_t = _guard_ticks(context, state, bypass_buy_block)
+        q = grid_quote(state)
         
         should_have_buy_order = (pos + unit <= max_pos)
-        if is_valid_price(down_limit) and buy_p < down_limit:
+        if q.down is not None and buy_t < q.down:
             should_have_buy_order = False 
 
         pending_frozen = context.pending_frozen.get(symbol, 0)
         real_enable = enable_amount - pending_frozen
         should_have_sell_order = (real_enable >= unit and pos - unit >= base_pos)
-        if is_valid_price(up_limit) and sell_p > up_limit:
+        if q.up is not None and sell_t > q.up:
             should_have_sell_order = False 
 
         orders_to_cancel = []
@@ -1683,20 +2719,20 @@ def patrol_and_correct_orders(context, symbol, state):
         for o in open_orders:
             order_info = OrderUtils.normalize(o)
             entrust_no = order_info['entrust_no']
-            o_price = order_info['price']
             if not entrust_no: continue
+            o_t = to_ticks(order_info['price'] or 0)
             
             is_wrong = False
             if not OrderUtils.is_sell(order_info): 
                 if not should_have_buy_order: is_wrong = True 
-                elif abs(o_price - buy_p) / (buy_p + 1e-9) >= 0.002: is_wrong = True 
+                elif abs(o_t - buy_t) * 500 >= buy_t: is_wrong = True     # 偏离 >= 0.2%
                 else: valid_buy_orders.append(o)
             else: 
                 # [V3.12.0] 宏观大单不属于被巡检撤销的范围，直接无视
                 if entrust_no in state.get('_macro_sell_ids', []): continue
                 
                 if not should_have_sell_order: is_wrong = True 
-                elif abs(o_price - sell_p) / (sell_p + 1e-9) >= 0.002: is_wrong = True 
+                elif abs(o_t - sell_t) * 500 >= sell_t: is_wrong = True 
                 else: valid_sell_orders.append(o)
             
             if is_wrong: orders_to_cancel.append(o)
@@ -1715,7 +2751,7 @@ def patrol_and_correct_orders(context, symbol, state):
 
         if orders_to_cancel:
             info('[{}] 🛡️ PATROL: 发现 {} 笔错误/重复挂单，正在撤销...', dsym(context, symbol), len(orders_to_cancel))
-            state['_ignore_place_until'] = datetime.now() + timedelta(seconds=10)
+            state['_ignore_place_until'] = CLOCK.now() + timedelta(seconds=10)
             safe_save_state(symbol, state)
             
             if not hasattr(context, 'canceled_cache'):
@@ -1731,6 +2767,7 @@ def patrol_and_correct_orders(context, symbol, state):
                     raw_sym = order_info['raw_symbol']
                     if entrust_no and raw_sym:
                         cancel_order_ex({'entrust_no': entrust_no, 'symbol': raw_sym})
+                        ACCOUNT.invalidate(symbol)
                         cancelled_ids.add(entrust_no)
                         context.canceled_cache['orders'].add(entrust_no)
                 except Exception as e:
@@ -1738,6 +2775,7 @@ def patrol_and_correct_orders(context, symbol, state):
             
             state.pop('_last_order_ts', None)
             state.pop('_last_order_bp', None)
+            emit_event('patrol_cancel', symbol, found=len(orders_to_cancel), cancelled=sorted(cancelled_ids))
             place_limit_orders(context, symbol, state, ignore_cooldown=True, bypass_lock=True, ignore_entrust_nos=cancelled_ids)
             return 
 
@@ -1754,36 +2792,47 @@ def _check_macro_take_profit(context, symbol, state, price, dt):
     """
     [Global Ver: v3.13.11] [Func Ver: 4.2]
     [Change]: 修复连续止盈导致的滴灌池资金被覆盖遗忘的漏洞，引入资金滚存机制。
+    门槛/升档/回撤条件改动需同步 PortfolioBook.screen 的止盈掩码与 PortfolioBook.sync 的档位线。
     """
     try:
-        pos = get_position(symbol)
+        pos = ACCOUNT.position(symbol)
         if pos.amount == 0 or pos.cost_basis <= 0: return
         config = getattr(context, 'symbol_config', {}).get(symbol, {})
         tp_cool_weeks, min_weeks, min_val = config.get('tp_cool_weeks', 4), config.get('tp_min_weeks', 12), config.get('tp_min_value', 30000)
 
-        if len(state.get('trade_week_set', set())) < tp_cool_weeks: return
-        if len(state.get('trade_week_set', set())) < min_weeks or (pos.amount * price) < min_val: return
+        weeks = len(state.trade_week_set)
+        if weeks < tp_cool_weeks: return
+        if weeks < min_weeks or (pos.amount * price) < min_val: return
 
         atr = calculate_macro_atr(context, symbol, atr_period=60) or 0.02
-        state['macro_atr_rate'] = atr  
+        state.macro_atr_rate = atr  
+        lv = MACRO_TP_LEVELS.get(symbol)
+        if lv is None or lv[0] != atr:
+            # 三档触发线 10/20/30 倍 ATR、回撤线 3/5/8 倍 ATR：ATR 一天最多变一次，预先算好
+            lv = MACRO_TP_LEVELS[symbol] = (atr, (10.0*atr, 20.0*atr, 30.0*atr), (3.0*atr, 5.0*atr, 8.0*atr))
+        _, (up1, up2, up3), drops = lv
         profit_ratio = (price - pos.cost_basis) / pos.cost_basis
-        hwm = max(state.get('_tp_hwm_ratio', 0.0), profit_ratio)
-        state['_tp_hwm_ratio'] = hwm
+        hwm = max(state._tp_hwm_ratio, profit_ratio)
+        if hwm != state._tp_hwm_ratio:
+            state._tp_hwm_ratio = hwm
+            safe_save_state(symbol, state)
 
         tier = 0
-        for t, thresh in {3: 30.0*atr, 2: 20.0*atr, 1: 10.0*atr}.items():
-            if profit_ratio >= thresh: 
-                tier = max(state.get('_tp_tier', 0), t); break
-        if tier > state.get('_tp_tier', 0):
-            state['_tp_tier'] = tier
+        if profit_ratio >= up1:
+            t = 3 if profit_ratio >= up3 else (2 if profit_ratio >= up2 else 1)
+            tier = max(state._tp_tier, t)
+        if tier > state._tp_tier:
+            state._tp_tier = tier
             info('[{}] 🚀 宏观止盈警报升级: Tier {}', dsym(context, symbol), tier)
+            emit_event('macro_tp', symbol, action='tier', tier=tier, profit=profit_ratio, atr=atr)
+            safe_save_state(symbol, state, sync=True)
 
-        if tier > 0 and (hwm - profit_ratio) >= {1: 3.0*atr, 2: 5.0*atr, 3: 8.0*atr}.get(tier, 0.05):
+        if tier > 0 and (hwm - profit_ratio) >= drops[min(tier, 3) - 1]:
             sell_ratio = {1: 0.33, 2: 0.50, 3: 1.0}.get(tier, 0.33)
             sell_amount = pos.amount if tier == 3 else math.floor(pos.amount * sell_ratio / 100) * 100
             
             if sell_amount > 0:
-                eid = order(symbol, -sell_amount, price)
+                eid = _place_order(context, symbol, -sell_amount, price)
                 if eid:
                     state.setdefault('_macro_sell_ids', []).append(str(eid))
                     total_cash = sell_amount * price
@@ -1818,32 +2867,247 @@ def _check_macro_take_profit(context, symbol, state, price, dt):
                     state['_tp_hwm_ratio'], state['_tp_tier'] = 0.0, 0
                     
                     info('[{}] ♻️ 止盈重置成功：锁定新底仓 {} 股，新增及滚存现金共 {:.2f} 元，将分 {} 周平滑滴灌。', dsym(context, symbol), new_base, total_drip_pool, drip_weeks)
-                    safe_save_state(symbol, state)
+                    emit_event('macro_tp', symbol, action='reset', tier=tier, entrust_no=str(eid), sell_qty=sell_amount,
+                               new_base=new_base, drip_pool=round(total_drip_pool, 2), drip_weeks=drip_weeks)
+                    safe_save_state(symbol, state, sync=True)
                     
     except Exception as e:
         log.error(f"[{symbol}] 宏观止盈引擎执行异常: {e}")
                     
 
+# ---------------- 组合数组 (向量化筛选) ----------------
+
+class PortfolioBook:
+    """
+    【组合数组】逐标的数值字段按槽位存成 NumPy 数组 (struct of arrays)：最新价、最近有效行情时间、基准价、
+    网格单位、底仓/上限、止盈高水位，以及每个标的上次走完逐标的流程后推算出的各项触发线。
+    盘中连续竞价时段 handle_data 先用一次向量化运算得出停牌翻转、棘轮触发、VA 盈余/缺口、止盈升档/回撤与
+    “需重新报价” 掩码，只有被标记的标的进入 Python 流程；其余标的本 tick 的止盈/VA/挂单/补偿流程必然无副作用。
+    触发线全部取宽松方向：只可能多放行，不会漏掉；成交、报撤单、状态变更、配置重载都会把标的标脏 (touch)。
+    """
+    def __init__(self, context):
+        self.context = context
+        self.symbol_list = list(context.symbol_list)
+        self.state = context.state
+        self.syms = [s for s in self.symbol_list if s in context.state]
+        self.slot = {s: i for i, s in enumerate(self.syms)}
+        self.day = None
+        n = len(self.syms)
+        nan = lambda: np.full(n, np.nan)
+        self.price, self.last_ts, self.halted = nan(), nan(), np.zeros(n, dtype=bool)
+        # 状态镜像 (逐标的流程走完后同步)
+        self.base_price, self.grid_unit, self.base_pos, self.max_pos, self.tp_hwm = nan(), nan(), nan(), nan(), nan()
+        self.mirror = [None] * n
+        # 触发线：理论买卖价 (整数价位)、VA 释放/加仓所需量、止盈档位线
+        self.buy_t, self.sell_t = nan(), nan()
+        self.va_target, self.va_floor, self.va_lwp, self.va_min_base = nan(), nan(), nan(), nan()
+        self.tp_on, self.tp_ready = np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)
+        self.tp_min_val, self.tp_up1, self.tp_next, self.tp_drop = nan(), nan(), nan(), nan()
+        # 上个 tick 的挂单快照：笔数/卖单冻结量一变 (含成交回报丢失、柜台撤单) 就要重走挂单流程
+        self.oo_n, self.oo_frozen = nan(), nan()
+        # 需重新报价：dirty 外部事件标脏，loud 每 tick 都要进 Python，wake 冷却/计时到期时间 (epoch 秒)
+        self.dirty = np.ones(n, dtype=bool)
+        self.loud = np.zeros(n, dtype=bool)
+        self.wake = np.full(n, np.inf)
+        for i in range(n): self._refresh(i)
+
+    def matches(self, context):
+        return self.context is context and self.state is context.state and self.symbol_list == context.symbol_list
+
+    def _refresh(self, i):
+        """从 context 的行情/停牌字典重读该槽位 (成交回报等路径会绕开行情快照直接改写它们)。"""
+        ctx, sym = self.context, self.syms[i]
+        px, ts = ctx.latest_data.get(sym), ctx.last_valid_ts.get(sym)
+        self.price[i] = float(px) if is_valid_price(px) else np.nan
+        self.last_ts[i] = ts.timestamp() if ts is not None else np.nan
+        self.halted[i] = bool(ctx.mark_halted.get(sym, False))
+
+    def touch(self, symbol=None):
+        if symbol is None:
+            for i in range(len(self.syms)): self._refresh(i)
+            self.dirty[:] = True
+            return
+        i = self.slot.get(symbol)
+        if i is not None:
+            self._refresh(i)
+            self.dirty[i] = True
+
+    def quote(self, symbol, px, ts):
+        i = self.slot.get(symbol)
+        if i is not None:
+            self.price[i] = px
+            self.last_ts[i] = ts
+
+    def detect_halts(self, now_ts, phase_ts, grace):
+        """向量化停牌判定：返回本 tick 停牌标记发生翻转的槽位，以及其中由停牌恢复的槽位。"""
+        lt = self.last_ts
+        stale = np.isnan(lt) | (lt < phase_ts)
+        with np.errstate(invalid='ignore'):
+            now_halted = np.where(stale, now_ts >= phase_ts + grace, (now_ts - lt) > grace)
+        flipped = np.flatnonzero(now_halted != self.halted)
+        recovered = flipped[self.halted[flipped]]
+        self.halted = now_halted
+        self.dirty[flipped] = True
+        return flipped, recovered
+
+    def screen(self, now_ts, amount, cost, n_open, frozen):
+        """
+        一次向量化运算返回本 tick 需要进 Python 的槽位。amount / cost 为当前持仓数量与成本价，n_open / frozen 为活跃挂单笔数与卖单冻结量。
+        各掩码与逐标的函数的触发条件逐项对应 (同样的浮点运算)，价位比较多留 1.5 个价位的余量。
+        脏标记在此清零：本 tick 处理期间再被 touch 的标的下个 tick 继续进 Python，直到状态不再变化。
+        """
+        price, bp, unit = self.price, self.base_pos, self.grid_unit
+        with np.errstate(invalid='ignore', divide='ignore'):
+            requote = (self.dirty | self.loud | (now_ts >= self.wake) | np.isnan(price)
+                       | (n_open != self.oo_n) | (frozen != self.oo_frozen))
+            self.oo_n, self.oo_frozen = n_open, frozen
+            self.dirty[:] = False
+            # 影子棘轮：触及理论卖价且仓位在浅水区 / 触及理论买价且仓位贴近上限 (基准 ±10% 内才生效)
+            pt = price * PRICE_TICKS
+            near = _in_ratchet_band(price, self.base_price)
+            ratchet = near & (((pt + 1.5 >= self.sell_t) & (amount - unit <= bp)) |
+                              ((pt - 1.5 <= self.buy_t) & (amount + unit >= self.max_pos)))
+            # VA：盈余释放 / 缺口加仓 (与 get_target_base_position 同式)
+            surplus = _va_release_due(bp, price, self.va_target, unit, self.va_floor)
+            delta = self.va_target - self.va_lwp * price
+            new_pos = self.va_lwp + np.ceil(delta / price / 100) * 100
+            deficit = (delta > 0) & (np.round(np.maximum(self.va_min_base, new_pos) / 100) * 100 > bp)
+            # 宏观止盈：门槛内首次生效 / 刷新高水位 / 升档 / 回撤卖出
+            gate = self.tp_on & (amount != 0) & (cost > 0) & (amount * price >= self.tp_min_val)
+            ratio = (price - cost) / cost
+            hwm = self.tp_hwm
+            tier = gate & (~self.tp_ready | (ratio > hwm) |
+                           ((ratio >= self.tp_up1) & ((ratio >= self.tp_next) | (hwm - ratio >= self.tp_drop))))
+        return np.flatnonzero(requote | ratchet | surplus | deficit | tier)
+
+    def sync(self, context, symbol, state, now_dt):
+        """该标的刚走完逐标的流程：镜像状态字段并重算触发线。"""
+        i = self.slot.get(symbol)
+        if i is None: return
+        st = state
+        self._refresh(i)
+        # 本 tick 改动了基准/底仓/网格单位等输入 (如棘轮、VA 加仓)，下个 tick 再走一遍直到不动点 (adjust_grid_unit 等要跟上)
+        mirror = (st.base_price, st.buy_grid_spacing, st.sell_grid_spacing, st.grid_unit, st.base_position, st.max_position,
+                  st.max_grid_count, st.last_week_position, st.initial_position_value, st._tp_hwm_ratio, st._tp_tier)
+        if mirror != self.mirror[i]: self.dirty[i] = True
+        self.mirror[i] = mirror
+        self.base_price[i], self.grid_unit[i], self.tp_hwm[i] = st.base_price, st.grid_unit, st._tp_hwm_ratio
+        self.base_pos[i], self.max_pos[i] = st.base_position, st.max_position
+        try:
+            q = grid_quote(st)
+            self.buy_t[i], self.sell_t[i] = q.theo_buy, q.theo_sell
+            self.loud[i], self.wake[i] = _screen_timers(context, symbol, st, q, now_dt)
+
+            weeks = len(st.trade_week_set)
+            self.va_target[i] = va_target_value(st, weeks)
+            self.va_floor[i] = st.initial_base_position * 0.5
+            self.va_lwp[i] = st.last_week_position
+            self.va_min_base[i] = round(st.initial_position_value / st.base_price / 100) * 100
+
+            config = getattr(context, 'symbol_config', {}).get(symbol, {})
+            self.tp_on[i] = weeks >= config.get('tp_cool_weeks', 4) and weeks >= config.get('tp_min_weeks', 12)
+            self.tp_min_val[i] = config.get('tp_min_value', 30000)
+            pos, price = ACCOUNT.position(symbol), context.latest_data.get(symbol)
+            lv = MACRO_TP_LEVELS.get(symbol)
+            # 本轮止盈已在门槛内跑过 (ATR 已按当日刷新、档位线与之匹配) 才能信任缓存的档位线
+            self.tp_ready[i] = bool(self.tp_on[i] and lv is not None and lv[0] == st.macro_atr_rate
+                                    and pos.amount != 0 and pos.cost_basis > 0 and pos.amount * price >= self.tp_min_val[i])
+            if lv is not None:
+                _, ups, drops = lv
+                tier = st._tp_tier
+                self.tp_up1[i] = ups[0]
+                self.tp_next[i] = ups[tier] if tier < 3 else np.inf
+                self.tp_drop[i] = drops[min(tier, 3) - 1] if tier > 0 else np.inf
+        except Exception:
+            self.loud[i] = True     # 推算不了触发线就每 tick 老实走 Python
+
+def _screen_timers(context, symbol, state, q, now_dt):
+    """
+    按 place_limit_orders / _fill_recover_watch 的闸门顺序推算：返回 (loud, wake)。
+    loud = 每 tick 都会产生日志/事件/状态变更 (停牌、守门员修正、涨跌停封锁、破锁待融合、掉单观察窗口)；
+    wake = 冷却到期后才可能挂单的时刻 (epoch 秒)，无冷却为 inf。
+    """
+    st = state
+    for until in (st._after_cancel_until, st._recover_until):
+        if until and now_dt <= until: return True, np.inf
+    if st._last_pos_seen is None or st._oo_drop_seen_ts or st._pos_jump_seen_ts: return True, np.inf
+    if context.mark_halted.get(symbol, False): return True, np.inf
+
+    if st._ignore_place_until and CLOCK.now() < st._ignore_place_until: return True, np.inf
+    if st._rehang_due_ts is not None: return False, np.inf          # 等补单状态机接手 (届时会标脏)
+    if st._last_trade_ts and (now_dt - st._last_trade_ts).total_seconds() < TRADE_COOLDOWN_SEC:
+        return False, (st._last_trade_ts + timedelta(seconds=TRADE_COOLDOWN_SEC)).timestamp()
+
+    if q.theo_buy <= 0 or q.theo_sell <= 0: return False, np.inf
+    if q.buy_fix is not None or q.sell_fix is not None: return True, np.inf
+    if q.up is not None and q.down is not None and (q.theo_buy < q.down or q.theo_sell > q.up): return True, np.inf
+    raw, used = _cached_grid_atr(context, symbol, 14), st.grid_atr_rate
+    atr = raw if raw is not None and raw > 0 and (used is None or abs(raw - used) / used > 0.10) else used
+    if atr is None or math.isnan(atr) or atr <= 0: atr = 0.02
+    if (q.theo_sell - q.theo_buy) / q.theo_buy > StrategyConfig.MARKET.UNLOCK_ATR_MULTIPLIER * atr: return True, np.inf
+
+    last_ts = st.get('_last_order_ts')
+    if last_ts and (now_dt - last_ts).seconds < ORDER_COOLDOWN_SEC:
+        return False, (last_ts + timedelta(seconds=ORDER_COOLDOWN_SEC)).timestamp()
+    last_bp = st.get('_last_order_bp')
+    if last_bp and abs(st.base_price / last_bp - 1) < st.buy_grid_spacing / 2: return False, np.inf
+    return True, np.inf
+
+def _portfolio_book(context):
+    """取 (必要时重建) 组合数组：标的列表或状态表被替换时整体重建，所有标的先走一遍 Python。"""
+    global BOOK
+    if BOOK is None or not BOOK.matches(context):
+        BOOK = PortfolioBook(context)
+    return BOOK
+
+def book_touch(symbol=None):
+    """外部事件 (成交、报撤单、状态变更、配置重载) 让该标的 (None = 全部) 的触发线失效，下个 tick 必进 Python。"""
+    if BOOK is not None: BOOK.touch(symbol)
+
 # ---------------- 行情主循环 ----------------
 
 def handle_data(context, data):
+    """
+    本 tick 内持仓/挂单统一走 ACCOUNT 视图 (每类至多一次柜台往返)，tick 结束即失效；
+    整个 tick 与各阶段耗时计入 PERF 运行监控。
+    """
+    today_str = context.current_dt.strftime('%Y-%m-%d')
+    if PERF.date != today_str: PERF.reset(today_str)
+    ACCOUNT.begin(context.symbol_list)
+    try:
+        with PERF.scope('tick'):
+            _handle_data_tick(context, data)
+    finally:
+        ACCOUNT.end()
+    PERF.end_tick(context)
+
+def _handle_data_tick(context, data):
     """
     [Global Ver: v3.12.11] [Func Ver: 2.1 (Hotfix)]
     [Change]: 修复 _check_macro_take_profit 缺少 dt 参数导致的 TypeError 崩溃。
     """
     now_dt = context.current_dt
     now = now_dt.time()
-    _fetch_quotes_via_snapshot(context)
+    with PERF.scope('quotes'):
+        _fetch_quotes_via_snapshot(context)
     
-    if now_dt.minute % 5 == 0:
+    # 配置热加载仍按 5 分钟 (日内波动指标已随行情快照逐分钟更新)；HUD 面板按 REPORT.DASHBOARD_MIN (行缓存使每分钟刷新足够便宜)
+    every5, dash_due = now_dt.minute % 5 == 0, now_dt.minute % StrategyConfig.REPORT.DASHBOARD_MIN == 0
+    if every5 or dash_due:
         last_update = getattr(context, 'last_report_time', None)
         if last_update is None or last_update.minute != now_dt.minute:
-            try:
-                reload_config_if_changed(context)
-                _calculate_intraday_metrics(context)
-                generate_html_report(context)
-                context.last_report_time = now_dt
-            except Exception: pass
+            with PERF.scope('report'):
+                try:
+                    if every5: reload_config_if_changed(context)
+                    if dash_due: generate_html_report(context)
+                    context.last_report_time = now_dt
+                except Exception: pass
+
+    book = _portfolio_book(context)
+    if book.day != now_dt.date():
+        book.day = now_dt.date()
+        book.touch()
+    now_ts = now_dt.timestamp()
 
     boot_grace = (now_dt - getattr(context, 'boot_dt', now_dt)).total_seconds() < StrategyConfig.BOOT.GRACE_SECONDS
     if not boot_grace:
@@ -1856,81 +3120,136 @@ def handle_data(context, data):
         if phase_start_t:
             phase_start_dt = datetime.combine(now_dt.date(), phase_start_t)
             grace_seconds = 120
-            for sym in context.symbol_list:
-                if sym not in context.state: continue
-                was_halted = context.mark_halted.get(sym, False)
-                last_ts = context.last_valid_ts.get(sym)
-                is_now_halted = False
-                if last_ts is None or last_ts < phase_start_dt:
-                    is_now_halted = (now_dt >= phase_start_dt + timedelta(seconds=grace_seconds))
-                else:
-                    is_now_halted = ((now_dt - last_ts).total_seconds() > grace_seconds)
-                context.mark_halted[sym] = is_now_halted
-                if was_halted and not is_now_halted:
-                    state = context.state[sym]
-                    recover_window_seconds = 180 
-                    state['_recover_until'] = now_dt + timedelta(seconds=recover_window_seconds)
-
-    for sym in context.symbol_list:
-        if sym not in context.state: continue
-        st = context.state[sym]
-        price = context.latest_data.get(sym)
-        if is_valid_price(price):
-            # [V3.12.11 热修复]: 补齐 now_dt 参数
-            _check_macro_take_profit(context, sym, st, price, now_dt)
-            
-            get_target_base_position(context, sym, st, price, now_dt)
-            adjust_grid_unit(st)
-            if now_dt.minute % 30 == 0 and now_dt.second < 5:
-                update_grid_spacing_final(context, sym, st, get_position(sym).amount)
+            # 停牌判定整组向量化，只有标记翻转的标的回写字典；由停牌恢复的进入 180s 观察窗口
+            flipped, recovered = book.detect_halts(now_ts, phase_start_dt.timestamp(), grace_seconds)
+            for j in flipped: context.mark_halted[book.syms[j]] = bool(book.halted[j])
+            for j in recovered:
+                recover_window_seconds = 180
+                context.state[book.syms[j]]['_recover_until'] = now_dt + timedelta(seconds=recover_window_seconds)
 
     is_patrol_time = (now_dt.minute % 30 == 0 and now_dt.second < 5)
-    if not is_patrol_time and (is_auction_time() or (is_main_trading_time() and now < dtime(14, 55))):
-        for sym in context.symbol_list:
-            if sym in context.state:
-                place_limit_orders(context, sym, context.state[sym], ignore_cooldown=False)
+    screen = (StrategyConfig.PERF.SCREEN and not boot_grace and not is_patrol_time and is_main_trading_time()
+              and not is_auction_time() and not is_order_blocking_period() and now < dtime(14, 55)
+              and not _in_reopen_window(now))
+    if screen:
+        # 止盈/VA/棘轮/挂单/补偿全部无事可做的标的本 tick 直接跳过
+        with PERF.scope('screen'):
+            amount, cost = ACCOUNT.position_arrays(book.syms)
+            n_open, frozen = ACCOUNT.open_order_arrays(book.syms)
+            active = [book.syms[j] for j in book.screen(now_ts, amount, cost, n_open, frozen)]
+    else:
+        active = [sym for sym in context.symbol_list if sym in context.state]
+
+    with PERF.scope('macro_va'):
+        for sym in active:
+            st = context.state[sym]
+            price = context.latest_data.get(sym)
+            if is_valid_price(price):
+                with PERF.scope('macro_va', sym):
+                    # [V3.12.11 热修复]: 补齐 now_dt 参数
+                    _check_macro_take_profit(context, sym, st, price, now_dt)
+                    
+                    get_target_base_position(context, sym, st, price, now_dt)
+                    adjust_grid_unit(st)
+                    if now_dt.minute % 30 == 0 and now_dt.second < 5:
+                        update_grid_spacing_final(context, sym, st, ACCOUNT.position(sym).amount)
 
-    for sym in context.symbol_list:
-        st = context.state.get(sym)
-        if not st: continue
-        _fill_recover_watch(context, sym, st)
+    if not is_patrol_time and (is_auction_time() or (is_main_trading_time() and now < dtime(14, 55))):
+        with PERF.scope('place'):
+            for sym in active:
+                with PERF.scope('place', sym):
+                    place_limit_orders(context, sym, context.state[sym], ignore_cooldown=False)
+
+    with PERF.scope('recover'):
+        for sym in active:
+            with PERF.scope('recover', sym):
+                _fill_recover_watch(context, sym, context.state[sym])
+
+    if screen:
+        for sym in active: book.sync(context, sym, context.state[sym], now_dt)
+    else:
+        book.touch()
 
     if is_patrol_time:
-        for sym in context.symbol_list:
-            if sym in context.state:
-                patrol_and_correct_orders(context, sym, context.state[sym])
-                log_status(context, sym, context.state[sym], context.latest_data.get(sym))
+        with PERF.scope('patrol'):
+            for sym in context.symbol_list:
+                if sym in context.state:
+                    with PERF.scope('patrol', sym):
+                        patrol_and_correct_orders(context, sym, context.state[sym])
+                        log_status(context, sym, context.state[sym], context.latest_data.get(sym))
+
+    with PERF.scope('flush'):
+        flush_states()
 
 # ---------------- 日内RV计算 ----------------
 
-def _calculate_intraday_metrics(context):
-    if not is_main_trading_time() and not is_auction_time(): return
-    metrics = {}
-    today_date = context.current_dt.date()
-    for sym in context.symbol_list:
+class IntradayRV:
+    """
+    【日内波动累加器】与原 1 分钟 K 线口径一致：每分钟最后一个价视作该分钟收盘，
+    rv = Σ|ln(收盘_t / 收盘_t-1)|，daily_return 以当日首个分钟收盘为开盘价；当前分钟按最新价计入 (同 include=True)。
+    每次推进 O(1)，不再拉分钟线。
+    """
+    __slots__ = ('day', 'open', 'prev', 'cur', 'minute', 'rv')
+
+    def __init__(self, day):
+        self.day = day
+        self.open = self.prev = self.cur = self.minute = None
+        self.rv = 0.0           # 已收盘分钟的对数收益绝对值之和
+
+    def push(self, minute, px):
+        if self.cur is None:
+            self.open = self.cur = px
+            self.minute = minute
+            return
+        if minute != self.minute:
+            if self.prev is not None: self.rv += abs(math.log(self.cur / self.prev))
+            self.prev, self.minute = self.cur, minute
+        self.cur = px
+
+    def metrics(self):
+        rv = self.rv + abs(math.log(self.cur / self.prev))
+        daily_return = (self.cur - self.open) / self.open
+        return {'rv': rv, 'efficiency': rv / max(abs(daily_return), 0.0001), 'daily_return': daily_return}
+
+def _warm_intraday(symbols, day, minute):
+    """
+    一次性预热：盘中重启 (首次见到该标的时已过 09:31) 才批量拉一次当日分钟线回放进累加器；
+    正常开盘从第一根开始累计，不碰历史接口。拉取失败就从当前分钟起算。
+    """
+    accs = {sym: IntradayRV(day) for sym in symbols}
+    if minute.time() > dtime(9, 31):
         try:
-            hist = get_history(250, '1m', ['close'], security_list=[sym], include=True)
-            df = hist.get(sym) if isinstance(hist, dict) else hist
-            if df is None or df.empty: continue
-            today_df = df[df.index.date == today_date].copy()
-            if len(today_df) < 2: continue
-            close_series = today_df['close']
-            log_rets = np.log(close_series / close_series.shift(1))
-            rv = log_rets.abs().sum()
-            open_price = close_series.iloc[0]
-            curr_price = close_series.iloc[-1]
-            daily_return = (curr_price - open_price) / open_price
-            efficiency = rv / max(abs(daily_return), 0.0001)
-            metrics[sym] = {'rv': rv, 'efficiency': efficiency, 'daily_return': daily_return}
-        except Exception: pass
-    context.intraday_metrics = metrics
+            hist = get_history(250, '1m', ['close'], security_list=list(symbols), include=True)
+            for sym, acc in accs.items():
+                df = hist.get(sym) if isinstance(hist, dict) else None
+                if df is None or df.empty: continue
+                for ts, px in zip(df.index, df['close'].to_numpy(dtype=float)):
+                    if ts.date() == day and ts < minute and is_valid_price(px): acc.push(ts, float(px))
+        except Exception as e:
+            debug('日内波动预热失败 (从当前分钟起算): {}', e)
+    INTRADAY_RV.update(accs)
+
+def _update_intraday_metrics(context, fresh):
+    """行情快照取到的 {标的: 价} 逐分钟推进累加器，context.intraday_metrics 每分钟可用。"""
+    if not fresh or not is_main_trading_time(): return
+    now_dt = context.current_dt
+    day, minute = now_dt.date(), now_dt.replace(second=0, microsecond=0)
+    if getattr(context, 'intraday_day', None) != day:
+        context.intraday_metrics, context.intraday_day = {}, day
+    cold = [sym for sym in fresh if sym not in INTRADAY_RV or INTRADAY_RV[sym].day != day]
+    if cold: _warm_intraday(cold, day, minute)
+    metrics = context.intraday_metrics
+    for sym, px in fresh.items():
+        acc = INTRADAY_RV[sym]
+        acc.push(minute, px)
+        if acc.prev is not None: metrics[sym] = acc.metrics()
 
 # ---------------- 监控输出 ----------------
 
 def log_status(context, symbol, state, price):
     disp_price = context.last_valid_price.get(symbol, state['base_price'])
     if not is_valid_price(disp_price): return
-    position = get_position(symbol)
+    position = ACCOUNT.position(symbol)
     pos = position.amount
     pnl = (disp_price - position.cost_basis) * pos if position.cost_basis > 0 else 0
     info("📊 [{}] 状态: 价:{:.3f} 持仓:{}(可卖:{}) / 底仓:{} 成本:{:.3f} 盈亏:{:.2f} 网格:[买{:.2%},卖{:.2%}]",
@@ -1938,27 +3257,130 @@ def log_status(context, symbol, state, price):
 
 # ---------------- 动态网格间距 (双轨波动率引擎 V3.12.5) ----------------
 
+def _grid_atr_raw(symbol, atr_period):
+    """拉取日线并计算网格 ATR/收盘价；数据不足返回 None，接口异常向上抛出 (不写缓存，下次重试)。"""
+    hist = get_history(atr_period + 5, '1d', ['high', 'low', 'close'], security_list=[symbol])
+    df = hist.get(symbol) if isinstance(hist, dict) else hist
+    if df is None or df.empty or len(df) <= 1: return None
+    high, low, close = df['high'], df['low'], df['close']
+    tr1 = high - low
+    tr2 = (high - close.shift(1)).abs()
+    tr3 = (low - close.shift(1)).abs()
+    tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
+    atr_series = tr.ewm(span=atr_period, adjust=False).mean()
+    last_atr_val, last_price = atr_series.iloc[-1], close.iloc[-1]
+    return float(last_atr_val / last_price) if is_valid_price(last_price) else None
+
+def _cached_grid_atr(context, symbol, atr_period):
+    """
+    【日线缓存】日线在盘中不变 (get_history 默认不含当日)，按 (标的, 交易日, 周期) 一天只算一次；
+    盘前 refresh_atr_cache 统一预热，盘中新增标的或预热失败时在首次使用时补算。
+    """
+    key = (symbol, CLOCK.now().strftime('%Y-%m-%d'), atr_period)
+    if key not in ATR_CACHE:
+        try:
+            ATR_CACHE[key] = _grid_atr_raw(symbol, atr_period)
+        except Exception as e:
+            debug('[{}] 网格ATR测算异常: {}', dsym(context, symbol), e)
+            return None
+    return ATR_CACHE[key]
+
+def refresh_atr_cache(context, symbols=None, atr_period=14):
+    """
+    【刷新钩子】丢弃往日缓存，并重新计算指定标的 (默认全部) 当日的网格 ATR。
+    盘前调用一次；日线数据源修正后也可手动调用强制重算。
+    """
+    today = CLOCK.now().strftime('%Y-%m-%d')
+    symbols = list(symbols if symbols is not None else getattr(context, 'symbol_list', []) or [])
+    for cache in (ATR_CACHE, MACRO_ATR_CACHE):
+        for key in [k for k in cache if k[1] != today or k[0] in symbols]:
+            cache.pop(key, None)
+    for sym in symbols:
+        _cached_grid_atr(context, sym, atr_period)
+    if symbols: _cached_macro_atr(context, symbols[0], 60)
+
+def _macro_atr_kernel(high, low, close, atr_period):
+    """
+    【向量化内核】high/low/close 为 [标的数, 天数] 矩阵 (无缺失)，逐行等价于原 pandas 流水线：
+    TR -> 滚动中位数 (min_periods=1) -> 3 倍截尾 -> EMA(adjust=False)，返回末日 ATR/收盘价。
+    """
+    prev = close[:, :-1]
+    tr = high - low
+    tr[:, 1:] = np.maximum(tr[:, 1:], np.maximum(np.abs(high[:, 1:] - prev), np.abs(low[:, 1:] - prev)))
+    pad = np.full((tr.shape[0], atr_period - 1), np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(np.concatenate([pad, tr], axis=1), atr_period, axis=1)
+    clipped = np.minimum(tr, np.nanmedian(windows, axis=2) * 3)
+    alpha = 2.0 / (atr_period + 1)
+    old_wt, new_wt = 1.0 - alpha, alpha
+    ema = clipped[:, 0]
+    for t in range(1, clipped.shape[1]):
+        ema = (old_wt * ema + new_wt * clipped[:, t]) / (old_wt + new_wt)
+    return ema / close[:, -1]
+
+def _macro_atr_frame(df, atr_period):
+    """
+    【逐标的兜底】原 pandas 流水线，留给含缺失值 (停牌日 PTrade 默认填 NaN) 的日线：
+    max(axis=1)、rolling(min_periods=1).median() 与 ewm 都会跳过 NaN，与向量化内核在无缺失时逐行等价。
+    """
+    high, low, close = df['high'], df['low'], df['close']
+    tr1 = high - low
+    tr2 = (high - close.shift(1)).abs()
+    tr3 = (low - close.shift(1)).abs()
+    tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
+    tr_median = tr.rolling(window=atr_period, min_periods=1).median()
+    tr_clipped = tr.clip(upper=tr_median * 3)
+    atr_series = tr_clipped.ewm(span=atr_period, adjust=False).mean()
+    last_atr_val, last_price = atr_series.iloc[-1], close.iloc[-1]
+    return float(last_atr_val / last_price) if is_valid_price(last_price) else None
+
+def _macro_atr_batch(symbols, atr_period):
+    """
+    一次 get_history 拉全部标的日线；无缺失的按有效行数分组送入向量化内核，含 NaN 的走 _macro_atr_frame。
+    数据不足的标的记 None。
+    """
+    hist = get_history(atr_period + 20, '1d', ['high', 'low', 'close'], security_list=list(symbols))
+    groups, out = {}, {}
+    for sym in symbols:
+        df = hist.get(sym) if isinstance(hist, dict) else None
+        out[sym] = None
+        if df is None or df.empty or len(df) <= 1: continue
+        arr = df[['high', 'low', 'close']].to_numpy(dtype=float)
+        if np.isnan(arr).any():
+            out[sym] = _macro_atr_frame(df, atr_period)
+            continue
+        if not is_valid_price(arr[-1, 2]): continue
+        groups.setdefault(len(arr), []).append((sym, arr))
+    for items in groups.values():
+        block = np.stack([a for _, a in items])
+        rates = _macro_atr_kernel(block[:, :, 0], block[:, :, 1], block[:, :, 2], atr_period)
+        for (sym, _), r in zip(items, rates):
+            out[sym] = float(r)
+    return out
+
+def _cached_macro_atr(context, symbol, atr_period):
+    """当日缓存缺失时，为全部标的 (含本标的) 批量补算一次。"""
+    today = CLOCK.now().strftime('%Y-%m-%d')
+    key = (symbol, today, atr_period)
+    if key not in MACRO_ATR_CACHE:
+        symbols = list(getattr(context, 'symbol_list', None) or [])
+        if symbol not in symbols: symbols.append(symbol)
+        missing = [s for s in symbols if (s, today, atr_period) not in MACRO_ATR_CACHE]
+        try:
+            for sym, rate in _macro_atr_batch(missing, atr_period).items():
+                MACRO_ATR_CACHE[(sym, today, atr_period)] = rate
+        except Exception as e:
+            debug('[{}] 宏观ATR测算异常: {}', dsym(context, symbol), e)
+            return None
+    return MACRO_ATR_CACHE[key]
+
 def calculate_grid_atr(context, symbol, atr_period=14):
     """
     【微观防守引擎】
     纯原味短周期 EMA。极度灵敏，暴跌暴涨当天立刻放大网格间距，保障不被单边打穿。
+    原始 ATR 取自当日缓存，这里只做 10% 刷新门槛判断。
     """
     state = context.state[symbol]
-    try:
-        hist = get_history(atr_period + 5, '1d', ['high', 'low', 'close'], security_list=[symbol])
-        df = hist.get(symbol) if isinstance(hist, dict) else hist
-        current_atr_rate = None
-        if df is not None and not df.empty and len(df) > 1:
-            high, low, close = df['high'], df['low'], df['close']
-            tr1 = high - low
-            tr2 = (high - close.shift(1)).abs()
-            tr3 = (low - close.shift(1)).abs()
-            tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-            atr_series = tr.ewm(span=atr_period, adjust=False).mean()
-            last_atr_val, last_price = atr_series.iloc[-1], close.iloc[-1]
-            if is_valid_price(last_price): current_atr_rate = last_atr_val / last_price
-    except Exception as e:
-        pass
+    current_atr_rate = _cached_grid_atr(context, symbol, atr_period)
         
     used_rate = state.get('grid_atr_rate')
     if current_atr_rate is not None and current_atr_rate > 0:
@@ -1974,30 +3396,11 @@ def calculate_macro_atr(context, symbol, atr_period=60):
     【宏观收割引擎】
     带有截尾平滑处理 (Winsorizing) 的长周期 EMA。
     稳如泰山，单日极其夸张的暴涨暴跌会被强行削平，止盈门槛绝对不会变成“追着胡萝卜跑的驴”。
+    🛡️ 核心防失真装甲：中位数截尾 (限制极端日波幅不超过过去中位数的3倍)，再对削平后的健康数据做 EMA；
+    原始值由 _macro_atr_batch 每日全标的批量算好，这里只做 5% 刷新门槛判断。
     """
     state = context.state[symbol]
-    try:
-        # 多取历史数据保证均值平稳
-        hist = get_history(atr_period + 20, '1d', ['high', 'low', 'close'], security_list=[symbol])
-        df = hist.get(symbol) if isinstance(hist, dict) else hist
-        current_atr_rate = None
-        if df is not None and not df.empty and len(df) > 1:
-            high, low, close = df['high'], df['low'], df['close']
-            tr1 = high - low
-            tr2 = (high - close.shift(1)).abs()
-            tr3 = (low - close.shift(1)).abs()
-            tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-            
-            # 🛡️ 核心防失真装甲：中位数截尾 (限制极端日波幅不超过过去中位数的3倍)
-            tr_median = tr.rolling(window=atr_period, min_periods=1).median()
-            tr_clipped = tr.clip(upper=tr_median * 3)
-            
-            # 使用削平后的健康数据计算 EMA
-            atr_series = tr_clipped.ewm(span=atr_period, adjust=False).mean()
-            last_atr_val, last_price = atr_series.iloc[-1], close.iloc[-1]
-            if is_valid_price(last_price): current_atr_rate = last_atr_val / last_price
-    except Exception as e:
-        if StrategyConfig.DEBUG.ENABLE: info('[{}] 宏观ATR测算异常: {}', dsym(context, symbol), e)
+    current_atr_rate = _cached_macro_atr(context, symbol, atr_period)
         
     used_rate = state.get('macro_atr_rate')
     if current_atr_rate is not None and current_atr_rate > 0:
@@ -2008,14 +3411,14 @@ def calculate_macro_atr(context, symbol, atr_period=60):
     return used_rate
 
 def update_grid_spacing_final(context, symbol, state, curr_pos):
-    pos, unit, base_pos = curr_pos, state['grid_unit'], state['base_position']
+    pos, unit, base_pos = curr_pos, state.grid_unit, state.base_position
     atr_pct = calculate_grid_atr(context, symbol, atr_period=14)
     
     base_spacing = 0.005
     if atr_pct is not None and not math.isnan(atr_pct): 
         base_spacing = max(atr_pct * 0.25, StrategyConfig.TRANSACTION_COST * 5)
         
-    max_grids = state.get('max_grid_count', 12)
+    max_grids = state.max_grid_count
     thresh_low = max(1, max_grids // 3)
     thresh_high = max_grids - thresh_low
     
@@ -2031,8 +3434,8 @@ def update_grid_spacing_final(context, symbol, state, curr_pos):
         
     new_buy, new_sell = round(min(new_buy, 0.03), 4), round(min(new_sell, 0.03), 4)
     
-    if new_buy != state.get('buy_grid_spacing') or new_sell != state.get('sell_grid_spacing'):
-        state['buy_grid_spacing'], state['sell_grid_spacing'] = new_buy, new_sell
+    if new_buy != state.buy_grid_spacing or new_sell != state.sell_grid_spacing:
+        state.buy_grid_spacing, state.sell_grid_spacing = new_buy, new_sell
         info('[{}] 🌊 网格切入【{}】区 (Grid ATR={:.2%}) -> [买{:.2%},卖{:.2%}]', 
              dsym(context, symbol), zone_name, (atr_pct or 0.0), new_buy, new_sell)
         
@@ -2043,34 +3446,64 @@ def end_of_day(context):
     _fast_cancel_all_orders_global(context)
     for sym in context.symbol_list:
         if sym in context.state: safe_save_state(sym, context.state[sym])
+    flush_states(force=True)
     info('✅ 日终作业完成，PnL计算已推迟至盘后。')
 
 # ---------------- VA & Tools ----------------
 
+# ---------------- VA 价值平均排期 ----------------
+
+def va_accumulated(base, rate, weeks):
+    """
+    【定投排期】第 1~weeks 周累计定投额 Σ base·(1+rate)^w。
+    前缀和按 (base, rate) 缓存并逐周延长，查询 O(1)；逐项累加顺序与原生成器求和相同，结果逐位一致。
+    """
+    if weeks <= 0: return 0
+    acc = VA_SCHEDULE.get((base, rate))
+    if acc is None: acc = VA_SCHEDULE[(base, rate)] = [0]
+    while len(acc) <= weeks:
+        acc.append(acc[-1] + base * (1 + rate) ** len(acc))
+    return acc[weeks]
+
+def va_target_value(state, weeks):
+    """理论应到价值 = 底仓初始价值 (含滴灌注入) + 累计定投。"""
+    return state.get('initial_position_value', 0) + va_accumulated(state.get('dingtou_base', 0), state.get('dingtou_rate', 0), weeks)
+
+def va_target_shares(state, weeks, price):
+    """理论应到价值按现价折算的股数 (向下取整到 100 股)。"""
+    return int(va_target_value(state, weeks) / price / 100) * 100
+
+def _va_release_due(base_pos, price, target_val, unit, floor):
+    """
+    VA 底仓盈余释放条件：现值超出理论价值 K 个网格且释放后不低于底仓下限 (标量与 NumPy 数组通用)。
+    get_target_base_position 与 PortfolioBook.screen 共用。
+    """
+    return (base_pos * price - target_val >= StrategyConfig.VA.THRESHOLD_K * (unit * price)) & (base_pos - unit >= floor)
+
 def get_target_base_position(context, symbol, state, price, dt):
+    """VA 底仓调整；闸门条件改动需同步 PortfolioBook.screen 的 VA 掩码。"""
     try:
         weeks = get_trade_weeks(context, symbol, state, dt)
-        accumulated_investment = sum(state['dingtou_base'] * (1 + state['dingtou_rate'])**w for w in range(1, weeks + 1))
-        target_val, current_val = state['initial_position_value'] + accumulated_investment, state['base_position'] * price
-        surplus, grid_value = current_val - target_val, state['grid_unit'] * price
-        if surplus >= StrategyConfig.VA.THRESHOLD_K * grid_value:
-            release_amt = state['grid_unit']
-            if state['base_position'] - release_amt >= state['initial_base_position'] * 0.5:
-                state['base_position'] -= release_amt
-                info('[{}] 💰 VA底仓盈余释放: 减少 {} 股', dsym(context, symbol), release_amt)
-        delta_val = target_val - (state['last_week_position'] * price)
+        target_val = va_target_value(state, weeks)
+        if _va_release_due(state.base_position, price, target_val, state.grid_unit, state.initial_base_position * 0.5):
+            release_amt = state.grid_unit
+            state.base_position -= release_amt
+            info('[{}] 💰 VA底仓盈余释放: 减少 {} 股', dsym(context, symbol), release_amt)
+            emit_event('va', symbol, action='release', qty=release_amt, base=state.base_position, weeks=weeks)
+        delta_val = target_val - (state.last_week_position * price)
         if delta_val > 0:
             delta_pos = math.ceil(delta_val / price / 100) * 100
-            new_pos = state['last_week_position'] + delta_pos
-            min_base = round(state['initial_position_value'] / state['base_price'] / 100) * 100
+            new_pos = state.last_week_position + delta_pos
+            min_base = round(state.initial_position_value / state.base_price / 100) * 100
             final_pos = round(max(min_base, new_pos) / 100) * 100
-            if final_pos > state['base_position']:
+            if final_pos > state.base_position:
                 info('[{}] 📈 VA价值平均加仓: 底仓增加至 {}', dsym(context, symbol), final_pos)
-                state['base_position'] = final_pos
+                emit_event('va', symbol, action='add', qty=final_pos - state.base_position, base=final_pos, weeks=weeks)
+                state.base_position = final_pos
                 
-        state['max_position'] = state['base_position'] + state['grid_unit'] * state.get('max_grid_count', 12)
+        state.max_position = state.base_position + state.grid_unit * state.max_grid_count
     except Exception: pass
-    return state['base_position']
+    return state.base_position
 
 def get_trade_weeks(context, symbol, state, dt):
     """
@@ -2080,11 +3513,12 @@ def get_trade_weeks(context, symbol, state, dt):
     y, w, _ = dt.date().isocalendar()
     key = f"{y}_{w}"
     
-    if 'trade_week_set' not in state or not isinstance(state['trade_week_set'], set):
-        state['trade_week_set'] = set()
+    week_set = getattr(state, 'trade_week_set', None)
+    if not isinstance(week_set, set):
+        week_set = state.trade_week_set = set()
         
-    if key not in state['trade_week_set']:
-        state['trade_week_set'].add(key)
+    if key not in week_set:
+        week_set.add(key)
         # 记录上周位置，用于计算本周 VA 差额
         state['last_week_position'] = state.get('base_position', 0)
         
@@ -2104,7 +3538,7 @@ def get_trade_weeks(context, symbol, state, dt):
         safe_save_state(symbol, state)
         
     # 如果集合为空（刚止盈），强制返回 0 以便 VA 重新起步
-    return len(state['trade_week_set'])
+    return len(week_set)
 
 def adjust_grid_unit(state):
     """
@@ -2114,12 +3548,12 @@ def adjust_grid_unit(state):
     2. 物理通道：单次网格价值严格限制在 [1000元, 5000元] 区间。
     3. 支持缩容：废除棘轮效应，止盈后网格单位自动等比例回撤。
     """
-    max_grids = state.get('max_grid_count', 12)
+    max_grids = state.max_grid_count
     scale_multiplier = max_grids * 2
-    price = state.get('base_price', 1.0)
+    price = state.base_price
     
     # 算盘1：理论上应该有多大？
-    theoretical_unit = math.ceil(state['base_position'] / scale_multiplier / 100) * 100
+    theoretical_unit = math.ceil(state.base_position / scale_multiplier / 100) * 100
     
     # 算盘2：计算 1000元下限 和 5000元上限对应的股数
     floor_unit_val = max(100, math.ceil(1000 / price / 100) * 100)
@@ -2128,73 +3562,102 @@ def adjust_grid_unit(state):
     # 三者取其平衡：在理论值之上兜底 1000，在理论值之上封顶 5000
     new_unit = min(max(theoretical_unit, floor_unit_val), capped_unit_val)
     
-    if new_unit != state['grid_unit']:
-        direction = "📈 扩容" if new_unit > state['grid_unit'] else "📉 缩容"
-        info(f"[{state.get('symbol')}] 🔧 网格单位自适应{direction}: {state['grid_unit']} -> {new_unit} 股")
-        state['grid_unit'] = new_unit
+    if new_unit != state.grid_unit:
+        direction = "📈 扩容" if new_unit > state.grid_unit else "📉 缩容"
+        info(f"[{state.symbol}] 🔧 网格单位自适应{direction}: {state.grid_unit} -> {new_unit} 股")
+        state.grid_unit = new_unit
             
     # 动态天花板永远跟随最新底仓和最新网格量计算
-    state['max_position'] = state['base_position'] + state['grid_unit'] * max_grids
+    state.max_position = state.base_position + state.grid_unit * max_grids
 
 def _load_pnl_metrics(path):
     if path.exists(): return json.loads(path.read_text(encoding='utf-8'))
     return {}
 
 def _save_pnl_metrics(context):
-    if hasattr(context, 'pnl_metrics_path'):
+    if getattr(context, 'pnl_metrics_path', None):
         context.pnl_metrics_path.write_text(json.dumps(context.pnl_metrics, indent=2), encoding='utf-8')
 
+def _ledger_book(state):
+    """新标的建账：初始底仓按建账时的 base_price 记一笔 'base' 批次 (此后锁定在账本里)。"""
+    initial_pos, initial_cost = state.get('initial_base_position', 0), state.get('base_price', 0)
+    inv = [[initial_pos, initial_cost, 'base']] if initial_pos > 0 else []
+    return {'inv': inv, 'hold': initial_pos, 'grid': 0.0, 'base': 0.0}
+
+def _ledger_apply(book, state, qty, price, base_pos_at_trade):
+    """一笔成交推进 LIFO 库存：买入先补足当时底仓，余量记网格批次；卖出从最近的批次开始抵扣。"""
+    inventory = book['inv']
+    target_base = base_pos_at_trade if base_pos_at_trade > 0 else state.get('base_position', 0)
+    if qty > 0:
+        rem = qty
+        if book['hold'] < target_base:
+            fill = min(rem, target_base - book['hold'])
+            inventory.append([fill, price, 'base']); book['hold'] += fill; rem -= fill
+        if rem > 0: inventory.append([rem, price, 'grid']); book['hold'] += rem
+    elif qty < 0:
+        sell_q = abs(qty); book['hold'] -= sell_q
+        while sell_q > 0.001 and inventory:
+            lot = inventory[-1]; matched = min(sell_q, lot[0]); profit = (price - lot[1]) * matched
+            if lot[2] == 'base': book['base'] += profit
+            else: book['grid'] += profit
+            sell_q -= matched; lot[0] -= matched
+            if lot[0] <= 0.001: inventory.pop()
+
 def _calculate_local_pnl_lifo(context):
+    """
+    【增量 LIFO 账本】state/pnl_ledger.json 保存各标的剩余批次、持仓与已实现盈亏，
+    连同成交库游标 {月份: 已消费行数}；每次只读游标之后新追加的成交，盘前重建与历史长度无关。
+    - 成交库被截断/替换 (某月行数少于游标)：整本账从头重建；
+    - 新加入 (或移出后又加回) 的标的：只对该标的把游标之前的历史补一遍。
+    """
     info('🧮 启动本地 PnL 引擎 (LIFO)...')
-    trade_log_path = research_path('reports', 'a_trade_details.csv')
-    if not trade_log_path.exists(): return
-    trades = []
+    ledger_path = research_path('state', 'pnl_ledger.json')
+    try: ledger = json.loads(ledger_path.read_text(encoding='utf-8'))
+    except Exception: ledger = {}
+    cursor, books = ledger.get('cursor'), ledger.get('books', {})
     try:
-        with open(trade_log_path, 'r', encoding='utf-8') as f:
-            f.readline()
-            for line in f:
-                parts = line.strip().split(',')
-                if len(parts) < 6: continue
-                trades.append({'time': parts[0],'symbol': parts[1],'qty': float(parts[3]),'price': float(parts[4]),'base_pos_at_trade': int(parts[5]) if parts[5].isdigit() else 0})
+        TRADES.flush()
+        if not TRADES.months(): return
+        if cursor is None: cursor, books = {}, {}
+        if any(TRADES.count(m) < n for m, n in cursor.items()):
+            info('⚠️ 成交库与 PnL 账本游标不一致，从头重建')
+            cursor, books = {}, {}
+        active = {sym: context.state[sym] for sym in context.symbol_list if sym in context.state}
+        fresh = [sym for sym in active if sym not in books]
+        for sym in fresh: books[sym] = _ledger_book(active[sym])
+        if fresh and cursor:
+            history, _ = TRADES.scan(upto=cursor, symbols=fresh)
+            for ts, sid, qty, price, base_pos, _ in history.tolist():
+                sym = TRADES.symbol_of(sid)
+                _ledger_apply(books[sym], active[sym], qty, price, base_pos)
+        rows, cursor = TRADES.scan(after=cursor)
     except Exception: return
-    trades.sort(key=lambda x: x['time'])
-    pnl_metrics = getattr(context, 'pnl_metrics', {})
-    for sym in context.symbol_list:
-        if sym not in context.state: continue
-        state, initial_pos, initial_cost = context.state[sym], context.state[sym].get('initial_base_position', 0), context.state[sym].get('base_price', 0)
-        inventory, current_holding, grid_pnl, base_pnl = [], initial_pos, 0.0, 0.0
-        if initial_pos > 0: inventory.append([initial_pos, initial_cost, 'base'])
-        sym_trades = [t for t in trades if t['symbol'] == sym]
-        for t in sym_trades:
-            qty, price, target_base = t['qty'], t['price'], (t['base_pos_at_trade'] if t['base_pos_at_trade'] > 0 else state.get('base_position', 0))
-            if qty > 0:
-                rem = qty
-                if current_holding < target_base:
-                    fill = min(rem, target_base - current_holding)
-                    inventory.append([fill, price, 'base']); current_holding += fill; rem -= fill
-                if rem > 0: inventory.append([rem, price, 'grid']); current_holding += rem
-            elif qty < 0:
-                sell_q = abs(qty); current_holding -= sell_q
-                while sell_q > 0.001 and inventory:
-                    lot = inventory[-1]; matched = min(sell_q, lot[0]); profit = (price - lot[1]) * matched
-                    if lot[2] == 'base': base_pnl += profit
-                    else: grid_pnl += profit
-                    sell_q -= matched; lot[0] -= matched
-                    if lot[0] <= 0.001: inventory.pop()
+    for ts, sid, qty, price, base_pos, _ in rows.tolist():
+        sym = TRADES.symbol_of(sid)
+        if sym in active: _ledger_apply(books[sym], active[sym], qty, price, base_pos)
+        else: books.pop(sym, None)      # 不在交易列表中的标的不记账，重新加入时补账
+    try:
+        tmp = ledger_path.with_name(ledger_path.name + '.tmp')
+        tmp.write_text(json.dumps({'cursor': cursor, 'books': books}, separators=(',', ':')), encoding='utf-8')
+        tmp.replace(ledger_path)
+    except Exception as e:
+        info('⚠️ PnL 账本保存失败: {}', e)
+
+    pnl_metrics = {k: dict(v) for k, v in getattr(context, 'pnl_metrics', {}).items()}     # 换新字典发布，不在读者手里原地改
+    for sym in active:
+        book = books[sym]
         if sym not in pnl_metrics: pnl_metrics[sym] = {}
-        pnl_metrics[sym].update({'realized_grid_pnl': grid_pnl, 'realized_base_pnl': base_pnl, 'total_realized_pnl': grid_pnl + base_pnl})
+        pnl_metrics[sym].update({'realized_grid_pnl': book['grid'], 'realized_base_pnl': book['base'], 'total_realized_pnl': book['grid'] + book['base']})
     context.pnl_metrics = pnl_metrics
     _save_pnl_metrics(context)
 
 def after_trading_end(context, data):
+    flush_states(force=True)
     if '回测' in context.env: return
+    PERF.flush(context)
     info('🏁 盘后作业开始...')
-    try: _calculate_local_pnl_lifo(context)
-    except Exception: pass
-    try:
-        update_daily_reports(context, data)
-        generate_html_report(context)
-    except Exception: pass
+    REPORTER.submit('post', _report_post_market, context, _report_snapshot(context))
+    REPORTER.wait(StrategyConfig.REPORT.DRAIN_SEC)     # 盘后没有交易要赶，等日终报表落盘
     info('✅ 盘后作业结束')
 
 def reload_config_if_changed(context):
@@ -2257,30 +3720,195 @@ def reload_config_if_changed(context):
                         state['credit_limit'] = new_limit
         context.symbol_config = new_config
         _load_symbol_names(context)
+        book_touch()
         info('✅ 配置文件热重载完成！')
     except Exception as e:
-        info(f'❌ 配置文件热重载失败: {e}')
+        info(f'❌ 配置文件热重载失败: {e}', flush=True)
+
+TRADE_DTYPE = np.dtype([('ts', 'M8[s]'), ('sid', '<i4'), ('qty', '<f8'), ('price', '<f8'),
+                        ('base_pos', '<i8'), ('entrust_no', 'S16')])
+TRADE_CSV_HEADER = ",".join(["time", "symbol", "direction", "quantity", "price", "base_position_at_trade", "entrust_no"]) + "\n"
+
+class TradeStore:
+    """
+    【列式成交库】trades/<YYYY-MM>.bin 是 TRADE_DTYPE 定长记录的只追加文件 (按月分块)，查询时 np.memmap 只读映射；
+    trades/symbols.json 是 标的 -> 整数编号 的索引，按编号列做向量化掩码取数，不再解析文本。
+    成交先进内存缓冲，随 flush_states 每 tick 合并写盘一次；reports/a_trade_details.csv 保留为人工查看的导出，同批追加。
+    游标 {月份: 已读行数} 供 PnL 账本增量消费。交易线程追加、后台报表线程读取，写盘与缓冲交换在同一把锁内。
+    """
+    BUFFER_ROWS = 256       # 缓冲超过该行数时不等 tick 结束直接落盘
+
+    def __init__(self):
+        self.root = None
+        self._sids = {}
+        self._names = []
+        self._buf = []
+        self._lock = threading.RLock()
+
+    def _dir(self):
+        if self.root is not None: return self.root
+        with self._lock:
+            if self.root is not None: return self.root
+            root = research_path('trades')
+            root.mkdir(parents=True, exist_ok=True)
+            self.root = root
+            try: self._names = json.loads((root / 'symbols.json').read_text(encoding='utf-8'))
+            except Exception: self._names = []
+            self._sids = {sym: i for i, sym in enumerate(self._names)}
+            if not self.months(): self._import_csv()
+        return self.root
+
+    def sid(self, symbol):
+        i = self._sids.get(symbol)
+        if i is None:
+            self._dir()
+            i = self._sids[symbol] = len(self._names)
+            self._names.append(symbol)
+            tmp = self.root / 'symbols.json.tmp'
+            tmp.write_text(json.dumps(self._names), encoding='utf-8')
+            tmp.replace(self.root / 'symbols.json')
+        return i
+
+    def symbol_of(self, sid):
+        self._dir()
+        return self._names[int(sid)]
+
+    def months(self):
+        root = self.root if self.root is not None else self._dir()
+        return sorted(p.stem for p in root.glob('*.bin'))
+
+    def append(self, dt, symbol, qty, price, base_pos, entrust_no):
+        self._dir()
+        with self._lock:
+            self._buf.append((dt, symbol, float(qty), float(price), int(base_pos), str(entrust_no)))
+            if len(self._buf) >= self.BUFFER_ROWS: self.flush()
+
+    def _write(self, rows, csv=True):
+        by_month = {}
+        for row in rows: by_month.setdefault(f"{row[0]:%Y-%m}", []).append(row)
+        for month, items in by_month.items():
+            arr = np.array([(np.datetime64(dt.replace(microsecond=0), 's'), self.sid(sym), qty, price, base_pos, eid.encode('utf-8')[:16])
+                            for dt, sym, qty, price, base_pos, eid in items], dtype=TRADE_DTYPE)
+            path = self.root / f"{month}.bin"
+            with open(path, 'ab') as f:
+                torn = f.tell() % TRADE_DTYPE.itemsize
+                if torn: f.truncate(f.tell() - torn)   # 上次崩溃写了半条记录
+                f.write(arr.tobytes())
+        if not csv: return
+        csv_path = research_path('reports', 'a_trade_details.csv')
+        is_new = not csv_path.exists()
+        with open(csv_path, 'a', encoding='utf-8', newline='') as f:
+            if is_new: f.write(TRADE_CSV_HEADER)
+            f.write("".join(",".join([f"{dt:%Y-%m-%d %H:%M:%S}", sym, "BUY" if qty > 0 else "SELL", f"{qty:.0f}", f"{price:.3f}", str(base_pos), eid]) + "\n"
+                            for dt, sym, qty, price, base_pos, eid in rows))
+
+    def flush(self):
+        if not self._buf: return
+        with self._lock:
+            rows, self._buf = self._buf, []
+            try: self._write(rows)
+            except Exception as e:
+                self._buf = rows + self._buf       # 保留缓冲，下次重试
+                info('⚠️ 成交库写盘失败: {}', e)
+
+    def _import_csv(self):
+        """首次启用：把历史 a_trade_details.csv 一次性导入列式库 (不回写 CSV)。"""
+        csv_path = research_path('reports', 'a_trade_details.csv')
+        if not csv_path.exists(): return
+        rows = []
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                parts = line.strip().split(',')
+                if len(parts) < 6: continue
+                try:
+                    # 旧版数量列记的是回报原值 (多为正数)，方向以 BUY/SELL 列为准，与 log_trade_details 的符号约定一致
+                    qty = abs(float(parts[3]))
+                    if parts[2].strip().upper() != 'BUY': qty = -qty
+                    rows.append((datetime.strptime(parts[0], "%Y-%m-%d %H:%M:%S"), parts[1], qty, float(parts[4]),
+                                 int(parts[5]) if parts[5].isdigit() else 0, parts[6] if len(parts) > 6 else 'N/A'))
+                except ValueError: continue
+        if rows:
+            rows.sort(key=lambda r: r[0])
+            self._write(rows, csv=False)
+            info('📦 成交库: 从 a_trade_details.csv 导入 {} 笔历史成交', len(rows))
+
+    def count(self, month):
+        path = self._dir() / f"{month}.bin"
+        return path.stat().st_size // TRADE_DTYPE.itemsize if path.exists() else 0
+
+    def _load(self, month):
+        n = self.count(month)
+        if n == 0: return np.empty(0, dtype=TRADE_DTYPE)
+        return np.memmap(self.root / f"{month}.bin", dtype=TRADE_DTYPE, mode='r', shape=(n,))
+
+    def scan(self, after=None, upto=None, symbols=None):
+        """
+        按游标读取: 每个月份取 [after[月], upto[月]) 行 (缺省为 0 / 文件末尾)，可按标的过滤。
+        返回 (按时间稳定排序的结构化数组, 读到末尾的新游标)。
+        """
+        after, upto = after or {}, upto or {}
+        sids = None if symbols is None else np.array([self._sids[s] for s in symbols if s in self._sids], dtype='<i4')
+        parts, cursor = [], {}
+        for month in self.months():
+            arr = self._load(month)
+            hi = min(len(arr), upto.get(month, len(arr)))
+            cursor[month] = hi
+            chunk = arr[after.get(month, 0):hi]
+            if sids is not None: chunk = chunk[np.isin(chunk['sid'], sids)]
+            if len(chunk): parts.append(np.array(chunk))
+        rows = np.concatenate(parts) if parts else np.empty(0, dtype=TRADE_DTYPE)
+        return rows[np.argsort(rows['ts'], kind='stable')], cursor
+
+    def query(self, symbol=None, start=None, end=None):
+        """某标的 (None 为全部) 在 [start, end] 日期/时间范围内的成交，结构化数组 (ts/sid/qty/price/base_pos/entrust_no)。"""
+        self.flush()
+        t0 = np.datetime64(start, 's') if start is not None else None
+        t1 = np.datetime64(end, 's') if end is not None else None
+        if t1 is not None and isinstance(end, str) and len(end) == 10: t1 = t1 + np.timedelta64(86399, 's')
+        sid = self._sids.get(symbol) if symbol is not None else None
+        if symbol is not None and sid is None: return np.empty(0, dtype=TRADE_DTYPE)
+        parts = []
+        for month in self.months():
+            if t0 is not None and month < str(t0)[:7]: continue
+            if t1 is not None and month > str(t1)[:7]: continue
+            arr = self._load(month)
+            mask = np.ones(len(arr), dtype=bool)
+            if sid is not None: mask &= arr['sid'] == sid
+            if t0 is not None: mask &= arr['ts'] >= t0
+            if t1 is not None: mask &= arr['ts'] <= t1
+            if mask.any(): parts.append(np.array(arr[mask]))
+        rows = np.concatenate(parts) if parts else np.empty(0, dtype=TRADE_DTYPE)
+        return rows[np.argsort(rows['ts'], kind='stable')]
+
+TRADES = TradeStore()
+
+def _trades_shutdown():
+    try: TRADES.flush()
+    except Exception: pass
+
+atexit.register(_trades_shutdown)
 
 def log_trade_details(context, symbol, trade):
+    """成交明细进列式成交库缓冲 (随 tick 合并落盘，同批导出 a_trade_details.csv)。"""
     try:
-        trade_log_path = research_path('reports', 'a_trade_details.csv')
-        is_new = not trade_log_path.exists()
-        with open(trade_log_path, 'a', encoding='utf-8', newline='') as f:
-            if is_new: f.write(",".join(["time", "symbol", "direction", "quantity", "price", "base_position_at_trade", "entrust_no"]) + "\n")
-            dir_str, base_pos = ("BUY" if trade['entrust_bs'] == '1' else "SELL"), context.state[symbol].get('base_position', 0)
-            f.write(",".join([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), symbol, dir_str, str(trade['business_amount']), f"{trade['business_price']:.3f}", str(base_pos), trade.get('entrust_no', 'N/A')]) + "\n")
+        qty = float(trade['business_amount'])
+        qty = abs(qty) if trade['entrust_bs'] == '1' else -abs(qty)
+        TRADES.append(CLOCK.now(), symbol, qty, float(trade['business_price']),
+                      context.state[symbol].get('base_position', 0), trade.get('entrust_no', 'N/A'))
     except Exception: pass
 
-def update_daily_reports(context, data):
+def update_daily_reports(context):
+    """context 为报表快照 (_report_snapshot)，在后台报表线程里写各标的日报 CSV。"""
     reports_dir = research_path('reports')
     reports_dir.mkdir(parents=True, exist_ok=True)
     current_date = context.current_dt.strftime("%Y-%m-%d")
     for symbol in context.symbol_list:
-        report_file, state, position = reports_dir / f"{symbol}.csv", context.state[symbol], get_position(symbol)
+        report_file, state, position = reports_dir / f"{symbol}.csv", context.state[symbol], context.positions[symbol]
         amount, close_price = position.amount, context.last_valid_price.get(symbol, state['base_price'])
         if not is_valid_price(close_price): close_price = state['base_price']
         weeks, d_base, d_rate = len(state.get('trade_week_set', [])), state['dingtou_base'], state['dingtou_rate']
-        cumulative_invest = sum(d_base * (1 + d_rate) ** w for w in range(1, weeks+1))
+        cumulative_invest = va_accumulated(d_base, d_rate, weeks)
         
         max_grids = state.get('max_grid_count', 12)
         thresh_low = max(1, max_grids // 3)
@@ -2349,9 +3977,8 @@ def _calculate_watermark_grid_pnl(context, symbol, current_P, current_Q, current
             normalized_V = current_V + state['wm_pnl'] 
             
             # [Fix] 调用规范的 StrategyConfig.DEBUG 避免 AttributeError
-            if StrategyConfig.DEBUG.ENABLE:
-                info('[{}] 💧 水位线解析成功！在 {} 股档位完成套利，重构网格利润: +{:.2f} 元', 
-                     dsym(context, symbol), current_Q, new_profit)
+            debug('[{}] 💧 水位线解析成功！在 {} 股档位完成套利，重构网格利润: +{:.2f} 元', 
+                  dsym(context, symbol), current_Q, new_profit)
 
     # 5. 刷新该股数档位的最新成本记忆
     state['wm_map'][q_key] = normalized_V
@@ -2360,169 +3987,229 @@ def _calculate_watermark_grid_pnl(context, symbol, current_P, current_Q, current
 
 # ---------------- 【修改】监控与报表生成 (接入水位线引擎 & 12档弹药雷达) ----------------
 
-def generate_html_report(context):
+def _dashboard_row_key(context, symbol, state, position, price, pnl_metrics):
+    """行片段依赖的全部输入；与上次相同则整行 HTML 原样复用 (水位线账本对相同输入幂等，跳过不影响结果)。"""
+    config = getattr(context, 'symbol_config', {}).get(symbol, {})
+    return (price, position.amount, position.cost_basis, getattr(position, 'total_pnl', None),
+            pnl_metrics.get(symbol, {}).get('total_realized_pnl', 0),
+            tuple(state.get('buy_stack', ())), tuple(state.get('sell_stack', ())),
+            state.get('_tp_tier', 0), state.get('_tp_hwm_ratio', 0.0), state.get('macro_atr_rate'), state.get('grid_atr_rate'),
+            len(state.get('trade_week_set', ())), state.get('grid_unit'), state.get('base_position'), state.get('max_grid_count'),
+            state.get('dingtou_base'), state.get('dingtou_rate'), state.get('initial_position_value'),
+            state.get('tp_cool_weeks', config.get('tp_cool_weeks', 4)), state.get('tp_min_weeks', config.get('tp_min_weeks', 12)),
+            state.get('tp_min_value', config.get('tp_min_value', 30000)), dsym(context, symbol, style='long'), state.get('wm_pnl'))
+
+def _dashboard_row_html(context, symbol, state, position, price, pnl_metrics):
+    """单个标的的主行 + 抽屉行 HTML；返回 (分组序号 0/1/2, html)。"""
+    pos_amt = position.amount
+    market_value = pos_amt * price
+    unrealized_pnl = (price - position.cost_basis) * pos_amt if position.cost_basis > 0 else 0
+
+    config = getattr(context, 'symbol_config', {}).get(symbol, {})
+    tp_cool_weeks = state.get('tp_cool_weeks', config.get('tp_cool_weeks', 4))
+    min_weeks = state.get('tp_min_weeks', config.get('tp_min_weeks', 12))
+    min_val = state.get('tp_min_value', config.get('tp_min_value', 30000))
+
+    trade_weeks = state.get('trade_week_set', set())
+    current_weeks = len(trade_weeks)
+
+    tier = state.get('_tp_tier', 0)
+    hwm = state.get('_tp_hwm_ratio', 0.0)
+    profit_ratio = (price - position.cost_basis) / position.cost_basis if position.cost_basis > 0 else 0
+    atr = state.get('macro_atr_rate', 0.02)
+    if not isinstance(atr, (int, float)) or math.isnan(atr): atr = 0.02
+
+    status_html = ""
+    radar_html = ""
+    if current_weeks < tp_cool_weeks and min_weeks < 999:
+        status_html = '<span class="badge badge-cooldown">❄️ 物理冷却期</span>'
+        radar_html = f'<div style="width:110px;"><span class="text-dim">静默断代 (余 {tp_cool_weeks - current_weeks} 周)</span></div>'
+    elif min_weeks >= 999:
+        status_html = '<span class="badge badge-safe">🟢 信仰长拿</span>'
+        radar_html = '<div style="width:110px;"><span class="text-dim">🔒 防线关闭</span></div>'
+    elif current_weeks < min_weeks and market_value < min_val:
+        status_html = '<span class="badge badge-seed">🌱 幼苗保护期</span>'
+        progress = min(100, int((current_weeks / min_weeks) * 100))
+        radar_html = f'<div style="width:110px;"><div class="progress-bg"><div class="progress-fill fill-seed" style="width: {progress}%;"></div></div><div class="text-dim" style="margin-top:4px;">养肥中 ({current_weeks}/{min_weeks}周)</div></div>'
+    elif tier > 0:
+        status_html = f'<span class="badge badge-alert">🔥 Tier {tier} 警戒!</span>'
+        drawdown = hwm - profit_ratio
+        limit = {1: 3.0 * atr, 2: 5.0 * atr, 3: 8.0 * atr}.get(tier, 0.05)
+        risk_pct = min(100, max(0, int((drawdown / limit) * 100)))
+        radar_html = f'<div style="width:110px;"><div class="progress-bg"><div class="progress-fill fill-alert" style="width: {risk_pct}%;"></div></div><div class="text-alert" style="margin-top:4px;">距回撤防线 {(limit - drawdown)*100:.1f}%</div></div>'
+    else:
+        status_html = '<span class="badge badge-safe">🟢 安全发育中</span>'
+        tp_threshold = 10.0 * atr
+        dist_pct = min(100, max(0, int((profit_ratio / tp_threshold) * 100))) if tp_threshold > 0 else 0
+        radar_html = f'<div style="width:110px;"><div class="progress-bg"><div class="progress-fill fill-safe" style="width: {dist_pct}%;"></div></div><div class="text-dim" style="margin-top:4px;">距触发一阶 {(tp_threshold - profit_ratio)*100:.1f}%</div></div>'
+
+    unit = state.get('grid_unit', 100)
+    base_pos = state.get('base_position', 0)
+    max_grids = state.get('max_grid_count', 12)
+    thresh_low = max(1, max_grids // 3)
+    thresh_high = max_grids - thresh_low
+
+    current_bullets = max(0, (pos_amt - base_pos) / unit) if unit > 0 else 0
+    ammo_pct = min(100, int((current_bullets / max_grids) * 100)) if max_grids > 0 else 0
+
+    if current_bullets <= thresh_low:
+        ammo_class, ammo_text = "fill-safe", f"{int(current_bullets)}/{max_grids} 浅水区"
+    elif current_bullets <= thresh_high:
+        ammo_class, ammo_text = "fill-alert", f"{int(current_bullets)}/{max_grids} 核心区"
+    else:
+        ammo_class, ammo_text = "fill-cooldown", f"{int(current_bullets)}/{max_grids} 深水警告"
+
+    ammo_html = f'<div style="margin-bottom:4px; white-space:nowrap;"><div class="progress-bg" style="width:60px; display:inline-block; vertical-align:middle; margin-right:6px;"><div class="progress-fill {ammo_class}" style="width: {ammo_pct}%;"></div></div><span style="color:#9aa5ce; font-size:12px;">{ammo_text}</span></div><div style="color:#9aa5ce; font-size:11px; white-space:nowrap;">持仓:{int(pos_amt)}/底仓:{int(base_pos)}</div>'
+
+    grid_atr = state.get('grid_atr_rate')
+    grid_atr_disp = f"{grid_atr*100:.2f}%" if isinstance(grid_atr, (int, float)) and not math.isnan(grid_atr) and grid_atr > 0 else "N/A"
+    macro_val = state.get('macro_atr_rate')
+    macro_atr_disp = "N/A" if min_weeks >= 999 else (f"{macro_val*100:.2f}%" if isinstance(macro_val, (int, float)) and not math.isnan(macro_val) and macro_val > 0 else "N/A")
+
+    symbol_name = dsym(context, symbol, style='long')
+    sym_id_js = symbol.replace('.', '_')
+
+    symbol_html = f"<div style=\"cursor:pointer; color:#7aa2f7; font-weight:bold; font-size:14px; white-space:nowrap;\" onclick=\"toggleDrawer('{sym_id_js}')\">🔽 {symbol_name}</div><div style=\"color:#9aa5ce; font-size:11px; margin-left:22px; margin-top:2px; white-space:nowrap;\">定投: {current_weeks}周 | 网格: {int(state.get('grid_unit',0))}股</div>"
+
+    real_grid_pnl = 0.0
+    cost_reduction = 0.0
+    if pos_amt > 0:
+        real_grid_pnl = state.get('wm_pnl', 0.0)       # 水位线已在交易线程取快照时推进
+        base_q = state.get('base_position', 100)
+        cost_reduction = real_grid_pnl / base_q if base_q > 0 else 0.0
+
+    pnl_info = f"""
+    <span class="{'text-safe' if unrealized_pnl>=0 else 'text-alert'}">
+        浮盈: {unrealized_pnl:,.2f} <br> <b>{(profit_ratio*100):.2f}%</b>
+    </span><br>
+    <span style="color:#9ece6a; font-size:11px; font-weight:bold;">
+        💧网格: +{real_grid_pnl:,.2f}
+    </span><br>
+    <span style="color:#7dcfff; font-size:11px;">
+        🛡️降本: -{cost_reduction:.3f}
+    </span>
+    """
+
+    b_stack = state.get('buy_stack') or PriceLadder()
+    s_stack = state.get('sell_stack') or PriceLadder()
+    b_str = " | ".join([f"{p:.3f}({v}股)" for p, v in b_stack.items(reverse=True, limit=5)]) if b_stack else "无挂单 (下方真空)"
+    s_str = " | ".join([f"{-p:.3f}({v}股)" for p, v in s_stack.items(reverse=True, limit=5)]) if s_stack else "天空毫无阻力 (无套牢单)"
+
+    acc_invest = va_accumulated(state.get('dingtou_base', 0), state.get('dingtou_rate', 0), current_weeks)
+    target_val = va_target_value(state, current_weeks)
+
+    drawer_html = f"""
+    <td colspan="7" style="padding: 0; border: none; white-space: normal;">
+        <div id="drawer-{sym_id_js}" class="drawer-content" style="display: none; background: #1f2335; padding: 12px 15px; margin: 4px 10px 15px 10px; border-left: 3px solid #7aa2f7; border-radius: 4px; box-shadow: inset 0 2px 4px rgba(0,0,0,0.2);">
+            <div style="color: #c0caf5; font-size: 13px; margin-bottom: 6px;"><b>🧱 堆栈微观阵地 (Stack Radar):</b></div>
+            <div style="color: #f7768e; font-size: 12px; margin-left: 15px; margin-bottom: 4px;">🔴 <b>上方套牢阻力 (Sell Stack):</b> {s_str}</div>
+            <div style="color: #9ece6a; font-size: 12px; margin-left: 15px; margin-bottom: 8px;">🟢 <b>下方网格支撑 (Buy Stack):</b> {b_str}</div>
+            <div style="color: #c0caf5; font-size: 13px; margin-bottom: 6px;"><b>💧 VA 价值平均引擎 (Engine Status):</b></div>
+            <div style="color: #7dcfff; font-size: 12px; margin-left: 15px;">实际累计投入: {acc_invest:,.2f} 元 &nbsp; | &nbsp; 理论应到价值: {target_val:,.2f} 元</div>
+        </div>
+    </td>
+    """
+
+
+    row = (f"<tr class=\"row-main\"><td>{symbol_html}</td><td>{status_html}</td><td>{ammo_html}</td><td>{position.cost_basis:.3f} / {price:.3f}</td>"
+           f"<td>{pnl_info}</td><td>{grid_atr_disp} / <br>{macro_atr_disp}</td><td>{radar_html}</td></tr>"
+           f"<tr id=\"tr-drawer-{sym_id_js}\" style=\"display:none; background:transparent;\">{drawer_html}</tr>")
+    group = 0 if min_weeks >= 999 else (1 if min_weeks <= 12 else 2)
+    return group, row
+
+DASH_SLOTS = ('update_time', 'total_market_value', 'total_unrealized_pnl', 'total_realized_pnl', 'account_total_pnl',
+              'portfolio_radar', 'g1_rows', 'g2_rows', 'g3_rows', 'perf_metrics')
+DASH_EMPTY_ROWS = '<tr><td colspan="7" style="text-align:center; color:#565f89; padding: 20px;">暂无标的 / 正在初始化...</td></tr>'
+
+class DashboardRenderer:
+    """
+    【HUD 渲染器】模板只在 mtime 变化时重读，并一次性切成 [字面量, 槽位名, 字面量, ...]，每次渲染只做一次 join；
+    模板里没有 {perf_metrics} 槽位时，编译期在 </body> 前补一个。
+    各标的行片段按 _dashboard_row_key 缓存，只有价格/持仓/堆栈/止盈状态等输入变了的行才重建。
+    """
+    def __init__(self):
+        self._mtime = None
+        self._parts = None
+        self.rows = {}          # 标的 -> (输入键, 分组, 行 html)
+        self.rebuilt = 0        # 最近一次渲染实际重建的行数
+
+    def template(self):
+        path = research_path('config', 'dashboard_template.html')
+        try: mtime = path.stat().st_mtime
+        except OSError:
+            self._parts = self._mtime = None
+            return None
+        if self._parts is None or mtime != self._mtime:
+            self._parts = self.compile(path.read_text(encoding='utf-8'))
+            self._mtime = mtime
+        return self._parts
+
+    @staticmethod
+    def compile(text):
+        parts = re.split('\\{(' + '|'.join(DASH_SLOTS) + ')\\}', text)     # 奇数下标是槽位名
+        if 'perf_metrics' not in parts[1::2]:
+            tail = parts[-1]
+            k = tail.find('</body>')
+            parts[-1:] = [tail[:k], 'perf_metrics', tail[k:]] if k >= 0 else [tail, 'perf_metrics', '']
+        return parts
+
+    def row(self, context, symbol, state, position, price, pnl_metrics):
+        key = _dashboard_row_key(context, symbol, state, position, price, pnl_metrics)
+        hit = self.rows.get(symbol)
+        if hit is not None and hit[0] == key: return hit[1], hit[2]
+        group, html = _dashboard_row_html(context, symbol, state, position, price, pnl_metrics)
+        self.rows[symbol] = (key, group, html)
+        self.rebuilt += 1
+        return group, html
+
+    def render(self, values):
+        return ''.join(values.get(p, '') if i % 2 else p for i, p in enumerate(self._parts))
+
+DASHBOARD = DashboardRenderer()
+
+def render_dashboard(context):
+    """
+    HUD 面板 (后台报表线程)：context 为 _report_snapshot 快照。
+    汇总数值每次重算，行片段走 DASHBOARD 缓存，模板预编译后一次 join 写出。
+    """
     try:
-        all_metrics = {'group1': [], 'group2': [], 'group3': []}
+        if DASHBOARD.template() is None: return
+        DASHBOARD.rebuilt = 0
+        groups = ([], [], [])
         total_market_value = 0
         total_unrealized_pnl = 0
         total_realized_pnl = 0
-        
+
         portfolio_val = {'tech': 0, 'gold': 0, 'dividend': 0, 'other': 0}
         pnl_metrics = getattr(context, 'pnl_metrics', {})
-        intraday_metrics = getattr(context, 'intraday_metrics', {})
-        
+
         for symbol in context.symbol_list:
             if symbol not in context.state: continue
             state = context.state[symbol]
-            position = get_position(symbol)
-            
+            position = context.positions[symbol]
+
             price = context.last_valid_price.get(symbol, state['base_price'])
             if not is_valid_price(price): price = state['base_price']
-            
+
             pos_amt = position.amount
             market_value = pos_amt * price
             unrealized_pnl = (price - position.cost_basis) * pos_amt if position.cost_basis > 0 else 0
-            
+
             total_market_value += market_value
             total_unrealized_pnl += unrealized_pnl
             total_realized_pnl += pnl_metrics.get(symbol, {}).get('total_realized_pnl', 0)
-            
+
             name_str = dsym(context, symbol, style='short')
             if any(k in name_str for k in ['纳指', '标普', '科技', '互联']): portfolio_val['tech'] += market_value
             elif '黄金' in name_str: portfolio_val['gold'] += market_value
             elif any(k in name_str for k in ['红利', '低波', '收息']): portfolio_val['dividend'] += market_value
             else: portfolio_val['other'] += market_value
-            
-            config = getattr(context, 'symbol_config', {}).get(symbol, {})
-            tp_cool_weeks = state.get('tp_cool_weeks', config.get('tp_cool_weeks', 4))
-            min_weeks = state.get('tp_min_weeks', config.get('tp_min_weeks', 12))
-            min_val = state.get('tp_min_value', config.get('tp_min_value', 30000))
-            
-            trade_weeks = state.get('trade_week_set', set())
-            current_weeks = len(trade_weeks)
-            
-            tier = state.get('_tp_tier', 0)
-            hwm = state.get('_tp_hwm_ratio', 0.0)
-            profit_ratio = (price - position.cost_basis) / position.cost_basis if position.cost_basis > 0 else 0
-            atr = state.get('macro_atr_rate', 0.02)
-            if not isinstance(atr, (int, float)) or math.isnan(atr): atr = 0.02
-            
-            status_html = ""
-            radar_html = ""
-            if current_weeks < tp_cool_weeks and min_weeks < 999:
-                status_html = '<span class="badge badge-cooldown">❄️ 物理冷却期</span>'
-                radar_html = f'<div style="width:110px;"><span class="text-dim">静默断代 (余 {tp_cool_weeks - current_weeks} 周)</span></div>'
-            elif min_weeks >= 999:
-                status_html = '<span class="badge badge-safe">🟢 信仰长拿</span>'
-                radar_html = '<div style="width:110px;"><span class="text-dim">🔒 防线关闭</span></div>'
-            elif current_weeks < min_weeks and market_value < min_val:
-                status_html = '<span class="badge badge-seed">🌱 幼苗保护期</span>'
-                progress = min(100, int((current_weeks / min_weeks) * 100))
-                radar_html = f'<div style="width:110px;"><div class="progress-bg"><div class="progress-fill fill-seed" style="width: {progress}%;"></div></div><div class="text-dim" style="margin-top:4px;">养肥中 ({current_weeks}/{min_weeks}周)</div></div>'
-            elif tier > 0:
-                status_html = f'<span class="badge badge-alert">🔥 Tier {tier} 警戒!</span>'
-                drawdown = hwm - profit_ratio
-                limit = {1: 3.0 * atr, 2: 5.0 * atr, 3: 8.0 * atr}.get(tier, 0.05)
-                risk_pct = min(100, max(0, int((drawdown / limit) * 100)))
-                radar_html = f'<div style="width:110px;"><div class="progress-bg"><div class="progress-fill fill-alert" style="width: {risk_pct}%;"></div></div><div class="text-alert" style="margin-top:4px;">距回撤防线 {(limit - drawdown)*100:.1f}%</div></div>'
-            else:
-                status_html = '<span class="badge badge-safe">🟢 安全发育中</span>'
-                tp_threshold = 10.0 * atr
-                dist_pct = min(100, max(0, int((profit_ratio / tp_threshold) * 100))) if tp_threshold > 0 else 0
-                radar_html = f'<div style="width:110px;"><div class="progress-bg"><div class="progress-fill fill-safe" style="width: {dist_pct}%;"></div></div><div class="text-dim" style="margin-top:4px;">距触发一阶 {(tp_threshold - profit_ratio)*100:.1f}%</div></div>'
-
-            unit = state.get('grid_unit', 100)
-            base_pos = state.get('base_position', 0)
-            max_grids = state.get('max_grid_count', 12)
-            thresh_low = max(1, max_grids // 3)
-            thresh_high = max_grids - thresh_low
-            
-            current_bullets = max(0, (pos_amt - base_pos) / unit) if unit > 0 else 0
-            ammo_pct = min(100, int((current_bullets / max_grids) * 100)) if max_grids > 0 else 0
-            
-            if current_bullets <= thresh_low:
-                ammo_class, ammo_text = "fill-safe", f"{int(current_bullets)}/{max_grids} 浅水区"
-            elif current_bullets <= thresh_high:
-                ammo_class, ammo_text = "fill-alert", f"{int(current_bullets)}/{max_grids} 核心区"
-            else:
-                ammo_class, ammo_text = "fill-cooldown", f"{int(current_bullets)}/{max_grids} 深水警告"
-            
-            ammo_html = f'<div style="margin-bottom:4px; white-space:nowrap;"><div class="progress-bg" style="width:60px; display:inline-block; vertical-align:middle; margin-right:6px;"><div class="progress-fill {ammo_class}" style="width: {ammo_pct}%;"></div></div><span style="color:#9aa5ce; font-size:12px;">{ammo_text}</span></div><div style="color:#9aa5ce; font-size:11px; white-space:nowrap;">持仓:{int(pos_amt)}/底仓:{int(base_pos)}</div>'
 
-            grid_atr = state.get('grid_atr_rate')
-            grid_atr_disp = f"{grid_atr*100:.2f}%" if isinstance(grid_atr, (int, float)) and not math.isnan(grid_atr) and grid_atr > 0 else "N/A"
-            macro_val = state.get('macro_atr_rate')
-            macro_atr_disp = "N/A" if min_weeks >= 999 else (f"{macro_val*100:.2f}%" if isinstance(macro_val, (int, float)) and not math.isnan(macro_val) and macro_val > 0 else "N/A")
+            group, row = DASHBOARD.row(context, symbol, state, position, price, pnl_metrics)
+            groups[group].append(row)
+        for sym in [s for s in DASHBOARD.rows if s not in context.state]: del DASHBOARD.rows[sym]
 
-            symbol_name = dsym(context, symbol, style='long')
-            sym_id_js = symbol.replace('.', '_')
-            
-            symbol_html = f"<div style=\"cursor:pointer; color:#7aa2f7; font-weight:bold; font-size:14px; white-space:nowrap;\" onclick=\"toggleDrawer('{sym_id_js}')\">🔽 {symbol_name}</div><div style=\"color:#9aa5ce; font-size:11px; margin-left:22px; margin-top:2px; white-space:nowrap;\">定投: {current_weeks}周 | 网格: {int(state.get('grid_unit',0))}股</div>"
-
-            broker_total_pnl = getattr(position, 'total_pnl', None)
-            if broker_total_pnl is None:
-                local_realized = pnl_metrics.get(symbol, {}).get('total_realized_pnl', 0)
-                broker_total_pnl = unrealized_pnl + local_realized
-
-            real_grid_pnl = 0.0
-            cost_reduction = 0.0
-            if pos_amt > 0:
-                real_grid_pnl = _calculate_watermark_grid_pnl(context, symbol, price, pos_amt, broker_total_pnl)
-                base_q = state.get('base_position', 100)
-                cost_reduction = real_grid_pnl / base_q if base_q > 0 else 0.0
-
-            pnl_info = f"""
-            <span class="{'text-safe' if unrealized_pnl>=0 else 'text-alert'}">
-                浮盈: {unrealized_pnl:,.2f} <br> <b>{(profit_ratio*100):.2f}%</b>
-            </span><br>
-            <span style="color:#9ece6a; font-size:11px; font-weight:bold;">
-                💧网格: +{real_grid_pnl:,.2f}
-            </span><br>
-            <span style="color:#7dcfff; font-size:11px;">
-                🛡️降本: -{cost_reduction:.3f}
-            </span>
-            """
-
-            b_stack = state.get('buy_stack', [])
-            s_stack = state.get('sell_stack', [])
-            b_str = " | ".join([f"{p:.3f}({v}股)" for p, v in sorted(b_stack, key=lambda x: x[0], reverse=True)[:5]]) if b_stack else "无挂单 (下方真空)"
-            s_str = " | ".join([f"{-p:.3f}({v}股)" for p, v in sorted(s_stack, key=lambda x: x[0], reverse=True)[:5]]) if s_stack else "天空毫无阻力 (无套牢单)"
-            
-            d_base = state.get('dingtou_base', 0)
-            d_rate = state.get('dingtou_rate', 0)
-            acc_invest = sum(d_base * (1 + d_rate)**w for w in range(1, current_weeks + 1))
-            target_val = state.get('initial_position_value', 0) + acc_invest
-            
-            drawer_html = f"""
-            <td colspan="7" style="padding: 0; border: none; white-space: normal;">
-                <div id="drawer-{sym_id_js}" class="drawer-content" style="display: none; background: #1f2335; padding: 12px 15px; margin: 4px 10px 15px 10px; border-left: 3px solid #7aa2f7; border-radius: 4px; box-shadow: inset 0 2px 4px rgba(0,0,0,0.2);">
-                    <div style="color: #c0caf5; font-size: 13px; margin-bottom: 6px;"><b>🧱 堆栈微观阵地 (Stack Radar):</b></div>
-                    <div style="color: #f7768e; font-size: 12px; margin-left: 15px; margin-bottom: 4px;">🔴 <b>上方套牢阻力 (Sell Stack):</b> {s_str}</div>
-                    <div style="color: #9ece6a; font-size: 12px; margin-left: 15px; margin-bottom: 8px;">🟢 <b>下方网格支撑 (Buy Stack):</b> {b_str}</div>
-                    <div style="color: #c0caf5; font-size: 13px; margin-bottom: 6px;"><b>💧 VA 价值平均引擎 (Engine Status):</b></div>
-                    <div style="color: #7dcfff; font-size: 12px; margin-left: 15px;">实际累计投入: {acc_invest:,.2f} 元 &nbsp; | &nbsp; 理论应到价值: {target_val:,.2f} 元</div>
-                </div>
-            </td>
-            """
-
-            item = {
-                "symbol": symbol, "sym_id": sym_id_js,
-                "symbol_html": symbol_html, "status": status_html, "ammo": ammo_html,
-                "price_info": f"{position.cost_basis:.3f} / {price:.3f}", 
-                "pnl_info": pnl_info,
-                "atr_info": f"{grid_atr_disp} / <br>{macro_atr_disp}",
-                "radar": radar_html, "drawer_html": drawer_html
-            }
-            
-            if min_weeks >= 999: all_metrics['group1'].append(item)
-            elif min_weeks <= 12: all_metrics['group2'].append(item)
-            else: all_metrics['group3'].append(item)
-            
-        try:
-            if hasattr(context, 'portfolio') and context.portfolio:
-                portfolio_val['other'] += getattr(context.portfolio, 'available_cash', 0)
-        except Exception:
-            pass
+        portfolio_val['other'] += context.cash
 
         total_port = sum(portfolio_val.values()) or 1.0
         p_tech = portfolio_val['tech'] / total_port * 100
@@ -2555,28 +4242,346 @@ def generate_html_report(context):
         </div>
         """
             
-        template_file = research_path('config', 'dashboard_template.html')
-        if not template_file.exists(): return
-        html_template = template_file.read_text(encoding='utf-8')
-        
-        def render_table(items):
-            if not items: return '<tr><td colspan="7" style="text-align:center; color:#565f89; padding: 20px;">暂无标的 / 正在初始化...</td></tr>'
-            rows = ""
-            for m in items:
-                rows += f"<tr class=\"row-main\"><td>{m['symbol_html']}</td><td>{m['status']}</td><td>{m['ammo']}</td><td>{m['price_info']}</td><td>{m['pnl_info']}</td><td>{m['atr_info']}</td><td>{m['radar']}</td></tr>"
-                rows += f"<tr id=\"tr-drawer-{m['sym_id']}\" style=\"display:none; background:transparent;\">{m['drawer_html']}</tr>"
-            return rows
-
-        final_html = html_template.replace('{update_time}', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-        final_html = final_html.replace('{total_market_value}', f"{total_market_value:,.2f}")
-        final_html = final_html.replace('{total_unrealized_pnl}', f"{total_unrealized_pnl:,.2f}")
-        final_html = final_html.replace('{total_realized_pnl}', f"{total_realized_pnl:,.2f}")
-        final_html = final_html.replace('{account_total_pnl}', f"{(total_realized_pnl + total_unrealized_pnl):,.2f}")
-        final_html = final_html.replace('{portfolio_radar}', portfolio_html)
-        final_html = final_html.replace('{g1_rows}', render_table(all_metrics['group1']))
-        final_html = final_html.replace('{g2_rows}', render_table(all_metrics['group2']))
-        final_html = final_html.replace('{g3_rows}', render_table(all_metrics['group3']))
-
+        perf_html = PERF.render_html(context.run_cycle, context.perf) if StrategyConfig.PERF.ENABLE else ''
+        final_html = DASHBOARD.render({
+            'update_time': context.now.strftime("%Y-%m-%d %H:%M:%S"),
+            'total_market_value': f"{total_market_value:,.2f}",
+            'total_unrealized_pnl': f"{total_unrealized_pnl:,.2f}",
+            'total_realized_pnl': f"{total_realized_pnl:,.2f}",
+            'account_total_pnl': f"{(total_realized_pnl + total_unrealized_pnl):,.2f}",
+            'portfolio_radar': portfolio_html,
+            'g1_rows': ''.join(groups[0]) or DASH_EMPTY_ROWS,
+            'g2_rows': ''.join(groups[1]) or DASH_EMPTY_ROWS,
+            'g3_rows': ''.join(groups[2]) or DASH_EMPTY_ROWS,
+            'perf_metrics': perf_html,
+        })
         research_path('reports', 'strategy_dashboard.html').write_text(final_html, encoding='utf-8')
     except Exception as e:
-        log.error(f"⚠️ 生成 HUD 面板异常: {e}")
\ No newline at end of file
+        log.error(f"⚠️ 生成 HUD 面板异常: {e}")
+
+# ---------------- 面板数据源 (JSON Feed) ----------------
+
+FEED_COLS = ('price', 'position', 'base_position', 'grid_pnl', 'tp_ratio')     # 日内序列每个点的字段顺序
+
+DASH_LIVE_PAGE = r"""<!doctype html>
+<html><head><meta charset="utf-8"><title>vagird 实时面板</title>
+<style>
+body{background:#1a1b26;color:#a9b1d6;font:13px/1.6 Consolas,"Microsoft YaHei",monospace;margin:20px}
+h3{color:#c0caf5;margin:0 0 8px}#meta,#legend{color:#565f89}#totals{margin:8px 0 12px}#totals b{color:#e0af68;margin-right:18px}
+#chart{width:100%;height:220px;background:#16161e;border-radius:6px}
+table{border-collapse:collapse;width:100%;margin-top:12px}td,th{padding:4px 8px;border-bottom:1px solid #24283b;text-align:right}
+th{color:#7aa2f7}td:first-child,th:first-child{text-align:left}tr{cursor:pointer}tr.sel{background:#24283b}.up{color:#f7768e}.dn{color:#9ece6a}
+</style></head><body>
+<h3>vagird 实时面板 <span id="meta">等待数据...</span></h3>
+<div id="totals"></div>
+<svg id="chart" viewBox="0 0 1000 220" preserveAspectRatio="none"></svg><div id="legend"></div>
+<table><thead><tr><th>标的</th><th>现价</th><th>持仓</th><th>底仓</th><th>成本</th><th>浮盈</th><th>已实现</th><th>网格利润</th><th>止盈浮盈率</th><th>档位</th></tr></thead>
+<tbody id="rows"></tbody></table>
+<script>
+const POLL_MS = 5000;
+const FIELDS = [['price',3],['position',0],['base_position',0],['cost',3],['unrealized',2],['realized',2],['grid_pnl',2],['tp_ratio',-1],['tp_tier',0]];
+const TOTALS = [['market_value','总市值'],['unrealized','浮动盈亏'],['realized','已实现'],['total_pnl','合计盈亏'],['cash','可用现金']];
+let last = {}, stamp = null, sel = null, series = {file: null, bytes: 0, buf: '', pts: {}};
+const $ = id => document.getElementById(id);
+const fmt = (v, d) => v == null ? '-' : d < 0 ? (v * 100).toFixed(2) + '%' :
+  Number(v).toLocaleString(undefined, {minimumFractionDigits: d, maximumFractionDigits: d});
+
+function row(sym, r) {                       // 只改动值变化了的单元格
+  let tr = $('r-' + sym);
+  if (!tr) {
+    tr = document.createElement('tr'); tr.id = 'r-' + sym; tr.onclick = () => { sel = sym; draw(); };
+    tr.innerHTML = '<td></td>' + FIELDS.map(() => '<td></td>').join('');
+    tr.cells[0].textContent = r.name || sym; $('rows').appendChild(tr);
+  }
+  const prev = last[sym] || {};
+  FIELDS.forEach(([k, d], i) => {
+    if (prev[k] === r[k]) return;
+    const td = tr.cells[i + 1]; td.textContent = fmt(r[k], d);
+    if (k === 'price' && prev[k] != null) td.className = r[k] > prev[k] ? 'up' : r[k] < prev[k] ? 'dn' : '';
+  });
+}
+
+async function pullSeries(doc) {             // 序列只追加：按已读字节数增量拉取 (服务器不支持 Range 时本地截取)
+  if (doc.series !== series.file) series = {file: doc.series, bytes: 0, buf: '', pts: {}};
+  if (!doc.series || doc.series_bytes <= series.bytes) return false;
+  const res = await fetch(doc.series, {cache: 'no-store', headers: {Range: 'bytes=' + series.bytes + '-'}});
+  let text = await res.text();
+  if (res.status !== 206) text = text.slice(series.bytes);
+  series.bytes += text.length;              // 序列文件是纯 ASCII，字符数即字节数
+  const lines = (series.buf + text).split('\n'); series.buf = lines.pop();
+  for (const line of lines) {
+    if (!line) continue;
+    const p = JSON.parse(line);
+    for (const [sym, v] of Object.entries(p.d)) (series.pts[sym] = series.pts[sym] || []).push([p.t.slice(11), ...v]);
+  }
+  return true;
+}
+
+function draw() {
+  for (const tr of $('rows').rows) tr.classList.toggle('sel', tr.id === 'r-' + sel);
+  const pts = series.pts[sel] || [];
+  const line = (col, color) => {
+    const v = pts.map(p => p[col]), lo = Math.min(...v), span = (Math.max(...v) - lo) || 1;
+    return '<polyline fill="none" stroke="' + color + '" stroke-width="2" vector-effect="non-scaling-stroke" points="' +
+      v.map((x, i) => (pts.length > 1 ? i * 1000 / (pts.length - 1) : 500).toFixed(1) + ',' + (210 - (x - lo) / span * 200).toFixed(1)).join(' ') + '"/>';
+  };
+  $('chart').innerHTML = pts.length ? line(1, '#ff9e64') + line(4, '#7aa2f7') : '';
+  $('legend').textContent = pts.length ? (last[sel] ? last[sel].name : sel) + '  ' + pts[0][0] + ' – ' + pts[pts.length - 1][0] +
+    '  橙 = 价格  蓝 = 网格利润  (' + pts.length + ' 点)' : '';
+}
+
+async function poll() {
+  try {
+    const doc = await (await fetch('dashboard.json', {cache: 'no-store'})).json();
+    if (doc.update_time !== stamp) {
+      stamp = doc.update_time;
+      $('meta').textContent = '更新于 ' + doc.update_time;
+      $('totals').innerHTML = TOTALS.map(([k, label]) => label + ' <b>' + fmt(doc.totals[k], 2) + '</b>').join('');
+      for (const [sym, r] of Object.entries(doc.symbols)) row(sym, r);
+      for (const tr of [...$('rows').rows]) if (!(tr.id.slice(2) in doc.symbols)) tr.remove();
+      last = doc.symbols;
+      if (!(sel in last)) sel = Object.keys(last)[0] || null;
+      await pullSeries(doc); draw();
+    }
+  } catch (e) { $('meta').textContent = '数据源暂不可用: ' + e; }
+  setTimeout(poll, POLL_MS);
+}
+poll();
+</script></body></html>
+"""
+
+class DashboardFeed:
+    """
+    【面板数据源】后台报表线程在快照上写 (research_path/reports 下):
+      dashboard.json          最新一帧 (汇总 + 各标的数值)，tmp + replace 原子替换；
+      series/<日期>.jsonl      日内序列，按 REPORT.SERIES_MIN 分桶降采样、只追加，一桶一行:
+                              {"t":"2026-03-02 10:35","d":{"510300.SS":[价格,持仓,底仓,网格利润,止盈浮盈率],...}}
+    静态页 dashboard_live.html 每个进程写出一次；浏览器轮询 dashboard.json、按字节偏移增量拉序列，只改动变化的单元格。
+    """
+    def __init__(self):
+        self.day = None
+        self.bucket = None          # 当日最后写入的时间桶 "YYYY-MM-DD HH:MM"
+        self.page_ok = False
+        self.points = 0
+
+    @staticmethod
+    def _recover(path):
+        """盘中重启：截掉崩溃留下的半行，并从尾行恢复最后一个时间桶，同一桶不重复写。"""
+        try:
+            with open(path, 'r+b') as f:
+                size = f.seek(0, 2)
+                f.seek(max(0, size - 65536))
+                tail = f.read()
+                cut = tail.rfind(b'\n') + 1
+                if cut < len(tail):
+                    f.truncate(size - len(tail) + cut)
+                    tail = tail[:cut]
+            lines = tail.split(b'\n')
+            return json.loads(lines[-2])['t'] if len(lines) > 1 else None
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def rows(snap):
+        """各标的数值 (与 HUD 主行同口径)，以及组合汇总。"""
+        rows, pnl_metrics = {}, snap.pnl_metrics or {}
+        totals = dict.fromkeys(('market_value', 'unrealized', 'realized'), 0.0)
+        for sym in snap.symbol_list:
+            st, pos = snap.state[sym], snap.positions[sym]
+            price = snap.last_valid_price.get(sym, st['base_price'])
+            if not is_valid_price(price): price = st['base_price']
+            cost = pos.cost_basis
+            unrealized = (price - cost) * pos.amount if cost > 0 else 0.0
+            realized = pnl_metrics.get(sym, {}).get('total_realized_pnl', 0) or 0.0
+            cfg = snap.symbol_config.get(sym, {})
+            min_weeks = st.get('tp_min_weeks', cfg.get('tp_min_weeks', 12))
+            rows[sym] = {
+                'name': dsym(snap, sym, style='short'), 'group': 0 if min_weeks >= 999 else (1 if min_weeks <= 12 else 2),
+                'price': round(price, 3), 'position': pos.amount, 'base_position': st.get('base_position', 0),
+                'cost': round(cost, 3), 'market_value': round(pos.amount * price, 2), 'unrealized': round(unrealized, 2),
+                'realized': round(realized, 2), 'grid_pnl': round(st.get('wm_pnl', 0.0) or 0.0, 2),
+                'tp_ratio': round((price - cost) / cost, 4) if cost > 0 else 0.0,
+                'tp_hwm': round(st.get('_tp_hwm_ratio', 0.0) or 0.0, 4), 'tp_tier': st.get('_tp_tier', 0) or 0,
+                'weeks': len(st.get('trade_week_set', ())), 'buy_stack': len(st.get('buy_stack', ())),
+                'sell_stack': len(st.get('sell_stack', ())),
+            }
+            totals['market_value'] += pos.amount * price
+            totals['unrealized'] += unrealized
+            totals['realized'] += realized
+        totals = {k: round(v, 2) for k, v in totals.items()}
+        totals['total_pnl'] = round(totals['unrealized'] + totals['realized'], 2)
+        totals['cash'] = round(snap.cash, 2)
+        return rows, totals
+
+    def publish(self, snap):
+        now = snap.now
+        day = now.strftime('%Y-%m-%d')
+        series = research_path('reports', 'series', f'{day}.jsonl')
+        if day != self.day:
+            self.day, self.bucket = day, self._recover(series)
+        rows, totals = self.rows(snap)
+
+        n = StrategyConfig.REPORT.SERIES_MIN
+        m = (now.hour * 60 + now.minute) // n * n
+        bucket = f'{day} {m // 60:02d}:{m % 60:02d}'
+        if rows and (self.bucket is None or bucket > self.bucket):
+            point = {'t': bucket, 'd': {sym: [r[c] for c in FEED_COLS] for sym, r in rows.items()}}
+            with open(series, 'ab') as f:
+                f.write(json.dumps(point, separators=(',', ':')).encode('ascii') + b'\n')
+            self.bucket = bucket
+            self.points += 1
+
+        try: series_bytes = series.stat().st_size
+        except OSError: series_bytes = 0
+        doc = {'update_time': now.strftime('%Y-%m-%d %H:%M:%S'), 'totals': totals, 'cols': FEED_COLS,
+               'series': f'series/{day}.jsonl', 'series_bytes': series_bytes, 'symbols': rows}
+        path = research_path('reports', 'dashboard.json')
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_text(json.dumps(doc, ensure_ascii=False, separators=(',', ':')), encoding='utf-8')
+        tmp.replace(path)
+
+        if not self.page_ok:
+            page = research_path('reports', 'dashboard_live.html')
+            try: same = page.read_text(encoding='utf-8') == DASH_LIVE_PAGE
+            except OSError: same = False
+            if not same: page.write_text(DASH_LIVE_PAGE, encoding='utf-8')
+            self.page_ok = True
+
+FEED = DashboardFeed()
+
+def _report_dashboard(snap):
+    """面板任务：先写 JSON 数据源 (几 KB)，再按 REPORT.HTML 决定是否服务端渲染整页。"""
+    if StrategyConfig.REPORT.FEED:
+        try: FEED.publish(snap)
+        except Exception as e: info('⚠️ 面板数据源写出异常: {}', e)
+    if StrategyConfig.REPORT.HTML: render_dashboard(snap)
+
+# ---------------- 后台报表线程 (Report Worker) ----------------
+
+def _report_snapshot(context):
+    """
+    【报表快照】交易线程上只做浅拷贝：各标的 state 复制一层 (堆栈/定投周集合另拷)，持仓抄成只读三元组，
+    价格/配置/PnL 取当前引用 (它们只会被整体替换，不会原地修改)。
+    水位线网格利润会改写持久化的 wm_map/wm_pnl，仍在这里按原口径推进，状态演化与报表线程进度无关。
+    """
+    own_view = not ACCOUNT.active
+    if own_view: ACCOUNT.begin(context.symbol_list)
+    try:
+        pnl_metrics = getattr(context, 'pnl_metrics', {})
+        states, positions = {}, {}
+        for sym in context.symbol_list:
+            if sym not in context.state: continue
+            st = context.state[sym]
+            pos = ACCOUNT.position(sym)
+            total_pnl = getattr(pos, 'total_pnl', None)
+            if pos.amount > 0:
+                price = context.last_valid_price.get(sym, st['base_price'])
+                if not is_valid_price(price): price = st['base_price']
+                broker_total_pnl = total_pnl
+                if broker_total_pnl is None:
+                    unrealized = (price - pos.cost_basis) * pos.amount if pos.cost_basis > 0 else 0
+                    broker_total_pnl = unrealized + pnl_metrics.get(sym, {}).get('total_realized_pnl', 0)
+                _calculate_watermark_grid_pnl(context, sym, price, pos.amount, broker_total_pnl)
+            snap = {k: v for k, v in st.items() if k != 'wm_map'}
+            snap['buy_stack'], snap['sell_stack'] = st['buy_stack'].copy(), st['sell_stack'].copy()
+            snap['trade_week_set'] = set(st.get('trade_week_set', ()))
+            states[sym] = snap
+            positions[sym] = SimpleNamespace(amount=pos.amount, cost_basis=pos.cost_basis, total_pnl=total_pnl)
+    finally:
+        if own_view: ACCOUNT.end()
+    try: cash = getattr(context.portfolio, 'available_cash', 0) if getattr(context, 'portfolio', None) else 0
+    except Exception: cash = 0
+    return SimpleNamespace(
+        symbol_list=list(states), state=states, positions=positions,
+        last_valid_price=dict(context.last_valid_price), symbol_config=getattr(context, 'symbol_config', {}),
+        symbol_name_map=getattr(context, 'symbol_name_map', {}), pnl_metrics=pnl_metrics,
+        pnl_metrics_path=getattr(context, 'pnl_metrics_path', None), cash=cash or 0,
+        run_cycle=getattr(context, 'run_cycle', 60) or 60, current_dt=context.current_dt, now=CLOCK.now(),
+        perf=PERF.last if StrategyConfig.PERF.ENABLE else None)
+
+def _report_pnl(context, snap):
+    """在快照上增量记账，结果整体替换回 context.pnl_metrics (引用赋值，交易线程读到的总是完整字典)。"""
+    _calculate_local_pnl_lifo(snap)
+    context.pnl_metrics = snap.pnl_metrics
+
+def _report_pre_market(context, snap):
+    try: _report_pnl(context, snap)
+    except Exception as e: info('⚠️ PnL 补算遇到轻微错误: {} (后续会重试)', e)
+    _report_dashboard(snap)
+
+def _report_post_market(context, snap):
+    try: _report_pnl(context, snap)
+    except Exception as e: info('⚠️ 盘后 PnL 记账异常: {}', e)
+    try: update_daily_reports(snap)
+    except Exception as e: info('⚠️ 日报 CSV 写出异常: {}', e)
+    _report_dashboard(snap)
+
+class ReportWorker:
+    """
+    【后台报表线程】PnL 记账、HUD 渲染、日报 CSV 都在快照上执行，交易回调只负责取快照和入队。
+    同类任务尚未开工时新快照直接顶替旧的 (面板只需要最新一帧)；REPORT.ASYNC 关闭或线程起不来时原地同步执行。
+    """
+    def __init__(self):
+        self._cv = threading.Condition()
+        self._jobs = deque()        # (类型, 函数, 参数)
+        self._thread = None
+        self.busy = False
+        self.done = 0
+        self.coalesced = 0
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive(): return True
+        try:
+            self._thread = threading.Thread(target=self._loop, name='vagird-report', daemon=True)
+            self._thread.start()
+            return True
+        except Exception:
+            self._thread = None
+            return False
+
+    def submit(self, kind, fn, *args):
+        if not (StrategyConfig.REPORT.ASYNC and self._start()):
+            return self._run(kind, fn, args)
+        with self._cv:
+            for i, job in enumerate(self._jobs):
+                if job[0] == kind:
+                    self._jobs[i] = (kind, fn, args)
+                    self.coalesced += 1
+                    break
+            else:
+                self._jobs.append((kind, fn, args))
+            self._cv.notify_all()
+
+    def wait(self, timeout=None):
+        """等待队列清空且当前任务完成；返回是否按时完成。"""
+        with self._cv:
+            return self._cv.wait_for(lambda: not self._jobs and not self.busy, timeout)
+
+    def _run(self, kind, fn, args):
+        try: fn(*args)
+        except Exception as e: info('⚠️ [Report] {} 任务异常: {}', kind, e)
+        self.done += 1
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._jobs)
+                kind, fn, args = self._jobs.popleft()
+                self.busy = True
+            try: self._run(kind, fn, args)
+            finally:
+                with self._cv:
+                    self.busy = False
+                    self._cv.notify_all()
+
+REPORTER = ReportWorker()
+
+def _report_shutdown():
+    try: REPORTER.wait(StrategyConfig.REPORT.DRAIN_SEC)
+    except Exception: pass
+
+atexit.register(_report_shutdown)
+
+def generate_html_report(context):
+    """取快照 (交易线程) 并把面板数据源 / HUD 渲染交给后台报表线程。"""
+    REPORTER.submit('dashboard', _report_dashboard, _report_snapshot(context))